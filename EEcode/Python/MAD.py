@@ -1,7 +1,6 @@
 import ee
-from stats import chi_p
+from stats import chi_p, mode_reducer
 
-ee.Initialize()
 #function paramaterizing a gamma distribution from data, and returning p-values of observations
 #param chi: image of chi-square statistics, or other values following a gamma distribution
 #param aoi: geometry object defining area of analisys
@@ -20,7 +19,7 @@ def gamma(chi, aoi, scl):
         ee.Image: single band ['p']
     """
     mode = chi.reduceRegion(
-      reducer = ee.Reducer.mode(),
+      reducer = mode_reducer(),
       geometry = aoi,
       scale = scl,
       maxPixels = 1e13
@@ -95,9 +94,25 @@ def correlate(x, y, aoi):
             ).get('correlation')
     return cor
 
+def cov_to_cor(cov):
+    """
+    Convert a covariance matrix to a correlation matrix
+
+    Parameters:
+        cov (ee.Array): N x N covariance matrix
+
+    Returns:
+        ee.Array: N x N correlation matrix
+    """
+    sd = cov.matrixDiagonal().sqrt()
+    return cov.divide(sd.matrixMultiply(sd.matrixTranspose()))
+
 def corrmat(set1, set2, aoi):
     """
     Compute a correlation matrix between two sets of variables
+
+    The joint covariance of all n + m bands is computed in a single
+    reduction, rather than one pearsonsCorrelation reduction per band pair.
     
     Parameters:
         set1 (ee.Image): image with n bands equal to first set of variables
@@ -108,13 +123,17 @@ def corrmat(set1, set2, aoi):
         ee.Array: n x m array containing correlation coefficients between
         variables in set1 and set2
     """
-    emptylist = ee.List([])
-    xbands = set1.bandNames()
-    ybands = set2.bandNames()
-    ylen = len(ybands)
-    cors = [correlate(set1.select(x), set2.select(y), aoi) for x in xbands for y in ybands]
-    nestedcors = [cors[i:i+ylen] for i in range(0, len(cors), ylen)]
-    return ee.Array(nestedcors)
+    n = set1.bandNames().length()
+    # concatenate as arrays so matching band names in set1 and set2 don't collide
+    joint = set1.toArray().arrayCat(set2.toArray(), 0)
+    cov = ee.Array(joint.reduceRegion(
+            reducer = ee.Reducer.covariance(),
+            geometry = aoi,
+            scale = 100,
+            maxPixels = 1e13,
+            tileScale = 4
+            ).get('array'))
+    return cov_to_cor(cov).slice(0, 0, n).slice(1, n)
 # =============================================================================
 #   old javascript way of creating a correlation matrix
 #   xs = xbands.iterate(function(xband, list){
@@ -147,6 +166,9 @@ def corrmat(set1, set2, aoi):
 def wCorrmat(set1, set2, aoi, weights):
     """
     Compute a correlation matrix between two sets of variables
+
+    The weighted joint covariance of all n + m bands is computed in a single
+    reduction, from the second moments of sqrt(weights) * [1, set1, set2].
     
     Parameters:
         set1 (ee.Image): image with n bands equal to first set of variables
@@ -160,49 +182,28 @@ def wCorrmat(set1, set2, aoi, weights):
     
     weights = weights.clip(aoi)
     
-    b1 = weights.bandNames().get(0)
-    
     n = set1.bandNames().length()
     
-    img = set1.addBands(set2)
-    
-    weightsImage = img.multiply(ee.Image.constant(0).add(weights)) 
-  
-    N = img.bandNames().length()
-  
-    xbands = ee.List(img.bandNames().slice(0, n))
-
-    ybands = ee.List(img.bandNames().slice(n, N))
-
-    sumWeights = ee.Number(weights.reduceRegion(
-        reducer = ee.Reducer.sum(),
-        geometry = aoi,
-        scale = 10,
-        tileScale = 4,
-        maxPixels = 1e13).get(b1))
+    joint = ee.Image(1).toArray()\
+    .arrayCat(set1.toArray(), 0)\
+    .arrayCat(set2.toArray(), 0)\
+    .multiply(weights.sqrt())
     
-    nPixels = ee.Number(weights.reduceRegion(
-        reducer = ee.Reducer.count(),
-        geometry = aoi,
-        scale = 10,
-        tileScale = 4,
-        maxPixels = 1e13).get(b1))
-
-    means = img.addBands(weightsImage).reduceRegion(
-            reducer = ee.Reducer.mean().repeat(N).splitWeights(),
+    # uncentered moments: [0, 0] ~ sum(w), [1:, 0] ~ sum(w x), [1:, 1:] ~ sum(w x x')
+    # all share the same scale, which cancels in the correlation
+    moments = ee.Array(joint.reduceRegion(
+            reducer = ee.Reducer.centeredCovariance(),
             geometry = aoi,
             scale = 100,
-            maxPixels = 1e13
-            ).toArray().project([1])
-
-    centered = img.toArray().subtract(means)
-  
-    weighted = img.multiply(weights.sqrt())
-  
-    cors = [correlate(set1.select(x), set2.select(y), aoi) for x in xbands for y in ybands]
-    nestedcors = [cors[i:i+ylen] for i in range(0, len(cors), ylen)]
-    corw = ee.Array(nestedcors).multiply(nPixels).divide(sumWeights)
-    return corw
+            maxPixels = 1e13,
+            tileScale = 4
+            ).get('array'))
+    
+    sumWeights = moments.get([0, 0])
+    sums = moments.slice(0, 1).slice(1, 0, 1)
+    cov = moments.slice(0, 1).slice(1, 1)\
+    .subtract(sums.matrixMultiply(sums.matrixTranspose()).divide(sumWeights))
+    return cov_to_cor(cov).slice(0, 0, n).slice(1, n)
 # =============================================================================
 #   xs = xbands.map(function(xbnd){
 #     ys = ybands.map(function(ybnd){
@@ -313,9 +314,9 @@ def iw_mad(current, prev):
   cvs = ee.Image(cca.get('img'))
   ccachi = chisq(cvs, aoi, 100)
   updates = ee.Array(cca.get('rhos'))
-  net = updates.sort()
-    .subtract(rhos).abs()
-    .reduce(ee.Reducer.max(), [0])
+  net = updates.sort()\
+    .subtract(rhos).abs()\
+    .reduce(ee.Reducer.max(), [0])\
     .get([0,0])
   converged = net.lte(0.01)
   result = ee.Dictionary({
@@ -330,42 +331,10 @@ def iw_mad(current, prev):
 
 #Function to perform iterative reweighting and MAD transformations
 #param niter: number of iterations
-#Returns output same as mad()
-def mad_iw(before, after, aoi):
-  cca = mad(before, after, aoi, ee.Image(1))
-  net = rho.subtract(cca.get('rho'))
-
-  while net > 0.001:
-    ps = cca.select(['p']).sqrt()
-
-    sumWeights = ee.Number(ps.reduceRegion(
-      reducer = ee.Reducer.sum(),
-      geoetry = aoi,
-      scale = 10,
-      maxPixels = 1e13).get('p'))
-   
-
-# =============================================================================
-#     nPixels = ps.reduceRegion(
-#       reducer = ee.Reducer.count(),
-#       geometry = aoi,
-#       scale = 10,
-#       maxPixels = 1e13).get('p')
-# =============================================================================
-
-    weights = ee.Image.constant(count).divide(ee.Image.constant(sumweight)).multiply(ps)
-    
-    #This version will apply new weights to previously re-weighted images
-    #before = before.multiply(weights)
-    #after = after.multiply(weights)
-    #cca = mad(before, after, geometry, 30)
-    #This version will apply new weights to original images each iteration
-    b = before#.multiply(ps)
-    a = after#.multiply(ps)
-    cca = mad(b, a, aoi, ps)
-    net++
-  
-  return cca
+#Returns ee.Dictionary output of madw() after the last (or converged) iteration
+def mad_iw(before, after, aoi, niter=10):
+  first = madw(before, after, aoi, ee.Image(1))
+  return ee.Dictionary(ee.List.sequence(1, niter).iterate(iw_mad, first))
 
 def runMAD(before, after, aoi, ag):
     """
@@ -390,18 +359,18 @@ def runMAD(before, after, aoi, ag):
     past = before.median().clip(aoi)
       
     recent = ee.Image(
-      ee.Algorithms.If(ag == 'yes', recent.updateMask(agMask.and(demMask)), recent.updateMask(demMask))
+      ee.Algorithms.If(ag == 'yes', recent.updateMask(agMask.And(demMask)), recent.updateMask(demMask))
       )
     past = ee.Image(
-      ee.Algorithms.If(ag == 'yes', past.updateMask(agMask.and(demMask)), past.updateMask(demMask))
+      ee.Algorithms.If(ag == 'yes', past.updateMask(agMask.And(demMask)), past.updateMask(demMask))
       )
       
-    mad = mad(past, recent, aoi, 100)
-    chi = chisq(mad, aoi, 100)
+    # mad() already appends the chi square and p bands
+    madout = mad(past, recent, aoi)
     #  mad = ee.List.sequence(1, 10).iterate(iw_mad, madw(past, recent, aoi, ee.Image(1)))
     #  madout = ee.Image(ee.Dictionary(mad).get('img'))
     #  return madout
-    return mad.addBands(chi)
+    return madout
 
 #EXAMPLE
 # =============================================================================
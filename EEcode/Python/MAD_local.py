@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Local NumPy implementation of the iteratively re-weighted MAD algorithm
+
+Mirrors MAD_mc.py for imagery already on disk. The input image is a
+dictionary of 2n bands: the n 'before' bands followed by the n 'after'
+bands. Masked pixels are NaN and are excluded from all statistics.
+"""
+
+import numpy as np
+from scipy.linalg import solve_triangular
+from scipy.special import gammainc
+import stats_local
+
+def chi2cdf(chi2, df):
+    """
+    Chi square cumulative distribution function
+    """
+    return gammainc(df / 2, chi2 / 2)
+
+def chisq(img):
+    """
+    Compute the chi square statistic and p-value from an image as the sum
+    of squared differences in pixels from band means, as MAD.chisq does
+
+    Parameters:
+        img (dict): multiband image
+
+    Returns:
+        dict: bands ['chi', 'p']
+    """
+    stack = np.stack(list(img.values()))
+    mean, sd = stats_local.band_stats(stack)
+    chi = np.square((stack - mean[:, None, None]) / sd[:, None, None]).sum(axis=0)
+    return {'chi': chi, 'p': 1 - chi2cdf(chi, len(img))}
+
+def covarw(X, weights):
+    """
+    Return the weighted centered pixels and their weighted covariance matrix
+
+    The weighted means and second moments are computed together in a single
+    matrix product over the pixels augmented with a column of ones.
+
+    Parameters:
+        X (np.ndarray): (pixels, bands) array of unmasked pixel values
+        weights (np.ndarray): (pixels,) array of per pixel weights
+
+    Returns:
+        tuple: (centered (pixels, bands) array, (bands, bands) covariance)
+    """
+    nPix, N = X.shape
+    aug = np.empty((nPix, N + 1))
+    aug[:, :N] = X
+    aug[:, N] = 1
+    moments = (aug * weights[:, None]).T @ aug
+    sumWeights = moments[N, N]
+    means = moments[N, :N] / sumWeights
+    # centered covariance, scaled as in MAD_mc.covarw (n - 1 denominator,
+    # multiplied by nPixels / sumWeights)
+    scatter = moments[:N, :N] - sumWeights * np.outer(means, means)
+    covw = scatter / (nPix - 1) * nPix / sumWeights
+    return X - means, covw
+
+def corrmat(set1, set2, weights=None):
+    """
+    Compute a (weighted) correlation matrix between two sets of variables
+
+    Mirrors MAD.corrmat and MAD.wCorrmat: the joint covariance of all
+    n + m bands comes from the single matrix product in covarw.
+
+    Parameters:
+        set1 (dict): image with n bands equal to first set of variables
+        set2 (dict): image with m bands equal to second set of variables
+        weights (np.ndarray): optional 2D array of per pixel weights
+
+    Returns:
+        np.ndarray: n x m array of correlation coefficients between
+        variables in set1 and set2
+    """
+    n = len(set1)
+    stack = np.stack(list(set1.values()) + list(set2.values()))
+    X = stack.reshape(stack.shape[0], -1).T
+    w = np.ones(X.shape[0]) if weights is None else np.ravel(weights).astype(float)
+    valid = np.isfinite(X).all(axis=1) & np.isfinite(w)
+    _, cov = covarw(X[valid], w[valid])
+    sd = np.sqrt(np.diag(cov))
+    return (cov / np.outer(sd, sd))[:n, n:]
+
+def geneiv(C, B):
+    """
+    Generalized eigenproblem C*X = lambda*B*X
+
+    Parameters:
+        C (np.ndarray): symmetric matrix
+        B (np.ndarray): symmetric positive definite matrix
+
+    Returns:
+        tuple: (eigenvalues in increasing order, generalized eigenvectors
+        as columns)
+    """
+    # Li = choldc(B)^-1
+    L = np.linalg.cholesky(B)
+    Li = solve_triangular(L, np.eye(L.shape[0]), lower=True)
+    # solve symmetric eigenproblem Li*C*Li^T*x = lambda*x
+    lambdas, X = np.linalg.eigh(Li @ C @ Li.T)
+    # generalized eigenvectors as columns, Li^T*X
+    return lambdas, Li.T @ X
+
+def imad1(X, chi2, lastrhos):
+    """
+    One iteration of the iteratively re-weighted MAD
+
+    Parameters:
+        X (np.ndarray): (pixels, 2n) array of before and after pixel values
+        chi2 (np.ndarray): (pixels,) chi square values from the previous
+        iteration
+        lastrhos (np.ndarray): canonical correlations from the previous
+        iteration
+
+    Returns:
+        tuple: (done, rhos, MAD (pixels, n) array, chi2 (pixels,) array)
+    """
+    nBands = X.shape[1] // 2
+    weights = 1 - chi2cdf(chi2, nBands)
+    centered, covw = covarw(X, weights)
+    s11 = covw[:nBands, :nBands]
+    s22 = covw[nBands:, nBands:]
+    s12 = covw[:nBands, nBands:]
+    s21 = covw[nBands:, :nBands]
+    c1 = s12 @ np.linalg.solve(s22, s21)
+    c2 = s21 @ np.linalg.solve(s11, s12)
+    # solution of generalized eigenproblems, already in increasing order
+    lambdas, A = geneiv(c1, s11)
+    _, B = geneiv(c2, s22)
+    rhos = np.sqrt(np.clip(lambdas, 0, None))
+    # test for convergence
+    done = np.max(np.abs(rhos - lastrhos)) < 0.001
+    # MAD variances
+    sigma2s = (1 - rhos) * 2
+    # ensure sum of positive correlations between X and U is positive
+    s = (np.diag(1 / np.sqrt(np.diag(s11))) @ s11 @ A).sum(axis=0)
+    A = A * np.sign(s)
+    # ensure positive correlation
+    B = B * np.sign(np.diag(A.T @ s12 @ B))
+    # canonical and MAD variates
+    U = centered[:, :nBands] @ A
+    V = centered[:, nBands:] @ B
+    MAD = U - V
+    # chi square image
+    chi2 = (np.square(MAD) / sigma2s).sum(axis=1)
+    return done, rhos, MAD, chi2
+
+def imad(image, niters):
+    """
+    Run the iteratively re-weighted MAD until convergence or niters
+
+    Parameters:
+        image (dict): 2n bands, n 'before' bands followed by n 'after' bands
+        niters (int): maximum number of iterations
+
+    Returns:
+        dict: 'done', 'MAD' (dict of n bands named after the 'before' bands),
+        'chi2', 'allrhos' and 'niter', the number of iterations run
+    """
+    bands = list(image)
+    nBands = len(bands) // 2
+    stack = np.stack([image[band] for band in bands])
+    shape = stack.shape[1:]
+    valid = np.isfinite(stack).all(axis=0).ravel()
+    X = stack.reshape(len(bands), -1)[:, valid].T
+
+    allrhos = [list(np.arange(1, nBands + 1, dtype=float))]
+    chi2 = np.ones(X.shape[0])
+    MAD = np.zeros((X.shape[0], nBands))
+    done = False
+    niter = 0
+    while not done and niter < niters:
+        done, rhos, MAD, chi2 = imad1(X, chi2, np.array(allrhos[-1]))
+        allrhos.append(list(rhos))
+        niter += 1
+
+    def unflatten(values):
+        out = np.full(valid.size, np.nan)
+        out[valid] = values
+        return out.reshape(shape)
+
+    return {'done': done,
+            'MAD': {band: unflatten(MAD[:, i]) for i, band in enumerate(bands[:nBands])},
+            'chi2': unflatten(chi2),
+            'allrhos': allrhos,
+            'niter': niter}
@@ -7,7 +7,6 @@ Created on Mon Dec  9 14:56:04 2019
 
 import ee
 
-ee.Initialize()
 #util = require('users/mortcanty/changedetection:utilities')
 # ****************************
 # Modules for IR-MAD algorithm
@@ -2,20 +2,53 @@ import ee
 
 from datetime import datetime
 import clouds
+import instrument
 import iw
 import MAD_mc
+import session
 import stats
 import terrain
 import sys
 import os
 
-# Initialize Earth Engine
-#ee.Initialize()
+# Earth Engine is initialized by session on first use
+CDL = session.asset('Image', "USDA/NASS/CDL/2019")
+S2 = session.asset('ImageCollection', "COPERNICUS/S2")
+SR = session.asset('ImageCollection', "COPERNICUS/S2_SR")
+DEM = session.asset('Image', "USGS/SRTMGL1_003")
 
-CDL = ee.Image("USDA/NASS/CDL/2019")
-S2 = ee.ImageCollection("COPERNICUS/S2")
-SR = ee.ImageCollection("COPERNICUS/S2_SR")
-DEM = ee.Image("USGS/SRTMGL1_003")
+# running count of blocking getInfo() round trips made through get_info()
+round_trips = 0
+
+def get_info(obj):
+    """
+    Evaluate an Earth Engine object client side, counting the round trip
+
+    Parameters:
+        obj (ee.ComputedObject): object to evaluate
+
+    Returns:
+        the result of obj.getInfo()
+    """
+    global round_trips
+    round_trips += 1
+    return obj.getInfo()
+
+def request(function, *args):
+    """
+    Make a blocking Earth Engine request other than getInfo(), e.g.
+    terrain.asset_exists(), counting the round trip
+
+    Parameters:
+        function (callable): function making the request
+        args: arguments of function
+
+    Returns:
+        the result of function(*args)
+    """
+    global round_trips
+    round_trips += 1
+    return instrument.request(function, *args)
 
 def sz(ft):
     area = ft.area(5)
@@ -24,24 +57,201 @@ def sz(ft):
 def displaySize(size):
     print('size:', size)
 
+def masked_collection(aoi, prior, today, rgbn):
+    """
+    Cloud masked Sentinel-2 images between two dates, SR from 2019 on and
+    TOA before, with only the rgbn bands when the window spans both
+
+    Parameters:
+        aoi (ee.Geometry): area of interest
+        prior (ee.Date): start of the window
+        today (ee.Date): end of the window
+        rgbn (list): bands kept where TOA and SR images are merged
+
+    Returns:
+        ee.ImageCollection
+    """
+    # choose the collection server side so metadata can be fetched in a
+    # single round trip
+    sr = SR().filterDate(prior, today).filterBounds(aoi).map(clouds.maskSR)
+    s2 = S2().filterDate(prior, '2018-12-25').filterBounds(aoi).map(clouds.maskTOA)
+    mixed = s2.select(rgbn).merge(
+            SR().filterDate('2018-12-26', today).filterBounds(aoi).map(clouds.maskSR).select(rgbn))
+    toa = S2().filterDate(prior, today).filterBounds(aoi).map(clouds.maskTOA)
+    return ee.ImageCollection(ee.Algorithms.If(
+            prior.get('year').gte(2019),
+            sr,
+            ee.Algorithms.If(today.get('year').gte(2019), mixed, toa)))
+
+def change_polygons(iwout, dictionary, aoi, sq_meters, add_props, iterations):
+    """
+    Score IW z-scores with LDA coefficients and vectorize the changed areas
+
+    Parameters:
+        iwout (ee.Image): z-score output of iw.runIW
+        dictionary (ee.Dictionary): lda coefficients, or an ee.Image of per
+        pixel coefficients, see analyze_iw
+        aoi (ee.Geometry): area of interest
+        sq_meters (ee.Number): minimum area of the polygons kept
+        add_props (function): maps an output feature to add its properties
+        iterations (ee.Number): reweighting iterations, added as a property
+
+    The stages 'lda' and 'vectorize' are recorded by an active
+    instrument.Recorder.
+
+    Returns:
+        ee.FeatureCollection: change polygons with property 'area'
+    """
+    # calculate LDA score to discriminate change/no-change pixels in iwout.  Requires thresholds from habitat dictionary
+    with instrument.stage('lda'):
+        ldabands = ['cv_z', 'rcvmax_z', 'ndvi_z', 'ndsi_z', 'ndwi_z', 'nbr_z']
+        if isinstance(dictionary, ee.Image):
+            # per pixel coefficients and thresholds in one multiply-sum
+            selected = stats.ldaMargin(iwout, ldabands, dictionary).gte(0)
+        else:
+            scored = stats.ldaScore(iwout, ldabands, dictionary)
+            selected = scored.gte(dictionary.toImage(['lda']))
+    
+#    scored = stats.ldaScore(iwout, 0 ['cv_z', 'rcvmax_z', 'ndvi_z', 'ndsi_z', 'ndwi_z', 'nbr_z'],
+#                            [cvz, rcvz, ndviz, ndsiz, ndwiz, nbrz]).clip(aoi)
+
+        # create a binary [0, 1] image representing change and no-change pixels.  Erode and dilate changed areas
+        selected = selected\
+        .focal_min(1, 'square', 'pixels')\
+        .focal_max(1, 'square', 'pixels')
+
+        # mask image to retain only pixels equal to '1'
+        selected = selected.updateMask(selected)
+    #maskSelected = selected.updateMask(selected.eq(0))
+    # mask out no-change areas (i.e. selected = 0) here.  Creates fewer polygons which should save memory
+    # selected = selected.updateMask(selected.eq(1))
+    #print('selected is a ', type(selected))
+
+    scale = 10
+    tileScale = 6
+    
+    # convert binary image to polygons.  Note: this creates polygons for both contiguous change and contiguous no-change areas
+    with instrument.stage('vectorize'):
+        polys = selected.reduceToVectors(
+            geometry=aoi,
+            scale=scale,
+            tileScale=tileScale,
+            eightConnected=True,
+            bestEffort=True,
+            maxPixels=1e13)
+
+        #print('polys is a ', type(polys))
+        #print('polys size:', polys.size().getInfo())
+
+        # return only polygons corresponding to change pixels
+        polys = polys.map(sz)
+        polys = polys.map(add_props)
+        # record the reweighting iterations so exports show their distribution
+        polys = polys.map(lambda ft: ft.set({'iterations': iterations}))
+
+        # filter out change polygons smaller than the user defined minimum area
+        polys = instrument.graph(polys.filter(ee.Filter.gte('area', sq_meters)))
+    return polys
+
 #def analyze_iw(aoi, doi, cvz, nbrz, ndsiz, ndviz, ndwiz, rcvz, size, intercept, lda):
-def analyze_iw(aoi, doi, dictionary, size, aoiId):
+def window(doi):
+    """
+    Client side start and end of the before and after windows of a date of
+    interest, as computed in analyze_iw
+
+    Parameters:
+        doi (str): date of interest, 'YYYY-MM-DD'
+
+    Returns:
+        tuple: ('YYYY-MM-DD' start, 'YYYY-MM-DD' end)
+    """
+    year, month, day = int(doi[:4]), int(doi[5:7]), int(doi[8:10])
+    end_year, end_month = divmod(year * 12 + month - 1 + 6, 12)
+    return ('{:04d}-{:02d}-{:02d}'.format(year - 1, month, day),
+            '{:04d}-{:02d}-{:02d}'.format(end_year, end_month + 1, day))
+
+def coefficient_asset(folder, geometry, doi):
+    """
+    Asset id under which analyze_iw caches the c_correct coefficients of an
+    AOI and date of interest
+
+    Parameters:
+        folder (str): Earth Engine folder of cached coefficients
+        geometry (dict): client side GeoJSON geometry of the aoi
+        doi (str): date of interest, 'YYYY-MM-DD'
+
+    Returns:
+        str: asset id, see cached_coefficients()
+    """
+    # coeffcache loads numpy, which the Earth Engine pipeline does not
+    # otherwise need, so it is only imported when coefficients are cached
+    import coeffcache
+    rgbn = ['B2', 'B3', 'B4', 'B8', 'B11', 'B12']
+    start, end = window(doi)
+    key = coeffcache.cache_key(geometry, rgbn, DEM.asset_id, start, end)
+    return folder.rstrip('/') + '/c_' + key
+
+def cached_coefficients(imgCol, bands, aoi, asset_id):
+    """
+    Read the c_correct coefficients of a collection from an image asset, or
+    compute them and export them to the asset for the next run, unless an
+    export to it is already waiting or running. Makes one round trip when
+    the asset exists and up to four otherwise, all counted
+
+    Parameters:
+        imgCol (ee.ImageCollection): images to be corrected
+        bands (list<str>): bands to correct
+        aoi (ee.Geometry): area of interest, the region exported
+        asset_id (str): asset holding the coefficients, see
+        coefficient_asset()
+
+    Returns:
+        ee.Image: c = intercept / slope for each band
+    """
+    if request(terrain.asset_exists, asset_id):
+        print('Using cached coefficients', asset_id)
+        return ee.Image(asset_id).select(bands)
+    c = terrain.coefficients(terrain.add_illumination(imgCol, aoi, DEM()), bands)
+    if request(terrain.export_running, asset_id):
+        print('Coefficients already being exported to', asset_id)
+        return c
+    # exported on the grid of the first corrected band
+    proj = get_info(ee.Image(imgCol.first()).select(bands[0]).projection())
+    # the export finishes in the background; this run uses c as computed
+    request(terrain.export_coefficients(c, asset_id, aoi, proj).start)
+    return c
+
+def analyze_iw(aoi, doi, dictionary, size, aoiId, tol=None, c_asset=None):
     """
     Function that pre-processes sentinel-2 imagery and runs the LCC change detection algorithm
     
     Parameters:
         aoi(ee.Feature): area of interest with property 'landcover'
         doi(ee.Date): date of interest
-        dictionary (ee.Dictionary): appropriate dictionary of lda coefficients
+        dictionary (ee.Dictionary): appropriate dictionary of lda coefficients,
+        or an ee.Image of per pixel coefficients from
+        dictionaries.coefficient_image for AOIs spanning several habitats
         size (float): minimum size (ac) of changes to output
         aoiId (str): unique identifier for the area of interest
+        tol (float): optional convergence tolerance for iw.iw(). The number
+        of reweighting iterations run is added to the output polygons as
+        property 'iterations'
+        c_asset (str): optional asset id of the c_correct coefficients, from
+        coefficient_asset(). Read if it exists, otherwise the coefficients
+        are computed and exported to it for the next run
+
+    The stages 'mask', 'c_correct', 'metadata', 'iw', 'lda' and
+    'vectorize' are recorded by an active instrument.Recorder. An error is
+    printed with the line it was raised at, then raised again.
         
     Returns:
         tuple: ee.FeatureCollection with properties 'id', and 'landcover',
         ee.Image with bands
     """
+    session.initialize()
     # cast dictionary to ee.Dictionary for use in subsequent GEE ops
-    dictionary = ee.Dictionary(dictionary)
+    if not isinstance(dictionary, ee.Image):
+        dictionary = ee.Dictionary(dictionary)
     # grab the landcover property from aoi and then cast to geometry
     lc = ee.Feature(aoi).get('mode')
     aoi = aoi.geometry()
@@ -54,28 +264,15 @@ def analyze_iw(aoi, doi, dictionary, size, aoiId):
         return ft.set({'id': ftId, 'landcover': lc})
 
     try:
+        start = round_trips
         sq_meters = ee.Number(size).multiply(4047)
         projdate = ee.Date(doi)
         today = projdate.advance(6, 'month')
-        
-        today_dt = str(datetime.fromtimestamp(int(today.getInfo()['value'])/1e3))[:10]
-        print('today', today_dt)
-        proj_dt = str(datetime.fromtimestamp(int(projdate.getInfo()['value']) / 1e3))[:10]
-        print('proj_dt:', proj_dt)
         prior = ee.Date.fromYMD(projdate.get('year').subtract(1), projdate.get('month'), projdate.get('day'))
-        prior_dt = str(datetime.fromtimestamp(int(prior.getInfo()['value']) / 1e3))[:10]
-        print('prior_dt:', prior_dt)
 
         rgbn = ['B2', 'B3', 'B4', 'B8', 'B11', 'B12']
-        print(today.get('year').getInfo())
-        if(prior.get('year').getInfo() >= 2019):
-            masked = SR.filterDate(prior, today).filterBounds(aoi).map(clouds.maskSR)
-        elif(today.get('year').getInfo() >= 2019):
-            s2 = S2.filterDate(prior, '2018-12-25').filterBounds(aoi).map(clouds.maskTOA)
-            sr = SR.filterDate('2018-12-26', today).filterBounds(aoi).map(clouds.maskSR)
-            masked = s2.select(rgbn).merge(sr.select(rgbn))
-        else:
-            masked = S2.filterDate(prior, today).filterBounds(aoi).map(clouds.maskTOA)
+        with instrument.stage('mask'):
+            masked = instrument.graph(masked_collection(aoi, prior, today, rgbn))
 #        if(projdate.get('year').getInfo() >= 2019):
 #            filtered = SR.filterDate(prior, today).filterBounds(aoi)
 #            masked = filtered.map(clouds.maskSR)
@@ -84,82 +281,212 @@ def analyze_iw(aoi, doi, dictionary, size, aoiId):
 #            masked = filtered.map(clouds.maskTOA)
 
         #masked = S2.filterDate(prior, today).filterBounds(aoi).map(mask)
-        corrected = terrain.c_correct(masked, rgbn, aoi, DEM)
+        with instrument.stage('c_correct'):
+            c = None
+            if c_asset is not None:
+                c = cached_coefficients(masked, rgbn, aoi, c_asset)
+            corrected = instrument.graph(terrain.c_correct(masked, rgbn, aoi, DEM(), c))
         
         after = corrected.filterDate(projdate, today)
-        count = after.size()
-        print('after size:', count.getInfo())
-        reference = after.sort('system:time_start', False)
-        time0 = ee.Image(reference.first()).get('system:time_start')
-        recent_date = str(datetime.fromtimestamp(int(time0.getInfo()) / 1e3))[:10]
-
         before = corrected.filterDate(prior, projdate)
-        count = before.size()
-        print('before size:', count.getInfo())
-        reference = before.sort('system:time_start', False)
-        time0 = reference.first().get('system:time_start')
-        past_date = str(datetime.fromtimestamp(int(time0.getInfo()) / 1e3))[:10]
+
+        # dates and collection sizes, evaluated together
+        with instrument.stage('metadata'):
+            meta = get_info(ee.Dictionary({
+                    'today': today.millis(),
+                    'projdate': projdate.millis(),
+                    'prior': prior.millis(),
+                    'year': today.get('year'),
+                    'after': after.size(),
+                    'before': before.size(),
+                    'recent': after.aggregate_max('system:time_start'),
+                    'past': before.aggregate_max('system:time_start')}))
+
+        today_dt = str(datetime.fromtimestamp(int(meta['today'])/1e3))[:10]
+        print('today', today_dt)
+        proj_dt = str(datetime.fromtimestamp(int(meta['projdate']) / 1e3))[:10]
+        print('proj_dt:', proj_dt)
+        prior_dt = str(datetime.fromtimestamp(int(meta['prior']) / 1e3))[:10]
+        print('prior_dt:', prior_dt)
+        print(meta['year'])
+        print('after size:', meta['after'])
+        recent_date = str(datetime.fromtimestamp(int(meta['recent']) / 1e3))[:10]
+        print('before size:', meta['before'])
+        past_date = str(datetime.fromtimestamp(int(meta['past']) / 1e3))[:10]
  
         # run the IW algorithm between the before and after collections within the user defined AOI.
         # by default, ag fields are masked by 'yes'
         print('running the iw algorithm')
-        iwout = iw.runIW(before,
-                         after,
-                         aoi,
-                         scl = 30,
-                         tScl = 6,
-                         ag = 'yes').clip(aoi)
+        with instrument.stage('iw'):
+            iwout = iw.runIW(before,
+                             after,
+                             aoi,
+                             scl = 30,
+                             tScl = 6,
+                             ag = 'yes',
+                             tol = tol)
+            iterations = iwout.get('iterations')
+            iwout = instrument.graph(iwout.clip(aoi))
         
         print('performing LDA analysis')
-        # calculate LDA score to discriminate change/no-change pixels in iwout.  Requires thresholds from habitat dictionary        
-        scored = stats.ldaScore(
-                iwout,
-                ['cv_z', 'rcvmax_z', 'ndvi_z', 'ndsi_z', 'ndwi_z', 'nbr_z'],
-                dictionary)
-        
-#        scored = stats.ldaScore(iwout, 0 ['cv_z', 'rcvmax_z', 'ndvi_z', 'ndsi_z', 'ndwi_z', 'nbr_z'],
-#                                [cvz, rcvz, ndviz, ndsiz, ndwiz, nbrz]).clip(aoi)
+        polys = change_polygons(iwout, dictionary, aoi, sq_meters, add_props, iterations)
 
-        # create a binary [0, 1] image representing change and no-change pixels.  Erode and dilate changed areas
-        selected = scored.gte(dictionary.toImage(['lda']))\
-        .focal_min(1, 'square', 'pixels')\
-        .focal_max(1, 'square', 'pixels')
+        # indicator = True
+        print('round trips:', round_trips - start)
 
-        # mask image to retain only pixels equal to '1'
-        selected = selected.updateMask(selected)
-        #maskSelected = selected.updateMask(selected.eq(0))
-        # mask out no-change areas (i.e. selected = 0) here.  Creates fewer polygons which should save memory
-        # selected = selected.updateMask(selected.eq(1))
-        #print('selected is a ', type(selected))
+        return "OK", past_date, recent_date, polys, iwout.select([
+                'cv_z', 'nbr_z', 'ndsi_z', 'ndwi_z', 'ndvi_z', 'rcvmax_z'])
+    except Exception as error:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        print ("")
+        print ("*******************************")
+        print ("Unexpected error in analyze.py")
+        print (exc_type, fname, exc_tb.tb_lineno)
+        #print("sys.exc_info:", sys.exc_info()[0])
+        print ("Error:", error)
+        print ("*******************************")
+        print ("")
+        # raised again so callers such as batch.run_aoi see what failed
+        raise
 
-        scale = 10
-        tileScale = 6
-        
-        # convert binary image to polygons.  Note: this creates polygons for both contiguous change and contiguous no-change areas
-        polys = selected.reduceToVectors(
-            geometry=aoi,
-            scale=scale,
-            tileScale=tileScale,
-            eightConnected=True,
-            bestEffort=True,
-            maxPixels=1e13)
+# before and after windows around a date of interest, in months, as in
+# analyze_iw
+BEFORE_MONTHS = 12
+AFTER_MONTHS = 6
 
-        #print('polys is a ', type(polys))
-        count = polys.size().getInfo()
-        print(count)
-        #print('polys size:', count.getInfo(displaySize))
+def period_composites(collection, start, count, months=1):
+    """
+    Median composite of each consecutive period of a collection
 
-        # return only polygons corresponding to change pixels
-        polys = polys.map(sz)
-        polys = polys.map(add_props)
+    Parameters:
+        collection (ee.ImageCollection): images to composite
+        start (ee.Date): start of the first period
+        count (int): number of periods
+        months (int): length of a period in months
 
-        # filter out change polygons smaller than the user defined minimum area
-        polys = polys.filter(ee.Filter.gte('area', sq_meters))
+    Returns:
+        list: ee.Image of each period, with properties 'system:time_start',
+        the start of the period, and 'count', the number of images
+    """
+    start = ee.Date(start)
+    composites = []
+    for i in range(count):
+        # advance from start each time so periods keep the day of the month
+        begin = start.advance(i * months, 'month')
+        images = collection.filterDate(begin, start.advance((i + 1) * months, 'month'))
+        composites.append(images.median().set({
+                'system:time_start': begin.millis(),
+                'count': images.size()}))
+    return composites
 
-        # indicator = True
+def analyze_series(aoi, start, steps, dictionary, size, aoiId, months=1, tol=None):
+    """
+    Run the LCC change detection for a series of dates of interest, start
+    and every months after it, building each period composite only once
 
-        return "OK", past_date, recent_date, polys, iwout.select([
-                'cv_z', 'nbr_z', 'ndsi_z', 'ndwi_z', 'ndvi_z', 'rcvmax_z'])
+    Consecutive dates share most of their before and after windows, so the
+    masked, terrain corrected collection spanning all of them is built once
+    and reduced to a median composite per period. The before and after
+    images of each date are the medians of the period composites in its
+    12 and 6 month windows, so a 24 month series at monthly steps costs 41
+    period composites rather than 24 full analyze_iw pipelines.
+
+    The results differ slightly from analyze_iw on each date: the median of
+    period composites stands in for the median of all images in a window,
+    and the terrain correction is fitted once over the whole series.
+
+    Parameters:
+        aoi(ee.Feature): area of interest with property 'mode'
+        start (str): first date of interest, e.g. '2020-01-01'
+        steps (int): number of dates of interest
+        dictionary (ee.Dictionary): lda coefficients, or an ee.Image of per
+        pixel coefficients, see analyze_iw
+        size (float): minimum size (ac) of changes to output
+        aoiId (str): unique identifier for the area of interest, output
+        polygons get id aoiId + '_' + date of interest
+        months (int): period length and step between dates, 1, 2, 3 or 6
+        tol (float): optional convergence tolerance for iw.iw()
+
+    The stages 'mask', 'c_correct', 'periods' and 'metadata', and the
+    'iw', 'lda' and 'vectorize' stages of every date, are recorded by an
+    active instrument.Recorder.
+
+    Returns:
+        list: (doi, status, past_date, recent_date, polys, iwout) for each
+        date of interest, as returned by analyze_iw, or "error"
+    """
+    if AFTER_MONTHS % months:
+        raise ValueError('months must divide {}, got {}'.format(AFTER_MONTHS, months))
+    session.initialize()
+    if not isinstance(dictionary, ee.Image):
+        dictionary = ee.Dictionary(dictionary)
+    lc = ee.Feature(aoi).get('mode')
+    aoi = aoi.geometry()
+
+    def add_props(ftId):
+        return lambda ft: ft.set({'id': ftId, 'landcover': lc})
+
+    try:
+        begin = round_trips
+        sq_meters = ee.Number(size).multiply(4047)
+        first = ee.Date(start)
+        prior = first.advance(-BEFORE_MONTHS, 'month')
+        nbefore = BEFORE_MONTHS // months
+        nafter = AFTER_MONTHS // months
+        count = nbefore + steps - 1 + nafter
+        today = prior.advance(count * months, 'month')
+
+        rgbn = ['B2', 'B3', 'B4', 'B8', 'B11', 'B12']
+        with instrument.stage('mask'):
+            masked = instrument.graph(masked_collection(aoi, prior, today, rgbn))
+        with instrument.stage('c_correct'):
+            corrected = instrument.graph(terrain.c_correct(masked, rgbn, aoi, DEM()))
+        with instrument.stage('periods'):
+            composites = period_composites(corrected, prior, count, months)
+
+        # dates and collection sizes of every step, evaluated together
+        windows = []
+        for k in range(steps):
+            projdate = first.advance(k * months, 'month')
+            windows.append((corrected.filterDate(prior.advance(k * months, 'month'), projdate),
+                            corrected.filterDate(projdate, projdate.advance(AFTER_MONTHS, 'month'))))
+        with instrument.stage('metadata'):
+            meta = get_info(ee.List([ee.Dictionary({
+                    'projdate': first.advance(k * months, 'month').millis(),
+                    'before': before.size(),
+                    'after': after.size(),
+                    'past': before.aggregate_max('system:time_start'),
+                    'recent': after.aggregate_max('system:time_start')})
+                    for k, (before, after) in enumerate(windows)]))
+
+        def day(millis):
+            return str(datetime.fromtimestamp(int(millis) / 1e3))[:10]
+
+        results = []
+        for k, step in enumerate(meta):
+            doi = day(step['projdate'])
+            print('doi:', doi, 'before size:', step['before'], 'after size:', step['after'])
+            if not step['before'] or not step['after']:
+                print('no images before or after', doi)
+                results.append((doi, "empty", None, None, None, None))
+                continue
+            before = ee.ImageCollection(composites[k:k + nbefore])\
+            .filter(ee.Filter.gt('count', 0))
+            after = ee.ImageCollection(composites[k + nbefore:k + nbefore + nafter])\
+            .filter(ee.Filter.gt('count', 0))
+
+            with instrument.stage('iw'):
+                iwout = iw.runIW(before, after, aoi, scl = 30, tScl = 6, ag = 'yes', tol = tol)
+                iterations = iwout.get('iterations')
+                iwout = instrument.graph(iwout.clip(aoi))
+            polys = change_polygons(iwout, dictionary, aoi, sq_meters,
+                                    add_props(aoiId + '_' + doi), iterations)
+            results.append((doi, "OK", day(step['past']), day(step['recent']), polys, iwout.select([
+                    'cv_z', 'nbr_z', 'ndsi_z', 'ndwi_z', 'ndvi_z', 'rcvmax_z'])))
+
+        print('round trips:', round_trips - begin)
+        return results
     except Exception as error:
         exc_type, exc_obj, exc_tb = sys.exc_info()
         fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
@@ -167,13 +494,13 @@ def analyze_iw(aoi, doi, dictionary, size, aoiId):
         print ("*******************************")
         print ("Unexpected error in analyze.py")
         print (exc_type, fname, exc_tb.tb_lineno)
-        #print("sys.exc_info:", sys.exc_info()[0])
         print ("Error:", error)
         print ("*******************************")
         print ("")
         return "error"
 
 def analyze_mad(aoi, doi, size, niters):
+    session.initialize()
     iterations = niters
     # service_account = config.EE_ACCOUNT
     # credentials = ee.ServiceAccountCredentials(service_account, config.EE_PRIVATE_KEY_FILE)
@@ -193,10 +520,10 @@ def analyze_mad(aoi, doi, size, niters):
     print(nbands)
     
     masked = ee.Algorithms.If(doi.gte(ee.Date('2019-01-01')),
-                 S2.filterDate(prior, today).filterBounds(aoi).map(clouds.maskS2SR),
-                 S2.filterDate(prior, today).filterBounds(aoi).map(clouds.mask))
+                 S2().filterDate(prior, today).filterBounds(aoi).map(clouds.maskS2SR),
+                 S2().filterDate(prior, today).filterBounds(aoi).map(clouds.mask))
 
-    corrected = terrain.c_correct(masked, rgbn, aoi, DEM)
+    corrected = terrain.c_correct(masked, rgbn, aoi, DEM())
 
     after = corrected.filterDate(projdate, today)
     image2 = after.median().select(rgbn)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Run analyze.analyze_iw over many AOIs in parallel
+
+Each AOI in a manifest is analyzed in a worker process so the getInfo()
+round trips of different AOIs overlap. Earth Engine objects returned by the
+workers are serialized to JSON and rebuilt in the parent.
+
+A manifest is a list of dictionaries (or a JSON file containing one) with
+keys:
+    'id' (str): unique identifier for the aoi
+    'geometry' (dict): GeoJSON geometry of the aoi
+    'doi' (str): date of interest, 'YYYY-MM-DD'
+    'landcover' (str): habitat type, the name of a dictionary in dictionaries,
+    or 'mixed' to score each pixel by its NLCD class
+    'size' (float): minimum size (ac) of changes to output
+    'tol' (float): optional convergence tolerance for the IW reweighting
+
+Each AOI is run under an instrument.Recorder, and its per-stage report is
+returned in the 'report' column and optionally written as <id>.json.
+"""
+
+import csv
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import ee
+import analyze
+import dictionaries
+import instrument
+import session
+
+COLUMNS = ['id', 'status', 'past_date', 'recent_date', 'seconds', 'reason']
+
+def load_manifest(path):
+    """
+    Read a manifest of AOIs from a JSON file
+
+    Parameters:
+        path (str): path to a JSON file containing a list of AOI entries
+
+    Returns:
+        list<dict>: manifest entries
+    """
+    with open(path) as f:
+        return json.load(f)
+
+def init_worker(credentials=None):
+    """
+    Initialize Earth Engine once in each worker process
+
+    Parameters:
+        credentials (tuple): optional (service account, private key file)
+    """
+    session.initialize(credentials)
+
+def run_aoi(entry, cache=None):
+    """
+    Analyze a single manifest entry. Runs in a worker process
+
+    Parameters:
+        entry (dict): manifest entry
+        cache (str): optional Earth Engine folder of cached c_correct
+        coefficients, see analyze.coefficient_asset()
+
+    Returns:
+        dict: result row with 'polys' and 'iwout' serialized to JSON, and
+        the instrument report of the run
+    """
+    row = {'id': entry['id'], 'status': 'error', 'past_date': None,
+           'recent_date': None, 'polys': None, 'iwout': None, 'reason': None}
+    start = time.time()
+    recorder = instrument.Recorder(entry['id'])
+    try:
+        with recorder:
+            aoi = ee.Feature(ee.Geometry(entry['geometry']), {'mode': entry['landcover']})
+            if entry['landcover'] == 'mixed':
+                dictionary = dictionaries.coefficient_image()
+            else:
+                dictionary = getattr(dictionaries, entry['landcover'])
+            c_asset = None
+            if cache:
+                c_asset = analyze.coefficient_asset(cache, entry['geometry'], entry['doi'])
+            status, past_date, recent_date, polys, iwout = analyze.analyze_iw(
+                    aoi, entry['doi'], dictionary, entry['size'], entry['id'],
+                    entry.get('tol'), c_asset)
+            with instrument.stage('serialize'):
+                row.update({'status': status,
+                            'past_date': past_date,
+                            'recent_date': recent_date,
+                            'polys': ee.serializer.toJSON(polys),
+                            'iwout': ee.serializer.toJSON(iwout)})
+    except Exception as error:
+        row['reason'] = '{}: {}'.format(type(error).__name__, error)
+        traceback.print_exc()
+    row['seconds'] = time.time() - start
+    row['report'] = recorder.report()
+    return row
+
+def run_batch(manifest, workers=4, max_in_flight=None, credentials=None,
+              report_dir=None, cache=None):
+    """
+    Analyze every AOI in a manifest across a pool of worker processes
+
+    Parameters:
+        manifest (list<dict>): AOI entries, see module docstring
+        workers (int): number of worker processes
+        max_in_flight (int): maximum number of AOIs submitted at once,
+        defaults to 2 * workers
+        credentials (tuple): optional (service account, private key file)
+        used to initialize each worker
+        report_dir (str): optional existing directory in which the
+        instrument report of each AOI is written as <id>.json
+        cache (str): optional Earth Engine folder in which the c_correct
+        coefficients of each AOI are cached across batches
+
+    Returns:
+        list<dict>: one row per AOI in manifest order with keys COLUMNS,
+        the rebuilt 'polys' (ee.FeatureCollection) and 'iwout' (ee.Image),
+        and the instrument 'report'
+    """
+    max_in_flight = max_in_flight or 2 * workers
+    pending = list(enumerate(manifest))[::-1]
+    rows = [None] * len(manifest)
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=(credentials,)) as pool:
+        while pending or running:
+            while pending and len(running) < max_in_flight:
+                i, entry = pending.pop()
+                running[pool.submit(run_aoi, entry, cache)] = i
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                try:
+                    row = future.result()
+                except Exception as error:
+                    # the worker itself failed, e.g. during initialization
+                    row = {'id': manifest[i]['id'], 'status': 'error',
+                           'past_date': None, 'recent_date': None,
+                           'polys': None, 'iwout': None, 'seconds': None,
+                           'reason': '{}: {}'.format(type(error).__name__, error),
+                           'report': None}
+                print(row['id'], row['status'], row['seconds'])
+                if report_dir and row['report'] is not None:
+                    with open(os.path.join(report_dir, row['id'] + '.json'), 'w') as f:
+                        json.dump(row['report'], f, indent=2)
+                rows[i] = row
+
+    # the parent only needs Earth Engine to rebuild the worker outputs
+    if any(row['polys'] is not None for row in rows):
+        session.initialize(credentials)
+    for row in rows:
+        if row['polys'] is not None:
+            row['polys'] = ee.FeatureCollection(ee.deserializer.fromJSON(row['polys']))
+            row['iwout'] = ee.Image(ee.deserializer.fromJSON(row['iwout']))
+    return rows
+
+def write_results(rows, path):
+    """
+    Write the results table of run_batch to a csv file
+
+    Parameters:
+        rows (list<dict>): output of run_batch
+        path (str): output csv file
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+def write_stage_summary(rows, path):
+    """
+    Write the per-stage totals of the instrument reports of a batch to JSON
+
+    Parameters:
+        rows (list<dict>): output of run_batch
+        path (str): output JSON file
+    """
+    reports = [row['report'] for row in rows if row.get('report')]
+    with open(path, 'w') as f:
+        json.dump(instrument.aggregate(reports), f, indent=2)
+
+if __name__ == '__main__':
+    import sys
+    rows = run_batch(load_manifest(sys.argv[1]), workers=int(sys.argv[3]) if len(sys.argv) > 3 else 4)
+    write_results(rows, sys.argv[2])
+    write_stage_summary(rows, os.path.splitext(sys.argv[2])[0] + '_stages.json')
@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the local change detection algorithms
+
+Generates reproducible synthetic 'before' and 'after' scenes of the six
+RGBN bands with planted change patches, then times each algorithm stage and
+records its throughput (pixels / s) and peak traced memory. Results can be
+compared against a baseline written by an earlier run, so a change to the
+IW, IR-MAD, chi square or LDA code can be checked for regressions without
+Earth Engine credentials.
+
+Stages:
+    'iw': iw_local.runIW on the whole scene in memory
+    'iw_tiled': tiles.runIW within a memory budget
+    'imad': MAD_local.imad on the 12 band before / after stack
+    'chisq': MAD_local.chisq on the MAD variates
+    'lda': stats_local.ldaScore of the IW z-scores
+    'mask_naive': clouds_local.maskTOA and maskSR on each scene of a stack
+    'mask_fused': clouds_local.mask_stack for both masks on the same stack
+    'c_correct': terrain_local.c_correct of the RGBN bands of the same stack
+    over a hilly DEM
+    'composite': compositecache.mosaic of the SR masked median of the same
+    stack through an empty compositecache.CompositeCache
+    'composite_cached': the same mosaic again, read from the cache, with its
+    tile 'hits' and 'misses' and the pixels differing from 'composite'
+    'vectorize': vectors_local.vectorize of the pixels where B8 dropped by
+    more than 30%, the planted clearings, in 256 row windows
+    'opening_scipy': scipy.ndimage minimum then maximum filter of the
+    vectorize mask with added speckle, recorded per radius of
+    OPENING_RADII as 'opening_scipy_r<radius>'
+    'opening_vhgw': morphology_local.opening of the same mask, recorded as
+    'opening_vhgw_r<radius>' with the pixels differing from scipy
+    'equalize': calibration_local.equalize of the 'after' scene to the
+    'before' scene, with the largest per band KS distance to the reference
+    before and after matching
+
+The masking, c_correct and composite stages count the pixels of every scene in the
+stack. In-memory stages are skipped for scenes larger than max_pixels.
+
+Usage:
+    python benchmark.py results.json [--baseline baseline.json]
+        [--sizes 1000,2000,5000,10000]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from scipy import ndimage
+import calibration_local
+import clouds_local
+import compositecache
+import iw_local
+import MAD_local
+import morphology_local
+import stats_local
+import terrain_local
+import tiles
+import vectors_local
+
+SIZES = [1000, 2000, 5000, 10000]
+STAGES = ['iw', 'iw_tiled', 'imad', 'chisq', 'lda', 'mask_naive', 'mask_fused', 'c_correct',
+          'composite', 'composite_cached', 'equalize', 'vectorize', 'opening_scipy',
+          'opening_vhgw']
+
+# in-memory stages hold several float64 copies of all bands
+MAX_PIXELS = 10**7
+
+# rows generated at a time; fixed so scenes do not depend on the caller
+BLOCK_ROWS = 256
+
+# mean reflectance and response to the vegetation field of each band
+BASE = {'B2': 0.05, 'B3': 0.08, 'B4': 0.07, 'B8': 0.30, 'B11': 0.20, 'B12': 0.12}
+VEG = {'B2': -0.01, 'B3': 0.00, 'B4': -0.03, 'B8': 0.15, 'B11': -0.05, 'B12': -0.04}
+
+# multiplicative change inside planted patches, vegetation cleared to soil
+CLEARING = {'B2': 1.1, 'B3': 1.1, 'B4': 1.6, 'B8': 0.5, 'B11': 1.3, 'B12': 1.4}
+
+# side of each planted patch as a fraction of the scene side
+PATCH_FRACTIONS = [0.05, 0.02, 0.005]
+
+# landscape feature wavelengths in pixels
+WAVELENGTHS = [60, 150, 400]
+
+# LDA coefficients of dictionaries.forest
+LDA = {'int': 0, 'cv_z': 0.01968614, 'rcvmax_z': -0.01005500,
+       'ndvi_z': 0.23793789, 'ndsi_z': 0.09507422, 'ndwi_z': 0.09902060,
+       'nbr_z': 0.10534742}
+LDA_BANDS = ['cv_z', 'rcvmax_z', 'ndvi_z', 'ndsi_z', 'ndwi_z', 'nbr_z']
+
+# scenes in the masking stack, and the fraction of each covered by cloud
+MASK_SCENES = 4
+CLOUD_COVER = 0.3
+
+# (azimuth, zenith) solar angles of the scenes of the c_correct stage
+SUN_AZIMUTH = (130, 160)
+SUN_ZENITH = (20, 50)
+
+# radii of the opening stages, 1 as in analyze_iw
+OPENING_RADII = [1, 5]
+
+# fraction of the opening mask flipped at random
+SPECKLE = 0.05
+
+def patches(size, seed=0):
+    """
+    Positions of the planted change patches in a scene
+
+    Parameters:
+        size (int): number of rows and columns of the scene
+        seed (int): random seed
+
+    Returns:
+        list<tuple>: (row, col, side) of each square patch
+    """
+    rng = np.random.default_rng([seed, size])
+    out = []
+    for fraction in PATCH_FRACTIONS:
+        side = max(4, int(size * fraction))
+        row, col = rng.integers(0, size - side, 2)
+        out.append((int(row), int(col), side))
+    return out
+
+def synthetic_scene(size, directory, seed=0):
+    """
+    Generate a before / after pair of six band scenes with planted changes
+
+    Both scenes share a smooth landscape built from sinusoidal vegetation and
+    brightness fields, with independent sensor noise. Inside each patch the
+    'after' scene is cleared of vegetation. Bands are written block by block
+    to memory-mapped .npy files so scenes larger than memory can be built.
+
+    Parameters:
+        size (int): number of rows and columns of the scene
+        directory (str): directory in which 'before' and 'after' subdirectories
+        of float32 bands are written
+        seed (int): random seed; equal seeds give identical scenes
+
+    Returns:
+        tuple: (before, after, patches) where before and after are dicts of
+        memory-mapped bands and patches is the output of patches()
+    """
+    rng = np.random.default_rng(seed)
+    # (angle, phase) of a sinusoid at each wavelength, per latent field
+    waves = [[(rng.uniform(0, np.pi), rng.uniform(0, 2 * np.pi)) for w in WAVELENGTHS]
+             for field in range(2)]
+    planted = patches(size, seed)
+
+    scenes = []
+    for name in ['before', 'after']:
+        path = os.path.join(directory, name)
+        os.makedirs(path, exist_ok=True)
+        scenes.append(tiles.open_store(path, iw_local.RGBN, (size, size), np.float32))
+    before, after = scenes
+
+    cols = np.arange(size)
+    for window in tiles.windows((size, size), BLOCK_ROWS):
+        rows = np.arange(window.start, window.stop)[:, None]
+        fields = []
+        for field in waves:
+            f = sum(np.sin(2 * np.pi * (rows * np.sin(a) + cols * np.cos(a)) / w + p)
+                    for w, (a, p) in zip(WAVELENGTHS, field))
+            fields.append(f / len(WAVELENGTHS))
+        veg = 0.5 + 0.5 * fields[0]
+        bright = 1 + 0.3 * fields[1]
+        noise = np.random.default_rng([seed, size, window.start])
+        cleared = np.zeros(veg.shape, dtype=bool)
+        for row, col, side in planted:
+            cleared[max(row - window.start, 0):max(row + side - window.start, 0),
+                    col:col + side] = True
+        for band in iw_local.RGBN:
+            land = BASE[band] * bright + VEG[band] * veg
+            before[band][window] = land + noise.normal(0, 0.01, veg.shape)
+            now = land + noise.normal(0, 0.01, veg.shape)
+            after[band][window] = np.where(cleared, now * CLEARING[band], now)
+    for scene in scenes:
+        for arr in scene.values():
+            arr.flush()
+    return before, after, planted
+
+def synthetic_stack(scene, scenes=MASK_SCENES, seed=0):
+    """
+    Build a stack of raw Sentinel-2 scenes with clouds for the masking stages
+
+    Every scene is the reflectance of scene as uint16 digital numbers with
+    the remaining TOA bands added. Clouds are bright smooth blobs, flagged in
+    QA60 and SCL over part of their extent so both masks have work to do.
+
+    Parameters:
+        scene (dict): bands of iw_local.RGBN in reflectance
+        scenes (int): number of scenes in the stack
+        seed (int): random seed
+
+    Returns:
+        dict: band name to (scenes, rows, cols) uint16 array of each of
+        clouds_local.TOA_BANDS and 'SCL'
+    """
+    rng = np.random.default_rng([seed, scenes])
+    rows, cols = next(iter(scene.values())).shape
+    y, x = np.ogrid[0:rows, 0:cols]
+    bands = clouds_local.TOA_BANDS + ['SCL']
+    stack = {band: np.empty((scenes, rows, cols), dtype=np.uint16) for band in bands}
+    for i in range(scenes):
+        angle, phase = rng.uniform(0, 2 * np.pi, 2)
+        field = np.sin(2 * np.pi * (y * np.sin(angle) + x * np.cos(angle)) / WAVELENGTHS[1] + phase)
+        cloud = field > np.quantile(field, 1 - CLOUD_COVER)
+        for band in iw_local.RGBN:
+            stack[band][i] = np.clip(scene[band] * 10000, 0, 65535)
+        stack['B1'][i] = 0.8 * stack['B2'][i]
+        stack['B10'][i] = 50
+        for band in ['B1', 'B2', 'B3', 'B4', 'B10']:
+            stack[band][i][cloud] += 3000
+        stack['QA60'][i] = np.where(cloud & (field > 0.8), 1024, 0)
+        stack['SCL'][i] = np.where(cloud, 9, 4)
+    return stack
+
+def measure(func, *args, **kwargs):
+    """
+    Time a function call and trace its peak memory allocation
+
+    Returns:
+        tuple: (output of func, seconds, peak traced bytes)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        out = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return out, seconds, peak
+
+def run_size(size, stages=STAGES, seed=0, niter=10, max_pixels=MAX_PIXELS,
+             budget=2**28, workdir=None):
+    """
+    Benchmark every stage on one synthetic scene
+
+    Parameters:
+        size (int): number of rows and columns of the scene
+        stages (list<str>): stages to run, see module docstring
+        seed (int): random seed for synthetic_scene()
+        niter (int): IW reweighting and IR-MAD iterations
+        max_pixels (int): largest scene run by the in-memory stages
+        budget (int): memory budget of the tiled IW stage
+        workdir (str): directory for scenes and intermediate images,
+        defaults to the system temporary directory
+
+    Returns:
+        dict: per stage 'seconds', 'pixels_per_second' and 'peak_bytes', or
+        'skipped' with the reason
+    """
+    pixels = size * size
+    tmp = tempfile.mkdtemp(dir=workdir)
+    results = {}
+
+    def record(stage, seconds, peak, count=pixels):
+        results[stage] = {'seconds': seconds,
+                          'pixels_per_second': count / seconds,
+                          'peak_bytes': peak}
+
+    try:
+        before, after, _ = synthetic_scene(size, tmp, seed)
+
+        if 'iw_tiled' in stages:
+            os.mkdir(os.path.join(tmp, 'iw'))
+            _, seconds, peak = measure(tiles.runIW, before, after, os.path.join(tmp, 'iw'),
+                                       niter=niter, budget=budget, workdir=tmp)
+            record('iw_tiled', seconds, peak)
+
+        in_memory = [stage for stage in stages if stage != 'iw_tiled']
+        if pixels > max_pixels:
+            for stage in in_memory:
+                results[stage] = {'skipped': 'more than {} pixels'.format(max_pixels)}
+            return results
+        if not in_memory:
+            return results
+
+        old = {band: np.asarray(arr, dtype=float) for band, arr in before.items()}
+        new = {band: np.asarray(arr, dtype=float) for band, arr in after.items()}
+
+        zs = None
+        if 'iw' in stages or 'lda' in stages:
+            (zs, _), seconds, peak = measure(iw_local.runIW, old, new, niter=niter)
+            if 'iw' in stages:
+                record('iw', seconds, peak)
+        if 'lda' in stages:
+            _, seconds, peak = measure(stats_local.ldaScore, zs, LDA_BANDS, LDA)
+            record('lda', seconds, peak)
+        zs = None
+
+        if 'equalize' in stages:
+            equalized, seconds, peak = measure(calibration_local.equalize, old, new)
+            record('equalize', seconds, peak)
+            results['equalize']['ks_before'] = max(
+                    calibration_local.ks_distance(old[band], new[band]) for band in old)
+            results['equalize']['ks_after'] = max(
+                    calibration_local.ks_distance(old[band], equalized[band]) for band in old)
+            equalized = None
+
+        if 'vectorize' in stages:
+            cleared = new['B8'] < 0.7 * old['B8']
+            features, seconds, peak = measure(
+                    lambda: list(vectors_local.vectorize(cleared, min_pixels=4,
+                                                         budget=size * 256 * vectors_local.BYTES_PER_PIXEL)))
+            record('vectorize', seconds, peak)
+            results['vectorize']['polygons'] = len(features)
+            cleared = features = None
+
+        if 'opening_scipy' in stages or 'opening_vhgw' in stages:
+            rng = np.random.default_rng([seed, size])
+            speckled = (new['B8'] < 0.7 * old['B8']) ^ (rng.random((size, size)) < SPECKLE)
+            for radius in OPENING_RADII:
+                side = 2 * radius + 1
+                expected = None
+                if 'opening_scipy' in stages:
+                    expected, seconds, peak = measure(
+                            lambda: ndimage.maximum_filter(
+                                ndimage.minimum_filter(speckled, side, mode='constant', cval=1),
+                                side, mode='constant', cval=0))
+                    record('opening_scipy_r{}'.format(radius), seconds, peak)
+                if 'opening_vhgw' in stages:
+                    opened, seconds, peak = measure(morphology_local.opening, speckled, radius)
+                    record('opening_vhgw_r{}'.format(radius), seconds, peak)
+                    if expected is not None:
+                        results['opening_vhgw_r{}'.format(radius)]['mismatches'] = \
+                                int(np.sum(opened.astype(bool) != expected))
+            speckled = expected = opened = None
+
+        if 'imad' in stages or 'chisq' in stages:
+            image = dict(old)
+            image.update({band + '_2': arr for band, arr in new.items()})
+            mad, seconds, peak = measure(MAD_local.imad, image, niter)
+            if 'imad' in stages:
+                record('imad', seconds, peak)
+            if 'chisq' in stages:
+                _, seconds, peak = measure(MAD_local.chisq, mad['MAD'])
+                record('chisq', seconds, peak)
+        mad = image = None
+
+        stacked = ['mask_naive', 'mask_fused', 'c_correct', 'composite', 'composite_cached']
+        if any(stage in stages for stage in stacked):
+            stack = synthetic_stack(before, seed=seed)
+            scenes = len(stack['QA60'])
+
+        if 'mask_naive' in stages or 'mask_fused' in stages:
+            def naive():
+                keep = np.empty((2, scenes, size, size), dtype=bool)
+                for i in range(scenes):
+                    scene = {band: arr[i] for band, arr in stack.items()}
+                    keep[0, i] = ~np.isnan(clouds_local.maskTOA(scene)['QA60'])
+                    keep[1, i] = ~np.isnan(clouds_local.maskSR(scene)['QA60'])
+                return keep
+
+            def fused():
+                keep = np.empty((2, scenes, size, size), dtype=bool)
+                clouds_local.mask_stack(stack, 'TOA', out=keep[0])
+                clouds_local.mask_stack(stack, 'SR', out=keep[1])
+                return keep
+
+            expected = None
+            if 'mask_naive' in stages:
+                expected, seconds, peak = measure(naive)
+                record('mask_naive', seconds, peak, pixels * scenes)
+            if 'mask_fused' in stages:
+                keep, seconds, peak = measure(fused)
+                record('mask_fused', seconds, peak, pixels * scenes)
+                if expected is not None:
+                    # pixels on which the two implementations disagree
+                    results['mask_fused']['mismatches'] = int(np.sum(keep != expected))
+            keep = expected = None
+
+        if 'c_correct' in stages:
+            rng = np.random.default_rng([seed, size])
+            y, x = np.ogrid[0:size, 0:size]
+            dem = 300 + 40 * np.sin(y / 30.0) * np.cos(x / 45.0)
+            slope, aspect = terrain_local.slope_aspect(dem, 10)
+            angles = list(zip(rng.uniform(*SUN_AZIMUTH, size=scenes),
+                              rng.uniform(*SUN_ZENITH, size=scenes)))
+            rgbn = [{band: stack[band][i] for band in iw_local.RGBN} for i in range(scenes)]
+
+            def c_correct():
+                # consume the corrected scenes one at a time, as a writer would
+                for scene in terrain_local.c_correct(rgbn, angles, iw_local.RGBN, slope, aspect):
+                    pass
+
+            _, seconds, peak = measure(c_correct)
+            record('c_correct', seconds, peak, pixels * scenes)
+
+        if 'composite' in stages or 'composite_cached' in stages:
+            cache = compositecache.CompositeCache(os.path.join(tmp, 'composites'))
+            window = (slice(0, size), slice(0, size))
+
+            def load(rows, cols):
+                return {band: arr[:, rows, cols] for band, arr in stack.items()}
+
+            def mosaic():
+                return compositecache.mosaic(cache, window, '2019-06-01', '2020-06-01',
+                                             'SR', iw_local.RGBN, load)
+
+            # the first mosaic fills the cache, the repeat run reads it
+            (median, _), seconds, peak = measure(mosaic)
+            if 'composite' in stages:
+                record('composite', seconds, peak, pixels * scenes)
+            hits, misses = cache.hits, cache.misses
+            (cached, _), seconds, peak = measure(mosaic)
+            if 'composite_cached' in stages:
+                record('composite_cached', seconds, peak, pixels * scenes)
+                results['composite_cached'].update({
+                        'hits': cache.hits - hits,
+                        'misses': cache.misses - misses,
+                        'mismatches': int(np.sum(~((median == cached) |
+                                                   (np.isnan(median) & np.isnan(cached)))))})
+            cache = median = cached = None
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+def run_benchmark(sizes=SIZES, stages=STAGES, seed=0, niter=10,
+                  max_pixels=MAX_PIXELS, budget=2**28, workdir=None):
+    """
+    Benchmark every stage on synthetic scenes of each size
+
+    Parameters:
+        sizes (list<int>): scene sides in pixels
+        see run_size() for the other parameters
+
+    Returns:
+        dict: 'meta' describing the run and 'results' keyed by scene side
+        (as a string) and then by stage
+    """
+    meta = {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'seed': seed,
+            'niter': niter,
+            'budget': budget}
+    results = {}
+    for size in sizes:
+        results[str(size)] = run_size(size, stages, seed, niter, max_pixels, budget, workdir)
+        for stage, row in results[str(size)].items():
+            if 'skipped' in row:
+                print(size, stage, 'skipped:', row['skipped'])
+            else:
+                print(size, stage, '{:.2f} s, {:.3g} pixels/s, {:.1f} MB peak'.format(
+                        row['seconds'], row['pixels_per_second'], row['peak_bytes'] / 2**20))
+    return {'meta': meta, 'results': results}
+
+def compare(current, baseline, threshold=0.1):
+    """
+    Compare benchmark results against a baseline
+
+    Parameters:
+        current (dict): output of run_benchmark()
+        baseline (dict): output of an earlier run_benchmark()
+        threshold (float): relative slowdown or memory growth reported as a
+        regression
+
+    Returns:
+        list<dict>: one row per size and stage present in both runs with
+        'size', 'stage', 'speedup' (baseline / current seconds), 'memory'
+        (current / baseline peak bytes) and 'regression'
+    """
+    rows = []
+    for size, stages in current['results'].items():
+        for stage, row in stages.items():
+            base = baseline['results'].get(size, {}).get(stage)
+            if base is None or 'skipped' in row or 'skipped' in base:
+                continue
+            speedup = base['seconds'] / row['seconds']
+            memory = row['peak_bytes'] / base['peak_bytes']
+            rows.append({'size': size, 'stage': stage,
+                         'speedup': speedup, 'memory': memory,
+                         'regression': speedup < 1 / (1 + threshold) or memory > 1 + threshold})
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the local change detection algorithms')
+    parser.add_argument('output', help='JSON file to write results to')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES),
+                        help='comma separated scene sides in pixels')
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--niter', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    out = run_benchmark([int(size) for size in args.sizes.split(',')],
+                        args.stages.split(','), args.seed, args.niter)
+    with open(args.output, 'w') as f:
+        json.dump(out, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows = compare(out, json.load(f), args.threshold)
+        for row in rows:
+            print('{size:>6} {stage:<9} speedup {speedup:.2f}x memory {memory:.2f}x{flag}'.format(
+                    flag=' REGRESSION' if row['regression'] else '', **row))
+        if any(row['regression'] for row in rows):
+            raise SystemExit(1)
@@ -103,19 +103,17 @@ def hist_to_FC(hist, band):
   output = ee.FeatureCollection(array.toList().map(fxn))
   return output 
 
-def make_FC(image, AOI):
+def histograms(image, AOI):
   """
-  create a feature colleciton from the histograms of an images bands
+  calculate the histograms of an images bands
 
   Parameters:
     image (ee.Image): input image
-    AOI (ee.Feaure): area within which to...
+    AOI (ee.Geometry): area within which to calculate histograms
   Returns:
-    ee.List: list of feature collections returned by hist_to_FC
+    ee.Dictionary: output of the histogram reducer, keyed by band
   """
-  # Histogram equalization start:
-  bands = image.bandNames()
-  histo = image.reduceRegion(
+  return image.reduceRegion(
     reducer = ee.Reducer.histogram(
       maxBuckets = math.pow(2, 12)
     ), 
@@ -124,6 +122,20 @@ def make_FC(image, AOI):
     maxPixels = 1e13, 
     tileScale = 12
   )
+
+def make_FC(image, AOI):
+  """
+  create a feature colleciton from the histograms of an images bands
+
+  Parameters:
+    image (ee.Image): input image
+    AOI (ee.Feaure): area within which to...
+  Returns:
+    ee.List: list of feature collections returned by hist_to_FC
+  """
+  # Histogram equalization start:
+  bands = image.bandNames()
+  histo = histograms(image, AOI)
   
   def fxn(band):
     return hist_to_FC(histo, band)
@@ -133,7 +145,75 @@ def make_FC(image, AOI):
   
   return output
 
-def equalize(image1, image2, AOI):
+def hist_to_LUT(hist, band):
+  """
+  convert a histogram of band values to a cdf lookup table
+
+  Args:
+    hist (ee.Dictionary): output of histogram reducer on an image
+    band (str): band name
+
+  Return:
+    ee.Dictionary: lists 'dn' of bucket means and 'probability' of the
+    normalized cummulative probability. Empty buckets are dropped so both
+    lists are strictly increasing, as ee.Image.interpolate requires
+  """
+  valsArray = ee.Array(ee.Dictionary(ee.Dictionary(hist).get(band)).get('bucketMeans'))
+  freqsArray = ee.Array(ee.Dictionary(ee.Dictionary(hist).get(band)).get('histogram'))
+  cdfArray = freqsArray.accum(0)
+  normalizedCdf = cdfArray.divide(cdfArray.get([-1]))
+  full = freqsArray.gt(0)
+  return ee.Dictionary({'dn': valsArray.mask(full).toList(),
+                        'probability': normalizedCdf.mask(full).toList()})
+
+def make_LUT(image, AOI):
+  """
+  create cdf lookup tables from the histograms of an images bands
+
+  Parameters:
+    image (ee.Image): input image
+    AOI (ee.Geometry): area within which to calculate histograms
+  Returns:
+    ee.List: list of dictionaries returned by hist_to_LUT
+  """
+  histo = histograms(image, AOI)
+  return image.bandNames().map(lambda band: hist_to_LUT(histo, band))
+
+def equalize_lut(image1, image2, AOI):
+  """
+  use histogram matching by cdf lookup tables to calibrate two images
+
+  Each band of image2 is mapped DN -> probability -> DN by piecewise linear
+  interpolation in the lookup tables of make_LUT. Values outside the range
+  of a table are clamped to its ends.
+
+  Parameters:
+    image1 (ee.Image): reference image
+    image2 (ee.Image): image to be calibrated
+    AOI (ee.Geometry): area of overlap between the two images
+
+  Returns:
+    ee.Image: image2 with bands calibrated to the histogram(s) of image1 bands
+  """
+  bands = image1.bandNames()
+  nBands = bands.size().subtract(1)
+
+  lut1 = make_LUT(image1, AOI)
+  lut2 = make_LUT(image2, AOI)
+
+  def fxn(i):
+    band = bands.get(i)
+    table1 = ee.Dictionary(ee.List(lut1).get(i))
+    table2 = ee.Dictionary(ee.List(lut2).get(i))
+    # DN -> probability -> DN
+    return image2.select([band])\
+    .interpolate(ee.List(table2.get('dn')), ee.List(table2.get('probability')), 'clamp')\
+    .interpolate(ee.List(table1.get('probability')), ee.List(table1.get('dn')), 'clamp')
+
+  imgList = ee.List.sequence(0, nBands).map(fxn)
+  return ee.ImageCollection(imgList).toBands().rename(bands)
+
+def equalize(image1, image2, AOI, method = 'forest'):
   """
   use histogram matching to calibrate two images
   
@@ -141,10 +221,18 @@ def equalize(image1, image2, AOI):
     image1 (ee.Image): reference image
     image2 (ee.Image): image to be calibrated
     AOI (ee.Geometry): area of overlap between the two images
+    method (str): 'forest' to map DN -> probability -> DN with random
+      forest regressions trained on the histograms, or 'lut' to interpolate
+      in cdf lookup tables, see equalize_lut
 
   Returns:
     ee.Image: image2 with bands calibrated to the histogram(s) of image1 bands
   """
+  if method == 'lut':
+    return equalize_lut(image1, image2, AOI)
+  if method != 'forest':
+    raise ValueError('unknown equalization method: {}'.format(method))
+
   bands = image1.bandNames()
   nBands = bands.size().subtract(1)
   
@@ -181,53 +269,84 @@ def equalize(image1, image2, AOI):
   imgList = ee.List.sequence(0, nBands).map(fxn)
   return ee.ImageCollection(imgList).toBands().rename(bands)
 
-def equalize_collection(imgCol, bands, sceneID):
+def scene_records(imgCol, bands, sceneID):
+  """
+  Compute the median, footprint and centroid longitude of each unique scene
+  once, for reuse by equalize_collection
+
+  Parameters:
+    imgCol (ee.ImageCollection): collection storing images to equalize
+    bands (list<str>): image bands on which to calculate medians
+    sceneID (str): property by which images will be grouped
+
+  Returns:
+    ee.List<ee.Dictionary>: 'id', 'median', 'footprint' and 'longitude' of
+    each scene, sorted by increasing longitude
+  """
+  scenes = ee.List(imgCol.aggregate_array(sceneID)).distinct()
+
+  def record(str):
+    col = imgCol.filter(ee.Filter.eq(sceneID, str))
+    return ee.Dictionary({
+      'id': str,
+      'median': col.median().select(bands).set(sceneID, str),
+      'footprint': col.geometry(5).dissolve(),
+      'longitude': col.geometry(1).centroid(1).coordinates().get(0)})
+
+  records = scenes.map(record)
+  longitudes = records.map(lambda rec: ee.Dictionary(rec).get('longitude'))
+  return records.sort(longitudes)
+
+def equalize_collection(imgCol, bands, sceneID, method = 'forest'):
   """ 
   histogram equalize images in a collection by unique orbit path
 
+  Scene medians, footprints and longitudes are computed once by
+  scene_records, and the overlaps of successive scenes, which do not depend
+  on each other, are mapped over all pairs ahead of the iteration. Only the
+  equalization itself, which needs the previous equalized scene, runs in
+  sequence.
+
   Parameters:
     imgCol (ee.ImageCollection): collection storing images to equalize
     bands (list<str>): list of band names to be calibrated
     sceneID (str): property by which images will be grouped
+    method (str): equalization method passed to equalize
 
   Returns:
     ee.ImageCollection: median images per scene equalized to the westernmost path
   """
-  # first get list of all scene IDs
-  scenes = ee.List(imgCol.aggregate_array(sceneID)).distinct()
-  # create an image collection of scene medians
-  medians = scene_median(imgCol, bands, sceneID)
-  # define a function to return the centroid longitude of each scene
-  def get_longitude(str):
-    centroids = imgCol.filter(ee.Filter.eq(sceneID, str)).geometry(1).centroid(1)
-    longs = centroids.coordinates().get(0)
-    return longs
-  # create a list of centroid longitudes
-  coords = scenes.map(get_longitude)
-  # sort the scenes by increasing longitude
-  scenes = scenes.sort(coords)
+  records = scene_records(imgCol, bands, sceneID)
+
+  # overlap of each scene with the scene to its west
+  def overlap(pair):
+    pair = ee.List(pair)
+    footprint1 = ee.Geometry(ee.Dictionary(pair.get(0)).get('footprint'))
+    footprint2 = ee.Geometry(ee.Dictionary(pair.get(1)).get('footprint'))
+    intersect = footprint1.intersection(footprint2, 5)
+    return ee.Dictionary({
+      'median': ee.Dictionary(pair.get(1)).get('median'),
+      'overlap': intersect,
+      'area': intersect.area(5)})
+
+  pairs = records.slice(0, -1).zip(records.slice(1)).map(overlap)
+
   # define a function that will equalize the list of scenes in succession
-  def iterate_equalize(scene, prev):
-    # take the previous median image
+  def iterate_equalize(pair, prev):
+    pair = ee.Dictionary(pair)
     prev = ee.List(prev)
+    # take the previous (equalized) median image
     img1 = ee.Image(prev.get(-1))
-    # take the next median image
-    img2 = ee.Image(medians.filter(ee.Filter.eq(sceneID, scene)).first())
-    # filter image collection to the previous scene
-    index = scenes.indexOf(scene).subtract(1)
-    imgCol1 = imgCol.filter(ee.Filter.eq(sceneID, scenes.get(index)))
-    #imgCol1 = imgCol.filter(ee.Filter.eq(sceneID, prev))
-    # filter image collection to the next scene
-    imgCol2 = imgCol.filter(ee.Filter.eq(sceneID, scene))
-    overlap = get_overlap(imgCol1, imgCol2)
+    img2 = ee.Image(pair.get('median'))
     # if there is overlap between collections, equalize (returns image)
     # otherwise return the current image
-    equalized = ee.Algorithms.If(overlap.area(5).gt(0), equalize(img1, img2, overlap), img2)
-    update = ee.List(prev).add(equalized)
-    return update
-  # create a list of successively equalized scenes
-  # initial value for iterate is the first median scene
-  first = ee.Image(medians.filter(ee.Filter.eq(sceneID, scenes.get(0))).first())
-  # take all but the first scene median and iteratively equalize
-  output = scenes.slice(1).iterate(iterate_equalize, ee.List([first]))
-  return ee.ImageCollection.fromImages(output)
\ No newline at end of file
+    equalized = ee.Algorithms.If(
+      ee.Number(pair.get('area')).gt(0),
+      equalize(img1, img2, ee.Geometry(pair.get('overlap')), method),
+      img2)
+    return prev.add(equalized)
+
+  # initial value for iterate is the westernmost median scene
+  first = ee.Image(ee.Dictionary(records.get(0)).get('median'))
+  output = pairs.iterate(iterate_equalize, ee.List([first]))
+  return ee.ImageCollection.fromImages(output)
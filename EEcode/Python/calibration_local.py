@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Local NumPy implementation of the lookup table histogram matching in
+calibration.py
+
+Images are dictionaries mapping band names to 2D arrays of equal shape,
+with masked pixels set to NaN. Histograms are taken over every unmasked
+pixel of the arrays passed, so callers clip both images to their overlap
+first, as calibration.equalize does with its AOI.
+"""
+
+import numpy as np
+
+# bucket limit of the histograms, as in calibration.histograms
+MAX_BUCKETS = 2 ** 12
+
+def histogram(values, maxBuckets=MAX_BUCKETS):
+    """
+    Equal width histogram of the unmasked values of an array
+
+    Parameters:
+        values (np.ndarray): array of observations
+        maxBuckets (int): number of buckets spanning the range of values
+
+    Returns:
+        tuple: 1D arrays (bucketMeans, counts) of the occupied buckets, the
+        mean of the values in each bucket as reported by
+        ee.Reducer.histogram
+    """
+    values = values[np.isfinite(values)].astype(float)
+    lo, hi = values.min(), values.max()
+    if hi == lo:
+        return np.array([lo]), np.array([values.size])
+    keys = np.minimum(((values - lo) / (hi - lo) * maxBuckets).astype(np.int64), maxBuckets - 1)
+    counts = np.bincount(keys, minlength=maxBuckets)
+    sums = np.bincount(keys, weights=values, minlength=maxBuckets)
+    occupied = counts > 0
+    return sums[occupied] / counts[occupied], counts[occupied]
+
+def lookup_table(values, maxBuckets=MAX_BUCKETS):
+    """
+    Cumulative distribution lookup table of an array, see calibration.hist_to_LUT
+
+    Returns:
+        tuple: strictly increasing 1D arrays (dn, probability)
+    """
+    dn, counts = histogram(values, maxBuckets)
+    cdf = np.cumsum(counts, dtype=float)
+    return dn, cdf / cdf[-1]
+
+def match(values, table, reference):
+    """
+    Map values DN -> probability -> DN by piecewise linear interpolation
+
+    Values outside the range of a table are clamped to its ends, as
+    ee.Image.interpolate does with behavior 'clamp'. Masked values stay
+    masked.
+
+    Parameters:
+        values (np.ndarray): values to calibrate
+        table (tuple): lookup_table() of the image of values
+        reference (tuple): lookup_table() of the reference image
+
+    Returns:
+        np.ndarray: calibrated values
+    """
+    probability = np.interp(values, table[0], table[1])
+    return np.interp(probability, reference[1], reference[0])
+
+def equalize(image1, image2, bands=None, maxBuckets=MAX_BUCKETS):
+    """
+    Use histogram matching to calibrate two images
+
+    Parameters:
+        image1 (dict): reference image
+        image2 (dict): image to be calibrated
+        bands (list<str>): bands to calibrate, default all bands of image1
+        maxBuckets (int): histogram buckets per band
+
+    Returns:
+        dict: bands of image2 calibrated to the histograms of image1 bands
+    """
+    bands = list(image1) if bands is None else bands
+    return {band: match(image2[band],
+                        lookup_table(image2[band], maxBuckets),
+                        lookup_table(image1[band], maxBuckets))
+            for band in bands}
+
+def ks_distance(values1, values2):
+    """
+    Largest difference between the empirical distributions of two arrays
+
+    The Kolmogorov-Smirnov statistic, used to report how closely an
+    equalized band matches its reference. Masked values are ignored.
+
+    Returns:
+        float: maximum absolute difference of the two CDFs, in [0, 1]
+    """
+    a = np.sort(values1[np.isfinite(values1)], axis=None)
+    b = np.sort(values2[np.isfinite(values2)], axis=None)
+    points = np.concatenate([a, b])
+    cdf1 = np.searchsorted(a, points, side='right') / a.size
+    cdf2 = np.searchsorted(b, points, side='right') / b.size
+    return float(np.max(np.abs(cdf1 - cdf2)))
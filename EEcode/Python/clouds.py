@@ -1,10 +1,10 @@
 # Import the Earth Engine Python Package
+import re
 import ee
+import session
 
-# Initialize Earth Engine
-ee.Initialize()
-
-JRC = ee.ImageCollection("JRC/GSW1_1/YearlyHistory")
+# Earth Engine is initialized by session on first use
+JRC = session.asset('ImageCollection', "JRC/GSW1_1/YearlyHistory")
 
 def sentinel2toa(img):
     """
@@ -75,6 +75,79 @@ def waterScore(img):
 
     return score.clamp(0, 1).rename(['waterScore'])
 
+# Rescale rules of sentinelCloudScore and waterScore as data. Each rule is
+# (expression of TOA reflectance bands, [low, high] thresholds, clamp), and
+# a score is the minimum of 1 and every rescaled rule
+CLOUD_RULES = [
+    ('B2', [0.1, 0.5], False),
+    ('B1', [0.1, 0.3], False),
+    ('B1 + B10', [0.15, 0.2], False),
+    ('B4 + B3 + B2', [0.2, 0.8], False),
+    ('(B8 - B11) / (B8 + B11)', [-0.1, 0.1], False),
+    ('(B3 - B11) / (B3 + B11)', [0.8, 0.6], False)]
+
+# the population mean and standard deviation of the dark bands B3, B4, B8,
+# B11 and B12, as reduced by ee.Reducer.mean and ee.Reducer.stdDev
+_DARK_MEAN = '((B3 + B4 + B8 + B11 + B12) / 5)'
+_DARK_STD = 'sqrt(({}) / 5)'.format(' + '.join(
+        '(' + band + ' - ' + _DARK_MEAN + ') ** 2' for band in ['B3', 'B4', 'B8', 'B11', 'B12']))
+
+WATER_RULES = [
+    ('B8 + B11 + B12', [0.35, 0.2], True),
+    ('(B2 - ' + _DARK_STD + ') / ' + _DARK_MEAN, [0, 1], True),
+    ('(B3 - B11) / (B3 + B11)', [0.3, 0.8], False)]
+
+def compile_rules(rules):
+    """
+    Compile rescale rules into a single ee.Image.expression string
+
+    Band names in the rules are read from the image variable 'toa'. Each
+    rule is rescaled with the thresholds in the order rescale() applies
+    them, with the threshold range computed in Python as rescale() does, so
+    the expression reproduces the step by step score.
+
+    Parameters:
+        rules (list<tuple>): (expression, [low, high], clamp) rules
+
+    Returns:
+        str: expression of min(1, rule 1, rule 2, ...)
+    """
+    score = '1'
+    for expression, thresholds, clamp in rules:
+        term = '(({}) - {}) / {}'.format(re.sub(r'\bB\d+A?\b', r'toa.\g<0>', expression),
+                                         repr(thresholds[0]),
+                                         repr(thresholds[1] - thresholds[0]))
+        if clamp:
+            term = 'min(max({}, 0), 1)'.format(term)
+        score = 'min({}, {})'.format(score, term)
+    return score
+
+CLOUD_SCORE = compile_rules(CLOUD_RULES)
+WATER_SCORE = compile_rules(WATER_RULES)
+
+def sentinelCloudScoreExpr(img):
+    """
+    Compute sentinelCloudScore as a single compiled expression
+    Parameters:
+        img (ee.Image): Sentinel-2 image
+    Returns:
+        ee.Image: original image with added ['cloudScore'] band
+    """
+    toa = img.divide(10000)
+    score = img.expression(CLOUD_SCORE, {'toa': toa}).multiply(100).byte()
+    return img.addBands(score.rename(['cloudScore']))
+
+def waterScoreExpr(img):
+    """
+    Compute waterScore as a single compiled expression
+    Parameters:
+        img (ee.Image): Sentinel-2 image
+    Returns:
+        ee.Image: image with single ['waterScore'] band
+    """
+    toa = img.divide(10000)
+    return img.expression(WATER_SCORE, {'toa': toa}).clamp(0, 1).rename(['waterScore'])
+
 def basicQA(img):
     """
     Mask clouds in a Sentinel-2 image using builg in quality assurance band
@@ -179,9 +252,9 @@ def mask(img):
     month = date.get('month')
     cdi = ee.Algorithms.Sentinel2.CDI(img)
     scored = basicQA(img)
-    clouds = sentinelCloudScore(scored).lte(15).Or(cdi.gte(-0.2))
-    water = waterScore(img).select('waterScore').lte(0.25)
-    jrc = ee.Image(JRC.filterMetadata('month', 'equals', month).filterMetadata('year', 'equals', year).first())
+    clouds = sentinelCloudScoreExpr(scored).lte(15).Or(cdi.gte(-0.2))
+    water = waterScoreExpr(img).select('waterScore').lte(0.25)
+    jrc = ee.Image(JRC().filterMetadata('month', 'equals', month).filterMetadata('year', 'equals', year).first())
     waterMask = jrc.focal_max(1, 'square', 'pixels').neq(2).And(water)
     shadowMask = img.select('B11').gt(900)
     return scored.updateMask(clouds.And(shadowMask).And(waterMask))
@@ -217,9 +290,9 @@ def maskTOA(img):
     #month = date.get('month')
     #cdi = ee.Algorithms.Sentinel2.CDI(img)
     scored = basicQA(img)
-    cloudMask = sentinelCloudScore(scored).select('cloudScore').lte(15)#.Or(cdi.gte(-0.2))
-    water = waterScore(img).select('waterScore').lte(0.25)
-    jrc = ee.Image(JRC.filterMetadata('year', 'equals', year).first())
+    cloudMask = sentinelCloudScoreExpr(scored).select('cloudScore').lte(15)#.Or(cdi.gte(-0.2))
+    water = waterScoreExpr(img).select('waterScore').lte(0.25)
+    jrc = ee.Image(JRC().filterMetadata('year', 'equals', year).first())
     watermask = water.where(jrc.gte(2), 0)
     shadowMask = img.select('B11').gt(900)
     return scored.updateMask(cloudMask.And(shadowMask).And(watermask))
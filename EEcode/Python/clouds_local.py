@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Local NumPy implementation of the Sentinel-2 masks in clouds.py
+
+Scenes are dictionaries mapping band names to arrays of raw digital numbers
+(reflectance * 10000), with masked pixels set to NaN. The functions named
+after those in clouds.py translate them step by step, allocating a full
+scene temporary for every step, and serve as the reference.
+
+mask_stack() computes the same masks for a stack of scenes in a single
+fused pass per tile: each tile of each scene is read once, and every score
+is accumulated in a few preallocated tile buffers with in-place ufuncs.
+The rescale thresholds are converted to digital numbers up front so the
+bands are never divided by 10000, and the normalized difference of B3 and
+B11 is shared by the cloud and water scores.
+"""
+
+import numpy as np
+
+# QA60 bits 10 and 11 flag opaque clouds and cirrus
+QA_BITS = 1024 | 2048
+
+# SCL classes removed by maskSR: dark area (2), cloud shadow (3), water (6),
+# cloud medium / high probability (8, 9), cirrus (10) and snow (11)
+SCL_MASKED = [2, 3, 6, 8, 9, 10, 11]
+
+# bands read by each kind of mask
+TOA_BANDS = ['QA60', 'B1', 'B2', 'B3', 'B4', 'B8', 'B10', 'B11', 'B12']
+SR_BANDS = ['QA60', 'SCL']
+
+# JRC yearly history water class from which pixels are treated as water
+JRC_WATER = 2
+
+# rows of each tile processed by mask_stack
+BLOCK_ROWS = 256
+
+# scale of the digital numbers to the top of atmosphere reflectance used
+# by clouds.sentinel2toa
+DN_SCALE = 10000.0
+
+def _errstate():
+    # masked (NaN) pixels and zero sums are expected in every step
+    return np.errstate(invalid='ignore', divide='ignore')
+
+def sentinel2toa(img):
+    """
+    Convert raw digital numbers to top of atmosphere reflectance
+    """
+    out = {'QA60': img['QA60']}
+    out.update({band: img[band] / DN_SCALE for band in img if band.startswith('B')})
+    return out
+
+def rescale(img, thresholds):
+    """
+    Linearly rescale an array so thresholds map to 0 and 1
+    """
+    return (img - thresholds[0]) / (thresholds[1] - thresholds[0])
+
+def normalizedDifference(x, y):
+    return (x - y) / (x + y)
+
+def basicQA(img):
+    """
+    Mask clouds and cirrus flagged in the QA60 band
+
+    Returns:
+        dict: image with pixels masked where either flag is set
+    """
+    qa = img['QA60']
+    keep = ~np.isnan(qa) & (np.nan_to_num(qa).astype(np.int64) & QA_BITS == 0)
+    return {band: np.where(keep, arr, np.nan) for band, arr in img.items()}
+
+def sentinelCloudScore(img):
+    """
+    Compute the cloud likelihood score of clouds.sentinelCloudScore
+
+    Returns:
+        np.ndarray: cloudScore [0, 100] with NaN where masked
+    """
+    with _errstate():
+        im = sentinel2toa(img)
+        score = np.ones(im['B2'].shape)
+        score = np.minimum(score, rescale(im['B2'], [0.1, 0.5]))
+        score = np.minimum(score, rescale(im['B1'], [0.1, 0.3]))
+        score = np.minimum(score, rescale(im['B1'] + im['B10'], [0.15, 0.2]))
+        score = np.minimum(score, rescale(im['B4'] + im['B3'] + im['B2'], [0.2, 0.8]))
+        ndmi = normalizedDifference(im['B8'], im['B11'])
+        score = np.minimum(score, rescale(ndmi, [-0.1, 0.1]))
+        ndsi = normalizedDifference(im['B3'], im['B11'])
+        score = np.minimum(score, rescale(ndsi, [0.8, 0.6]))
+        # multiply(100).byte()
+        score = score * 100
+        return np.where(np.isnan(score), np.nan, np.trunc(np.clip(score, 0, 255)))
+
+def waterScore(img):
+    """
+    Compute the water likelihood score of clouds.waterScore
+
+    Returns:
+        np.ndarray: waterScore [0, 1] with NaN where masked
+    """
+    with _errstate():
+        im = sentinel2toa(img)
+        score = np.ones(im['B2'].shape)
+        total = im['B8'] + im['B11'] + im['B12']
+        score = np.minimum(score, np.clip(rescale(total, [0.35, 0.2]), 0, 1))
+        dark = np.stack([im[band] for band in ['B3', 'B4', 'B8', 'B11', 'B12']])
+        mean = dark.mean(axis=0)
+        std = dark.std(axis=0)
+        z = (im['B2'] - std) / mean
+        score = np.minimum(score, np.clip(rescale(z, [0, 1]), 0, 1))
+        ndsi = normalizedDifference(im['B3'], im['B11'])
+        score = np.minimum(score, rescale(ndsi, [0.3, 0.8]))
+        return np.clip(score, 0, 1)
+
+def maskSR(img, jrc=None):
+    """
+    Apply the built in masks to a Sentinel-2 surface reflectance scene
+
+    Parameters:
+        img (dict): level 2A scene with 'QA60' and 'SCL' bands
+        jrc (np.ndarray): optional JRC yearly history water class
+
+    Returns:
+        dict: masked image
+    """
+    scored = basicQA(img)
+    scl = img['SCL']
+    keep = ~np.isnan(scl)
+    for value in SCL_MASKED:
+        keep &= scl != value
+    if jrc is not None:
+        keep &= ~(jrc >= JRC_WATER)
+    return {band: np.where(keep, arr, np.nan) for band, arr in scored.items()}
+
+def maskTOA(img, jrc=None):
+    """
+    Mask a Sentinel-2 top of atmosphere scene for clouds, water and shadow
+
+    Parameters:
+        img (dict): level 1C scene with the TOA_BANDS
+        jrc (np.ndarray): optional JRC yearly history water class
+
+    Returns:
+        dict: masked image
+    """
+    scored = basicQA(img)
+    with _errstate():
+        keep = sentinelCloudScore(scored) <= 15
+        keep &= waterScore(img) <= 0.25
+        if jrc is not None:
+            keep &= ~(jrc >= JRC_WATER)
+        keep &= img['B11'] > 900
+    return {band: np.where(keep, arr, np.nan) for band, arr in scored.items()}
+
+# True for the SCL classes kept by maskSR
+SCL_LOOKUP = np.ones(16, dtype=bool)
+SCL_LOOKUP[SCL_MASKED] = False
+
+class _Buffers(object):
+    """
+    Preallocated tile buffers reused by every tile of mask_stack
+    """
+
+    def __init__(self, rows, cols):
+        self.floats = np.empty((5, rows, cols))
+        self.ints = np.empty((rows, cols), dtype=np.int64)
+        self.flags = np.empty((rows, cols), dtype=bool)
+
+    def view(self, rows):
+        """
+        Buffers for a tile of the given number of rows: (score, ndsi, t1,
+        t2, t3, ints, flags)
+        """
+        return list(self.floats[:, :rows]) + [self.ints[:rows], self.flags[:rows]]
+
+def _rescale_min(x, low, high, score, out, clip=False):
+    """
+    score = min(score, rescale(x, [low, high])) in place, using out
+    """
+    np.subtract(x, low, out=out)
+    np.multiply(out, 1 / (high - low), out=out)
+    if clip:
+        np.clip(out, 0, 1, out=out)
+    np.minimum(score, out, out=score)
+
+def _nd(x, y, out, tmp):
+    np.subtract(x, y, out=out, dtype=float)
+    np.add(x, y, out=tmp, dtype=float)
+    np.divide(out, tmp, out=out)
+
+def _qa_keep(qa, keep, ints, flags):
+    """
+    Set keep where QA60 is unmasked with the cloud and cirrus bits clear
+    """
+    np.isnan(qa, out=keep)
+    np.logical_not(keep, out=keep)
+    ints.fill(0)
+    np.copyto(ints, qa, where=keep, casting='unsafe')
+    np.bitwise_and(ints, QA_BITS, out=ints)
+    np.equal(ints, 0, out=flags)
+    keep &= flags
+
+def _toa_tile(b, keep, buffers):
+    """
+    Fused maskTOA of one tile: b maps band names to tile arrays, keep is
+    the boolean output tile. Bands may be unsigned integer digital numbers,
+    so every ufunc of two bands runs in float (dtype=float) rather than
+    wrapping around in the integer loop before the cast to the buffer
+    """
+    score, ndsi, t1, t2, t3, ints, flags = buffers
+    _qa_keep(b['QA60'], keep, ints, flags)
+
+    # cloud score, with the reflectance thresholds in digital numbers
+    dn = DN_SCALE
+    score.fill(1)
+    _rescale_min(b['B2'], 0.1 * dn, 0.5 * dn, score, t1)
+    _rescale_min(b['B1'], 0.1 * dn, 0.3 * dn, score, t1)
+    np.add(b['B1'], b['B10'], out=t2, dtype=float)
+    _rescale_min(t2, 0.15 * dn, 0.2 * dn, score, t1)
+    np.add(b['B4'], b['B3'], out=t2, dtype=float)
+    np.add(t2, b['B2'], out=t2)
+    _rescale_min(t2, 0.2 * dn, 0.8 * dn, score, t1)
+    _nd(b['B8'], b['B11'], t2, t1)
+    _rescale_min(t2, -0.1, 0.1, score, t1)
+    _nd(b['B3'], b['B11'], ndsi, t1)
+    _rescale_min(ndsi, 0.8, 0.6, score, t1)
+    # trunc(clip(100 * score, 0, 255)) <= 15 is 100 * score < 16
+    np.multiply(score, 100, out=score)
+    np.less(score, 16, out=flags)
+    keep &= flags
+
+    # water score
+    score.fill(1)
+    np.add(b['B8'], b['B11'], out=t2, dtype=float)
+    np.add(t2, b['B12'], out=t2)
+    _rescale_min(t2, 0.35 * dn, 0.2 * dn, score, t1, clip=True)
+    # population mean (t2) and standard deviation (t1) of the dark bands
+    dark = [b[band] for band in ['B3', 'B4', 'B8', 'B11', 'B12']]
+    np.add(dark[0], dark[1], out=t2, dtype=float)
+    for arr in dark[2:]:
+        np.add(t2, arr, out=t2)
+    np.multiply(t2, 1 / len(dark), out=t2)
+    t1.fill(0)
+    for arr in dark:
+        np.subtract(arr, t2, out=t3)
+        np.square(t3, out=t3)
+        np.add(t1, t3, out=t1)
+    np.multiply(t1, 1 / len(dark), out=t1)
+    np.sqrt(t1, out=t1)
+    np.subtract(b['B2'], t1, out=t1)
+    np.divide(t1, t2, out=t1)
+    np.clip(t1, 0, 1, out=t1)
+    np.minimum(score, t1, out=score)
+    _rescale_min(ndsi, 0.3, 0.8, score, t1)
+    np.less_equal(score, 0.25, out=flags)
+    keep &= flags
+
+    np.greater(b['B11'], 900, out=flags)
+    keep &= flags
+
+def _sr_tile(b, keep, buffers):
+    """
+    Fused maskSR of one tile, looking up the kept SCL classes
+    """
+    score, ndsi, t1, t2, t3, ints, flags = buffers
+    _qa_keep(b['QA60'], keep, ints, flags)
+    np.isnan(b['SCL'], out=flags)
+    np.logical_not(flags, out=flags)
+    keep &= flags
+    ints.fill(0)
+    np.copyto(ints, b['SCL'], where=keep, casting='unsafe')
+    np.clip(ints, 0, SCL_LOOKUP.size - 1, out=ints)
+    np.take(SCL_LOOKUP, ints, out=flags)
+    keep &= flags
+
+def mask_stack(stack, kind='TOA', jrc=None, out=None, block_rows=BLOCK_ROWS):
+    """
+    Compute maskTOA or maskSR for every scene of a stack in one fused pass
+    per tile
+
+    Parameters:
+        stack (dict): band name to (scenes, rows, cols) array of digital
+        numbers, e.g. np.memmap arrays; only the bands of the mask are read
+        kind (str): 'TOA' for maskTOA or 'SR' for maskSR
+        jrc (np.ndarray): optional JRC water class, (rows, cols) or one
+        (scenes, rows, cols) layer per scene
+        out (np.ndarray): optional preallocated boolean (scenes, rows, cols)
+        output
+        block_rows (int): rows of each tile
+
+    Returns:
+        np.ndarray: boolean (scenes, rows, cols) array, True for pixels kept
+    """
+    if kind not in ('TOA', 'SR'):
+        raise ValueError("kind must be 'TOA' or 'SR', got {}".format(kind))
+    bands = TOA_BANDS if kind == 'TOA' else SR_BANDS
+    kernel = _toa_tile if kind == 'TOA' else _sr_tile
+    scenes, rows, cols = stack[bands[0]].shape
+    if out is None:
+        out = np.empty((scenes, rows, cols), dtype=bool)
+    buffers = _Buffers(min(block_rows, rows), cols)
+    with _errstate():
+        for start in range(0, rows, block_rows):
+            window = slice(start, min(start + block_rows, rows))
+            views = buffers.view(window.stop - window.start)
+            for scene in range(scenes):
+                b = {band: stack[band][scene, window] for band in bands}
+                keep = out[scene, window]
+                kernel(b, keep, views)
+                if jrc is not None:
+                    water = jrc[scene, window] if jrc.ndim == 3 else jrc[window]
+                    keep &= ~(water >= JRC_WATER)
+    return out
+
+def apply_mask(stack, keep, bands=None):
+    """
+    Set the pixels not kept to NaN in place, for float stacks
+
+    Parameters:
+        stack (dict): band name to (scenes, rows, cols) float array
+        keep (np.ndarray): output of mask_stack()
+        bands (list<str>): bands to mask, defaults to all
+    """
+    for band in bands or list(stack):
+        np.copyto(stack[band], np.nan, where=~keep)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache for terrain correction coefficients
+
+Entries are (bands, rows, cols) arrays stored as .npy files and returned as
+read-only memory maps. An index.json file records the band names, size and
+creation / last use times of each entry. Entries older than max_age are
+dropped, then the least recently used entries are evicted until the cache
+fits within max_bytes.
+"""
+
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+def cache_key(aoi, bands, dem, start, end):
+    """
+    Build a cache key for the c_correct coefficients of an AOI
+
+    Parameters:
+        aoi (dict): client side GeoJSON geometry of the area of interest,
+        e.g. the 'geometry' of a batch manifest entry
+        bands (list<str>): corrected bands
+        dem (str): id of the digital elevation model
+        start (str): start of the collection window, 'YYYY-MM-DD'
+        end (str): end of the collection window, 'YYYY-MM-DD'
+
+    Returns:
+        str: hexadecimal digest
+    """
+    # an ee.Geometry would need a blocking round trip to serialize
+    if not isinstance(aoi, dict):
+        raise TypeError('aoi must be a GeoJSON dict, got {}'.format(type(aoi).__name__))
+    parts = [aoi, list(bands), dem, str(start), str(end)]
+    text = json.dumps(parts, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class CoefficientCache(object):
+    """
+    Size and age bounded cache of memory-mapped coefficient arrays
+
+    Parameters:
+        directory (str): cache directory, created if needed
+        max_bytes (int): maximum total size of cached arrays
+        max_age (float): maximum age of an entry in seconds
+    """
+
+    def __init__(self, directory, max_bytes=2**32, max_age=30 * 86400):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.index = self._read_index()
+
+    def _index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def _read_index(self):
+        try:
+            with open(self._index_path()) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_index(self):
+        tmp = self._index_path() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self._index_path())
+
+    def _remove(self, key):
+        entry = self.index.pop(key)
+        try:
+            os.remove(os.path.join(self.directory, entry['file']))
+        except OSError:
+            pass
+
+    def get(self, key):
+        """
+        Look up an entry
+
+        Parameters:
+            key (str): output of cache_key()
+
+        Returns:
+            tuple: (read-only memory-mapped array, list of band names), or
+            None if the key is missing or expired
+        """
+        entry = self.index.get(key)
+        now = time.time()
+        if entry is None or now - entry['created'] > self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry['used'] = now
+        self._write_index()
+        arr = np.load(os.path.join(self.directory, entry['file']), mmap_mode='r')
+        return arr, entry['bands']
+
+    def put(self, key, arr, bands):
+        """
+        Store an array, evicting old entries as needed. An array larger
+        than max_bytes on its own raises ValueError, since eviction would
+        drop it as soon as it was stored
+
+        Parameters:
+            key (str): output of cache_key()
+            arr (np.ndarray): (bands, rows, cols) coefficient array
+            bands (list<str>): band names of the first axis of arr
+        """
+        if arr.nbytes > self.max_bytes:
+            raise ValueError('entry of {} bytes exceeds the cache quota of {} bytes'.format(
+                    arr.nbytes, self.max_bytes))
+        if key in self.index:
+            self._remove(key)
+        name = key + '.npy'
+        out = np.lib.format.open_memmap(os.path.join(self.directory, name),
+                                        mode='w+', dtype=arr.dtype, shape=arr.shape)
+        out[:] = arr
+        out.flush()
+        del out
+        now = time.time()
+        self.index[key] = {'file': name, 'bands': list(bands), 'bytes': int(arr.nbytes),
+                           'created': now, 'used': now}
+        self.evict()
+
+    def evict(self):
+        """
+        Drop expired entries, then least recently used entries over max_bytes
+        """
+        now = time.time()
+        for key in [k for k, e in self.index.items() if now - e['created'] > self.max_age]:
+            self._remove(key)
+        total = sum(e['bytes'] for e in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]['used']):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]['bytes']
+            self._remove(key)
+        self._write_index()
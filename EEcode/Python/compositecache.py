@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk store of masked median composites, by grid tile
+
+The median() composites that iw.runIW and analyze_mad build from masked
+collections are shared by overlapping AOIs and repeat runs. Here the grid
+is cut into TILE x TILE pixel tiles and the masked median and valid pixel
+count of each tile are stored as a (bands + 1, rows, cols) float32 array,
+the count last, keyed by tile, date range, mask variant and band set.
+Entries are memory-mapped .npy files in a coeffcache.CoefficientCache, so
+they are evicted least recently used first to fit a disk quota, and hits
+and misses are counted.
+
+    cache = compositecache.CompositeCache('composites', max_bytes=2**34)
+    median, count = compositecache.mosaic(cache, window, '2019-06-01',
+                                          '2020-06-01', 'SR', RGBN, load)
+"""
+
+import hashlib
+import json
+import warnings
+import numpy as np
+import clouds_local
+import coeffcache
+
+# rows and columns of a grid tile
+TILE = 512
+
+def composite_key(tile, start, end, mask, bands, grid=''):
+    """
+    Build a cache key for the composite of a tile
+
+    Parameters:
+        tile (tuple): (row, col) index of the tile in the grid
+        start (str): start of the date range, 'YYYY-MM-DD'
+        end (str): end of the date range, 'YYYY-MM-DD'
+        mask (str): mask variant, 'TOA' for maskTOA or 'SR' for maskSR
+        bands (list<str>): composited bands
+        grid (str): id of the pixel grid, e.g. CRS and origin, when the
+        cache holds composites of several grids
+
+    Returns:
+        str: hexadecimal digest
+    """
+    parts = [grid, list(tile), str(start), str(end), mask, list(bands)]
+    text = json.dumps(parts, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class CompositeCache(coeffcache.CoefficientCache):
+    """
+    Disk quota bounded cache of memory-mapped tile composites
+
+    Composites of past date ranges do not go stale, so by default entries
+    only leave the cache by LRU eviction.
+
+    Parameters:
+        directory (str): cache directory, created if needed
+        max_bytes (int): maximum total size of cached composites
+        max_age (float): maximum age of an entry in seconds
+    """
+
+    def __init__(self, directory, max_bytes=2**34, max_age=float('inf')):
+        super(CompositeCache, self).__init__(directory, max_bytes, max_age)
+
+def masked_median(stack, keep, bands):
+    """
+    Per pixel median of the kept pixels of each band, and their count
+
+    Parameters:
+        stack (dict): band name to (scenes, rows, cols) array
+        keep (np.ndarray): boolean (scenes, rows, cols) array of pixels
+        kept, e.g. from clouds_local.mask_stack()
+        bands (list<str>): composited bands
+
+    Returns:
+        np.ndarray: float32 (bands + 1, rows, cols) array, the count last
+    """
+    valid = keep & np.all([np.isfinite(stack[band]) for band in bands], axis=0)
+    out = np.empty((len(bands) + 1,) + valid.shape[1:], dtype=np.float32)
+    with warnings.catch_warnings():
+        # pixels masked in every scene stay NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for i, band in enumerate(bands):
+            out[i] = np.nanmedian(np.where(valid, stack[band], np.nan), axis=0)
+    out[-1] = valid.sum(axis=0)
+    return out
+
+def median(cache, tile, start, end, mask, bands, load, grid=''):
+    """
+    Masked median and count composite of one tile, read from the cache or
+    computed and stored
+
+    Parameters:
+        cache (CompositeCache): composite cache
+        tile (tuple): (row, col) index of the tile in the grid
+        start (str): start of the date range, 'YYYY-MM-DD'
+        end (str): end of the date range, 'YYYY-MM-DD'
+        mask (str): 'TOA' or 'SR', see clouds_local.mask_stack()
+        bands (list<str>): composited bands
+        load (function): called with the (rows, cols) slices of the tile on
+        a miss only, returns the scenes of the date range as a dict of
+        (scenes, rows, cols) arrays of digital numbers, with the bands and
+        those read by the mask
+        grid (str): id of the pixel grid, see composite_key()
+
+    Returns:
+        tuple: (bands, rows, cols) median and (rows, cols) count arrays,
+        read-only memory maps on a hit
+    """
+    key = composite_key(tile, start, end, mask, bands, grid)
+    hit = cache.get(key)
+    if hit is not None and list(hit[1]) == list(bands) + ['count']:
+        return hit[0][:-1], hit[0][-1]
+    stack = load(*tile_window(tile))
+    out = masked_median(stack, clouds_local.mask_stack(stack, mask), bands)
+    cache.put(key, out, list(bands) + ['count'])
+    return out[:-1], out[-1]
+
+def tile_window(tile):
+    """
+    (rows, cols) slices of a tile in the grid
+    """
+    row, col = tile
+    return (slice(row * TILE, (row + 1) * TILE), slice(col * TILE, (col + 1) * TILE))
+
+def mosaic(cache, window, start, end, mask, bands, load, grid=''):
+    """
+    Masked median and count composite of a window of the grid, e.g. the
+    bounding box of an AOI, assembled from the composites of the tiles it
+    touches
+
+    Parameters:
+        window (tuple): (rows, cols) slices of the grid
+        load (function): called with the (rows, cols) slices of each
+        missing tile, see median(). Tiles at the edge of the grid may be
+        loaded smaller than TILE
+
+    Other parameters are those of median().
+
+    Returns:
+        tuple: (bands, rows, cols) median and (rows, cols) count arrays of
+        the window
+    """
+    rows, cols = window
+    shape = (rows.stop - rows.start, cols.stop - cols.start)
+    out = np.full((len(bands),) + shape, np.nan, dtype=np.float32)
+    count = np.zeros(shape, dtype=np.float32)
+    for row in range(rows.start // TILE, (rows.stop - 1) // TILE + 1):
+        for col in range(cols.start // TILE, (cols.stop - 1) // TILE + 1):
+            med, n = median(cache, (row, col), start, end, mask, bands, load, grid)
+            r0, c0 = row * TILE, col * TILE
+            # overlap of the tile and the window, in window coordinates
+            r = slice(max(rows.start, r0) - rows.start,
+                      min(rows.stop, r0 + n.shape[0]) - rows.start)
+            c = slice(max(cols.start, c0) - cols.start,
+                      min(cols.stop, c0 + n.shape[1]) - cols.start)
+            src = (slice(r.start + rows.start - r0, r.stop + rows.start - r0),
+                   slice(c.start + cols.start - c0, c.stop + cols.start - c0))
+            out[:, r, c] = med[(slice(None),) + src]
+            count[r, c] = n[src]
+    return out, count
@@ -4,11 +4,13 @@ Created on Wed Jan  9 09:21:46 2019
 
 @author: MEvans
 """
-#we probably don't need to import ee here, could create these as python dictionaries...?
 import ee
+import session
 
-#Collection of dictionaries storing parameter values for various habitat types
-forest = ee.Dictionary({
+#Collection of dictionaries storing parameter values for various habitat types.
+#Plain python dictionaries, so importing this module needs no server; they are
+#cast to ee.Dictionary where used
+forest = {
   'int': 0,
   'cv_z': 0.01968614,#0.020213447,
   'rcvmax_z': -0.01005500,#,-0.241673763,
@@ -25,10 +27,10 @@ forest = ee.Dictionary({
   'V5': 3.061286e-04,
   'V6':  -7.319635e-04,
   'mad': 1
-})
+}
 
 
-scrub = ee.Dictionary({
+scrub = {
   'int': 0,
   'cv_z': 0.001523492,#-0.004616377,
   'rcvmax_z': -0.228383542,#-0.756532635,
@@ -45,9 +47,9 @@ scrub = ee.Dictionary({
   'V5':  -0.0017628213,
   'V6':  0.0005914612,
   'mad': 1.5
-})
+}
 
-desert = ee.Dictionary({
+desert = {
   'int': 0,
   'cv_z': 0.05781507,#0.03535703,
   'rcvmax_z': -0.07196164,#0.37298094,
@@ -64,9 +66,9 @@ desert = ee.Dictionary({
   'V5': 2.851671e-04,
   'V6': -3.688913e-04,
   'mad': 2  
-})
+}
     
-wetland = ee.Dictionary({
+wetland = {
   'int': 0,
   'cv_z': 0.02608609,#0.01539318,
   'rcvmax_z': -0.11168147,#,-0.53627410,
@@ -83,9 +85,9 @@ wetland = ee.Dictionary({
   'V5':   8.904052e-04,
   'V6':  -2.347725e-03,
   'mad': 1.1
-})
+}
 
-grassland = ee.Dictionary({
+grassland = {
   'int': 0,
   'cv_z': 0.01501676,#0.003335746,
   'nbr_z': 0.09690559,#0.200660811,
@@ -102,6 +104,52 @@ grassland = ee.Dictionary({
   'V5':   0.0004734193,
   'V6':  -0.0011570211,
   'mad': 1
-})
+}
 
-iwdictImg = ee.Image().where()
\ No newline at end of file
+# habitat dictionary of each NLCD land cover class, classes not listed
+# (water, developed, agriculture) are left unscored
+HABITATS = {
+  31: desert,
+  41: forest,
+  42: forest,
+  43: forest,
+  51: scrub,
+  52: scrub,
+  71: grassland,
+  72: grassland,
+  90: wetland,
+  95: wetland
+}
+
+NLCD = session.asset('Image', "USGS/NLCD/NLCD2016")
+
+LDA_BANDS = ['cv_z', 'rcvmax_z', 'ndvi_z', 'ndsi_z', 'ndwi_z', 'nbr_z']
+
+def coefficient_image(landcover = None, habitats = HABITATS, bands = LDA_BANDS):
+  """
+  Build an image of per pixel LDA coefficients from a land cover image, so
+  AOIs spanning several habitats are scored in one pass
+
+  Parameters:
+    landcover (ee.Image): single band land cover classes, default NLCD
+    habitats (dict): land cover class (int) to a dict of lda coefficients,
+    e.g. forest, keyed by band name plus 'int' and 'lda', default HABITATS
+    bands (list<str>): band names to be scored
+
+  Returns:
+    ee.Image: bands of the coefficients of bands, 'int' and 'lda', masked
+    where the class has no habitat. Pass as the dictionary of
+    analyze.analyze_iw, or score with stats.ldaMargin
+  """
+  if landcover is None:
+    landcover = NLCD().select(['landcover'])
+  classes = sorted(habitats)
+
+  def remap(key):
+    values = ee.List([ee.Dictionary(habitats[cls]).get(key) for cls in classes])
+    return landcover.remap(classes, values).rename([key])
+
+  img = remap(bands[0])
+  for key in bands[1:] + ['int', 'lda']:
+    img = img.addBands(remap(key))
+  return img
\ No newline at end of file
@@ -0,0 +1,1775 @@
+# -*- coding: utf-8 -*-
+"""
+Offline stand-in for the subset of the Earth Engine API used by this project
+
+Objects build a lazy graph as ee objects do, and are evaluated on NumPy
+when getInfo() is called or another evaluated object needs their value.
+Each object is evaluated at most once. Every evaluated operation and every
+reduction is counted and timed, so graph hot spots can be found with
+profile() without an Earth Engine account.
+
+All rasters share a single lon / lat pixel grid set with set_grid(). Image
+bands are float64 arrays of shape (rows, cols) with masked pixels set to
+NaN, as in the *_local modules; constant images are (1, 1) arrays and
+array images carry extra trailing dimensions. Reductions use every grid
+pixel inside the geometry: scale, crs, maxPixels, bestEffort and tileScale
+arguments are accepted and ignored, and reproject() is a no-op. Functions
+passed to map() and iterate() are called once per element at evaluation
+time rather than once when the graph is built.
+
+Assets are registered in an in-memory catalog with add_image() and
+add_collection(). install() makes 'import ee' return this module, so it
+must be called before importing the project modules:
+
+    import eelocal
+    eelocal.set_grid((rows, cols), origin=(lon, lat), pixel=(dlon, dlat))
+    eelocal.add_image('USGS/SRTMGL1_003', {'elevation': dem})
+    eelocal.add_collection('COPERNICUS/S2_SR', [(bands, properties), ...])
+    eelocal.install()
+    import analyze
+"""
+
+import ast
+import calendar
+import collections
+import re
+import sys
+import time
+import warnings
+from datetime import datetime, timedelta
+import numpy as np
+from scipy import ndimage, special
+import stats_local
+import terrain_local
+
+# meters per degree of latitude on a sphere of the mean earth radius
+METERS_PER_DEGREE = 6371008.8 * np.pi / 180
+
+class EEException(Exception):
+    """
+    Raised where Earth Engine would return an error
+    """
+
+# ----------------------------------------------------------------------
+# profiling
+
+_counts = collections.Counter()
+_seconds = collections.Counter()
+_pixels = collections.Counter()
+# child evaluation time of each operation in progress
+_stack = []
+
+def _timed(op, func):
+    """
+    Run func, counting it under op and adding its exclusive time
+    """
+    _counts[op] += 1
+    start = time.perf_counter()
+    _stack.append(0.0)
+    try:
+        return func()
+    finally:
+        total = time.perf_counter() - start
+        _seconds[op] += total - _stack.pop()
+        if _stack:
+            _stack[-1] += total
+
+def profile():
+    """
+    Operation counts and timings since the last reset_profile()
+
+    Returns:
+        dict: 'ops' (evaluations per operation), 'seconds' (time spent in
+        each operation excluding the operations it evaluated) and 'pixels'
+        (values reduced per reducer)
+    """
+    return {'ops': dict(_counts), 'seconds': dict(_seconds), 'pixels': dict(_pixels)}
+
+def reset_profile():
+    """
+    Clear the operation counts and timings
+    """
+    _counts.clear()
+    _seconds.clear()
+    _pixels.clear()
+
+def print_profile(n=20):
+    """
+    Print the n operations with the most exclusive time
+    """
+    print('{:<36}{:>8}{:>12}'.format('operation', 'count', 'seconds'))
+    for op, seconds in _seconds.most_common(n):
+        print('{:<36}{:>8}{:>12.3f}'.format(op, _counts[op], seconds))
+    for op, pixels in _pixels.most_common():
+        print('{:<36}{:>8}{:>12} pixels'.format(op, _counts[op], pixels))
+
+# ----------------------------------------------------------------------
+# grid, catalog and concrete values
+
+class Grid(object):
+    """
+    Pixel grid shared by every raster
+
+    Parameters:
+        shape (tuple): (rows, cols)
+        origin (tuple): (lon, lat) of the upper left corner
+        pixel (tuple): (dlon, dlat) pixel size in degrees
+    """
+
+    def __init__(self, shape, origin, pixel):
+        self.shape = tuple(shape)
+        self.origin = origin
+        self.pixel = pixel
+
+    def centers(self):
+        """
+        (lon, lat) arrays of pixel centers, broadcastable to the grid
+        """
+        rows, cols = self.shape
+        lon = self.origin[0] + (np.arange(cols) + 0.5) * self.pixel[0]
+        lat = self.origin[1] - (np.arange(rows) + 0.5) * self.pixel[1]
+        return lon[None, :], lat[:, None]
+
+    def cellsize(self):
+        """
+        (row, col) pixel size in meters at the center of the grid
+        """
+        lat = self.origin[1] - self.shape[0] * self.pixel[1] / 2
+        return (self.pixel[1] * METERS_PER_DEGREE,
+                self.pixel[0] * METERS_PER_DEGREE * np.cos(np.radians(lat)))
+
+    def corner(self, row, col):
+        """
+        [lon, lat] of the upper left corner of a pixel
+        """
+        return [float(self.origin[0] + col * self.pixel[0]),
+                float(self.origin[1] - row * self.pixel[1])]
+
+_grid = None
+_catalog = {}
+
+def set_grid(shape, origin=(0.0, 0.0), pixel=(1e-4, 1e-4)):
+    """
+    Set the pixel grid of every raster
+
+    Parameters:
+        shape (tuple): (rows, cols)
+        origin (tuple): (lon, lat) of the upper left corner
+        pixel (tuple): (dlon, dlat) pixel size in degrees
+    """
+    global _grid
+    _grid = Grid(shape, origin, pixel)
+
+def grid():
+    if _grid is None:
+        raise EEException('no grid set, call eelocal.set_grid() first')
+    return _grid
+
+def _check_bands(bands):
+    out = collections.OrderedDict()
+    for name, arr in bands.items():
+        arr = np.asarray(arr, dtype=float)
+        if arr.shape[:2] != grid().shape:
+            raise EEException('band {} has shape {}, the grid is {}'.format(name, arr.shape, grid().shape))
+        out[name] = arr
+    return out
+
+def add_image(asset_id, bands, properties=None):
+    """
+    Register an image asset
+
+    Parameters:
+        asset_id (str): id used in ee.Image(asset_id)
+        bands (dict): band name to array of the grid shape, NaN where masked
+        properties (dict): optional image properties
+    """
+    props = dict(properties or {})
+    props.setdefault('system:id', asset_id)
+    _catalog[asset_id] = Raster(_check_bands(bands), props)
+
+def add_collection(asset_id, images):
+    """
+    Register an image collection asset
+
+    Parameters:
+        asset_id (str): id used in ee.ImageCollection(asset_id)
+        images (list<tuple>): (bands, properties) of each image, with
+        'system:time_start' in milliseconds for date filtering
+    """
+    elements = []
+    for i, (bands, properties) in enumerate(images):
+        props = dict(properties or {})
+        props.setdefault('system:index', str(i))
+        elements.append(Raster(_check_bands(bands), props))
+    _catalog[asset_id] = Collection(elements, {'system:id': asset_id})
+
+def clear():
+    """
+    Remove every registered asset
+    """
+    _catalog.clear()
+
+def install():
+    """
+    Make 'import ee' return this module
+
+    Returns:
+        module: this module
+    """
+    module = sys.modules[__name__]
+    sys.modules['ee'] = module
+    return module
+
+class Raster(object):
+    """
+    Concrete image: ordered band arrays and properties
+    """
+
+    def __init__(self, bands, props=None):
+        self.bands = collections.OrderedDict(bands)
+        self.props = dict(props or {})
+
+class Collection(object):
+    """
+    Concrete image or feature collection
+    """
+
+    def __init__(self, elements, props=None):
+        self.elements = list(elements)
+        self.props = dict(props or {})
+
+class Shape(object):
+    """
+    Concrete geometry: GeoJSON and its rasterization on the grid
+
+    Parameters:
+        geojson (dict): GeoJSON geometry
+        pixels (tuple): optional (rows, cols) index arrays of the pixels it
+        covers, when already known
+    """
+
+    def __init__(self, geojson, pixels=None):
+        self.geojson = geojson
+        self._pixels = pixels
+        self._mask = None
+
+    def mask(self):
+        """
+        Boolean grid of the pixels whose centers are inside the geometry
+        """
+        if self._mask is None:
+            if self._pixels is not None:
+                self._mask = np.zeros(grid().shape, dtype=bool)
+                self._mask[self._pixels] = True
+            else:
+                self._mask = _rasterize(self.geojson)
+        return self._mask
+
+    def polygons(self):
+        kind = self.geojson['type']
+        if kind == 'Polygon':
+            return [self.geojson['coordinates']]
+        if kind == 'MultiPolygon':
+            return self.geojson['coordinates']
+        raise EEException('unsupported geometry type ' + kind)
+
+    def area(self):
+        """
+        Area in square meters, projecting each polygon equirectangularly
+        about its mean latitude
+        """
+        total = 0.0
+        for polygon in self.polygons():
+            for i, ring in enumerate(polygon):
+                ring = np.asarray(ring, dtype=float)
+                scale = np.cos(np.radians(ring[:, 1].mean()))
+                x = ring[:, 0] * scale * METERS_PER_DEGREE
+                y = ring[:, 1] * METERS_PER_DEGREE
+                ring_area = abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+                total += ring_area if i == 0 else -ring_area
+        return total
+
+def _rasterize(geojson):
+    lon, lat = grid().centers()
+    lon, lat = np.broadcast_arrays(lon, lat)
+    out = np.zeros(grid().shape, dtype=bool)
+    for polygon in Shape(geojson).polygons():
+        inside = np.zeros(grid().shape, dtype=bool)
+        for ring in polygon:
+            ring = np.asarray(ring, dtype=float)
+            for (x1, y1), (x2, y2) in zip(ring, np.roll(ring, -1, axis=0)):
+                if y1 == y2:
+                    continue
+                crosses = (y1 > lat) != (y2 > lat)
+                xint = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+                inside ^= crosses & (lon < xint)
+        out |= inside
+    return out
+
+class FeatureValue(object):
+    """
+    Concrete feature: a Shape and properties
+    """
+
+    def __init__(self, shape, props=None):
+        self.shape = shape
+        self.props = dict(props or {})
+
+def _millis(dt):
+    return int(round(dt.timestamp() * 1000))
+
+def _datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        dt = datetime.fromisoformat(value.replace('Z', ''))
+        return dt.replace(tzinfo=None) if dt.tzinfo else dt
+    return datetime(1970, 1, 1) + timedelta(milliseconds=float(value))
+
+def _info(value):
+    """
+    Convert a concrete value to the plain Python that getInfo() returns
+    """
+    if isinstance(value, Raster):
+        return {'type': 'Image',
+                'bands': [{'id': name, 'dimensions': list(arr.shape[1::-1])}
+                          for name, arr in value.bands.items()],
+                'properties': _info(value.props)}
+    if isinstance(value, Collection):
+        kind = 'FeatureCollection' if all(isinstance(e, FeatureValue) for e in value.elements) \
+               and value.elements else 'ImageCollection'
+        return {'type': kind, 'features': [_info(e) for e in value.elements],
+                'properties': _info(value.props)}
+    if isinstance(value, FeatureValue):
+        return {'type': 'Feature', 'geometry': _info(value.shape.geojson),
+                'properties': _info(value.props)}
+    if isinstance(value, Shape):
+        return _info(value.geojson)
+    if isinstance(value, datetime):
+        return {'type': 'Date', 'value': _millis(value)}
+    if isinstance(value, dict):
+        return {k: _info(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_info(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return _info(value.tolist())
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+# ----------------------------------------------------------------------
+# lazy objects
+
+class ComputedObject(object):
+    """
+    Lazily evaluated value. Casting constructors share the evaluation of
+    the object they wrap
+    """
+
+    def __init__(self, value=None):
+        if isinstance(value, ComputedObject):
+            self._share(value)
+        else:
+            self._set(None, None, value)
+
+    def _set(self, op, func, value=None):
+        self._op = op
+        self._func = func
+        self._value = value
+        self._cached = func is None
+
+    def _share(self, other):
+        self._set(None, other._eval)
+
+    def _eval(self):
+        if not self._cached:
+            func = self._func
+            self._value = func() if self._op is None else _timed(self._op, func)
+            self._cached = True
+            self._func = None
+        return self._value
+
+    def getInfo(self):
+        """
+        Evaluate the object and return it as plain Python
+        """
+        return _timed('getInfo', lambda: _info(self._eval()))
+
+    def __getattr__(self, name):
+        # untyped results, e.g. of get() or Algorithms.If, take the methods
+        # of their evaluated type
+        if name.startswith('_') or type(self) is not ComputedObject:
+            raise AttributeError(name)
+        return getattr(_wrap(self._eval()), name)
+
+def _node(cls, op, func):
+    """
+    New object of class cls evaluated by func, counted under op
+    """
+    obj = cls.__new__(cls)
+    ComputedObject._set(obj, op, func)
+    return obj
+
+def _const(cls, value):
+    obj = cls.__new__(cls)
+    ComputedObject._set(obj, None, None, value)
+    return obj
+
+def _val(x):
+    """
+    Concrete value of an object, recursing into lists and dicts
+    """
+    if isinstance(x, ComputedObject):
+        return x._eval()
+    if isinstance(x, (list, tuple)):
+        return [_val(v) for v in x]
+    if isinstance(x, dict):
+        return {k: _val(v) for k, v in x.items()}
+    return x
+
+def _wrap(value):
+    """
+    Typed object holding a concrete value
+    """
+    if isinstance(value, Raster):
+        return _const(Image, value)
+    if isinstance(value, Collection):
+        if value.elements and isinstance(value.elements[0], FeatureValue):
+            return _const(FeatureCollection, value)
+        return _const(ImageCollection, value)
+    if isinstance(value, FeatureValue):
+        return _const(Feature, value)
+    if isinstance(value, Shape):
+        return _const(Geometry, value)
+    if isinstance(value, datetime):
+        return _const(Date, value)
+    if isinstance(value, dict):
+        return _const(Dictionary, value)
+    if isinstance(value, list):
+        return _const(List, value)
+    if isinstance(value, np.ndarray):
+        return _const(Array, value)
+    if isinstance(value, str):
+        return _const(String, value)
+    if isinstance(value, (int, float, np.number, bool, np.bool_)):
+        return _const(Number, value)
+    return _const(ComputedObject, value)
+
+def _truthy(value):
+    if value is None:
+        return False
+    if isinstance(value, (int, float, np.number, bool, np.bool_)):
+        return not (value == 0 or np.isnan(value))
+    if isinstance(value, (str, list, dict)):
+        return len(value) > 0
+    return True
+
+def Initialize(*args, **kwargs):
+    """
+    No-op in place of ee.Initialize
+    """
+    _counts['Initialize'] += 1
+
+def ServiceAccountCredentials(*args, **kwargs):
+    return None
+
+# ----------------------------------------------------------------------
+# numbers, strings, dates, lists, dictionaries and arrays
+
+def _number(x):
+    value = _val(x)
+    if isinstance(value, (bool, np.bool_)):
+        return int(value)
+    return value
+
+class Number(ComputedObject):
+    """
+    Lazily evaluated number
+    """
+
+    def __init__(self, number):
+        if isinstance(number, ComputedObject):
+            self._share(number)
+        else:
+            self._set(None, None, number)
+
+    def _unary(self, op, func):
+        return _node(Number, 'Number.' + op, lambda: func(_number(self)))
+
+    def _binary(self, op, other, func):
+        return _node(Number, 'Number.' + op, lambda: func(_number(self), _number(other)))
+
+    def add(self, other): return self._binary('add', other, lambda a, b: a + b)
+    def subtract(self, other): return self._binary('subtract', other, lambda a, b: a - b)
+    def multiply(self, other): return self._binary('multiply', other, lambda a, b: a * b)
+    def divide(self, other): return self._binary('divide', other, lambda a, b: a / b if b != 0 else None)
+    def pow(self, other): return self._binary('pow', other, lambda a, b: a ** b)
+    def mod(self, other): return self._binary('mod', other, lambda a, b: np.fmod(a, b))
+    def max(self, other): return self._binary('max', other, max)
+    def min(self, other): return self._binary('min', other, min)
+    def gt(self, other): return self._binary('gt', other, lambda a, b: int(a > b))
+    def gte(self, other): return self._binary('gte', other, lambda a, b: int(a >= b))
+    def lt(self, other): return self._binary('lt', other, lambda a, b: int(a < b))
+    def lte(self, other): return self._binary('lte', other, lambda a, b: int(a <= b))
+    def eq(self, other): return self._binary('eq', other, lambda a, b: int(a == b))
+    def neq(self, other): return self._binary('neq', other, lambda a, b: int(a != b))
+    def And(self, other): return self._binary('And', other, lambda a, b: int(bool(a) and bool(b)))
+    def Or(self, other): return self._binary('Or', other, lambda a, b: int(bool(a) or bool(b)))
+    def Not(self): return self._unary('Not', lambda a: int(not a))
+    def abs(self): return self._unary('abs', abs)
+    def sqrt(self): return self._unary('sqrt', np.sqrt)
+    def exp(self): return self._unary('exp', np.exp)
+    def log(self): return self._unary('log', np.log)
+    def cos(self): return self._unary('cos', np.cos)
+    def sin(self): return self._unary('sin', np.sin)
+    def tan(self): return self._unary('tan', np.tan)
+    def atan(self): return self._unary('atan', np.arctan)
+    def round(self): return self._unary('round', lambda a: float(np.round(a)))
+    def floor(self): return self._unary('floor', lambda a: float(np.floor(a)))
+    def ceil(self): return self._unary('ceil', lambda a: float(np.ceil(a)))
+    def int(self): return self._unary('int', int)
+    def toInt(self): return self._unary('toInt', int)
+    def float(self): return self._unary('float', float)
+    def toFloat(self): return self._unary('toFloat', float)
+
+class String(ComputedObject):
+    """
+    Lazily evaluated string
+    """
+
+    def __init__(self, string):
+        if isinstance(string, ComputedObject):
+            self._share(string)
+        else:
+            self._set(None, None, string)
+
+    def cat(self, other):
+        return _node(String, 'String.cat', lambda: _val(self) + _val(other))
+
+    def length(self):
+        return _node(Number, 'String.length', lambda: len(_val(self)))
+
+class Date(ComputedObject):
+    """
+    Lazily evaluated UTC date
+    """
+
+    def __init__(self, date, tz=None):
+        if isinstance(date, ComputedObject):
+            self._set(None, lambda: _datetime(_val(date)))
+        else:
+            self._set(None, None, _datetime(date))
+
+    @staticmethod
+    def fromYMD(year, month, day, timeZone=None):
+        return _node(Date, 'Date.fromYMD',
+                     lambda: datetime(int(_val(year)), int(_val(month)), int(_val(day))))
+
+    def advance(self, delta, unit, timeZone=None):
+        def thunk():
+            dt, n = _val(self), _val(delta)
+            if unit in ('year', 'month'):
+                months = dt.month - 1 + int(n) * (12 if unit == 'year' else 1)
+                year, month = dt.year + months // 12, months % 12 + 1
+                day = min(dt.day, calendar.monthrange(year, month)[1])
+                return dt.replace(year=year, month=month, day=day)
+            return dt + timedelta(**{unit + 's': n})
+        return _node(Date, 'Date.advance', thunk)
+
+    def get(self, unit, timeZone=None):
+        return _node(Number, 'Date.get', lambda: getattr(_val(self), unit))
+
+    def millis(self):
+        return _node(Number, 'Date.millis', lambda: _millis(_val(self)))
+
+    def format(self, fmt=None, timeZone=None):
+        return _node(String, 'Date.format', lambda: _val(self).isoformat())
+
+class List(ComputedObject):
+    """
+    Lazily evaluated list
+    """
+
+    def __init__(self, items):
+        if isinstance(items, ComputedObject):
+            self._share(items)
+        else:
+            self._set(None, lambda: _val(list(items)))
+
+    @staticmethod
+    def sequence(start, end=None, step=1, count=None):
+        def thunk():
+            first, by = _number(start), _number(step)
+            if count is not None:
+                return [first + by * i for i in range(int(_number(count)))]
+            return list(np.arange(first, _number(end) + by / 2, by).tolist())
+        return _node(List, 'List.sequence', thunk)
+
+    def get(self, index):
+        return _node(ComputedObject, 'List.get', lambda: _val(self)[int(_number(index))])
+
+    def length(self):
+        return _node(Number, 'List.length', lambda: len(_val(self)))
+
+    size = length
+
+    def cat(self, other):
+        return _node(List, 'List.cat', lambda: _val(self) + list(_val(other)))
+
+    def add(self, element):
+        return _node(List, 'List.add', lambda: _val(self) + [_val(element)])
+
+    def removeAll(self, other):
+        return _node(List, 'List.removeAll',
+                     lambda: [v for v in _val(self) if v not in _val(other)])
+
+    def contains(self, element):
+        return _node(Number, 'List.contains', lambda: int(_val(element) in _val(self)))
+
+    def slice(self, start, end=None, step=None):
+        return _node(List, 'List.slice', lambda: _val(self)[
+                _number(start):None if end is None else _number(end):_number(step)])
+
+    def sort(self):
+        return _node(List, 'List.sort', lambda: sorted(_val(self)))
+
+    def map(self, baseAlgorithm):
+        return _node(List, 'List.map',
+                     lambda: [_val(baseAlgorithm(_wrap(v))) for v in _val(self)])
+
+    def iterate(self, function, first):
+        def thunk():
+            acc = first
+            for v in _val(self):
+                acc = function(_wrap(v), acc)
+            return _val(acc)
+        return _node(ComputedObject, 'List.iterate', thunk)
+
+class Dictionary(ComputedObject):
+    """
+    Lazily evaluated dictionary
+    """
+
+    def __init__(self, d=None):
+        if isinstance(d, ComputedObject):
+            self._share(d)
+        else:
+            self._set(None, lambda: _val(dict(d or {})))
+
+    @staticmethod
+    def fromLists(keys, values):
+        return _node(Dictionary, 'Dictionary.fromLists',
+                     lambda: dict(zip(_val(keys), _val(values))))
+
+    def get(self, key, defaultValue=None):
+        return _node(ComputedObject, 'Dictionary.get',
+                     lambda: _val(self).get(_val(key), _val(defaultValue)))
+
+    def set(self, key, value):
+        return _node(Dictionary, 'Dictionary.set',
+                     lambda: dict(_val(self), **{_val(key): _val(value)}))
+
+    def combine(self, second, overwrite=True):
+        def thunk():
+            a, b = _val(self), _val(second)
+            return dict(a, **b) if overwrite else dict(b, **a)
+        return _node(Dictionary, 'Dictionary.combine', thunk)
+
+    def keys(self):
+        return _node(List, 'Dictionary.keys', lambda: sorted(_val(self)))
+
+    def values(self, keys=None):
+        return _node(List, 'Dictionary.values',
+                     lambda: [_val(self)[k] for k in (_val(keys) or sorted(_val(self)))])
+
+    def contains(self, key):
+        return _node(Number, 'Dictionary.contains', lambda: int(_val(key) in _val(self)))
+
+    def size(self):
+        return _node(Number, 'Dictionary.size', lambda: len(_val(self)))
+
+    def toArray(self, keys=None, axis=0):
+        def thunk():
+            d = _val(self)
+            return np.array([d[k] for k in (_val(keys) or sorted(d))], dtype=float)
+        return _node(Array, 'Dictionary.toArray', thunk)
+
+    def toImage(self, names=None):
+        def thunk():
+            d = _val(self)
+            bands = collections.OrderedDict()
+            for k in (_val(names) or sorted(d)):
+                value = d[k]
+                bands[k] = np.full((1, 1), np.nan if value is None else value, dtype=float)
+            return Raster(bands)
+        return _node(Image, 'Dictionary.toImage', thunk)
+
+def _array(x):
+    return np.asarray(_val(x), dtype=float)
+
+class Array(ComputedObject):
+    """
+    Lazily evaluated multidimensional array
+    """
+
+    def __init__(self, values, pixelType=None):
+        if isinstance(values, ComputedObject):
+            self._share(values)
+        else:
+            self._set(None, lambda: _array(values))
+
+    @staticmethod
+    def cat(arrays, axis=0):
+        return _node(Array, 'Array.cat',
+                     lambda: np.concatenate([_array(a) for a in _val(arrays)], axis=_number(axis)))
+
+    def _unary(self, op, func):
+        return _node(Array, 'Array.' + op, lambda: func(_array(self)))
+
+    def _binary(self, op, other, func):
+        return _node(Array, 'Array.' + op, lambda: func(_array(self), _array(other)))
+
+    def add(self, other): return self._binary('add', other, np.add)
+    def subtract(self, other): return self._binary('subtract', other, np.subtract)
+    def multiply(self, other): return self._binary('multiply', other, np.multiply)
+    def divide(self, other): return self._binary('divide', other, np.divide)
+    def pow(self, other): return self._binary('pow', other, np.power)
+    def gt(self, other): return self._binary('gt', other, lambda a, b: (a > b).astype(float))
+    def lt(self, other): return self._binary('lt', other, lambda a, b: (a < b).astype(float))
+    def matrixMultiply(self, other): return self._binary('matrixMultiply', other, np.matmul)
+    def abs(self): return self._unary('abs', np.abs)
+    def sqrt(self): return self._unary('sqrt', np.sqrt)
+    def matrixTranspose(self): return self._unary('matrixTranspose', np.transpose)
+    def transpose(self): return self._unary('transpose', np.transpose)
+    def matrixInverse(self): return self._unary('matrixInverse', np.linalg.inv)
+    def matrixDiagonal(self): return self._unary('matrixDiagonal', lambda a: np.diag(a)[:, None])
+    def matrixToDiag(self): return self._unary('matrixToDiag', lambda a: np.diag(np.ravel(a)))
+
+    def matrixCholeskyDecomposition(self):
+        return _node(Dictionary, 'Array.matrixCholeskyDecomposition',
+                     lambda: {'L': np.linalg.cholesky(_array(self))})
+
+    def eigen(self):
+        def thunk():
+            # eigenvalues in decreasing order, each row [value, vector...]
+            values, vectors = np.linalg.eigh(_array(self))
+            order = np.argsort(values)[::-1]
+            return np.column_stack([values[order], vectors[:, order].T])
+        return _node(Array, 'Array.eigen', thunk)
+
+    def get(self, position):
+        return _node(Number, 'Array.get',
+                     lambda: float(_array(self)[tuple(int(i) for i in _val(position))]))
+
+    def length(self):
+        return _node(Array, 'Array.length', lambda: np.array(_array(self).shape, dtype=float))
+
+    def slice(self, axis=0, start=0, end=None, step=1):
+        def thunk():
+            a = _array(self)
+            index = [slice(None)] * a.ndim
+            index[_number(axis)] = slice(_number(start), _number(end), _number(step))
+            return a[tuple(index)]
+        return _node(Array, 'Array.slice', thunk)
+
+    def project(self, axes):
+        def thunk():
+            a = _array(self)
+            keep = list(_val(axes))
+            return a.reshape([a.shape[i] for i in keep]) if a.size else a
+        return _node(Array, 'Array.project', thunk)
+
+    def repeat(self, axis=0, copies=1):
+        return _node(Array, 'Array.repeat',
+                     lambda: np.repeat(_array(self), _number(copies), axis=_number(axis)))
+
+    def reduce(self, reducer, axes, fieldAxis=None):
+        def thunk():
+            a = _array(self)
+            for axis in sorted(_val(axes)):
+                moved = np.moveaxis(a, axis, 0)
+                a = np.moveaxis(reducer._kernel(moved)[0][None], 0, axis)
+            return a
+        return _node(Array, 'Array.reduce', thunk)
+
+    def toList(self):
+        return _node(List, 'Array.toList', lambda: _array(self).tolist())
+
+# ----------------------------------------------------------------------
+# reducers
+
+def _quiet(func, *args):
+    with warnings.catch_warnings(), np.errstate(all='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return func(*args)
+
+def _count(x):
+    return np.sum(~np.isnan(x), axis=0).astype(float)
+
+def _sum(x):
+    # masked where every input is masked, as Earth Engine does
+    return np.where(_count(x) == 0, np.nan, np.nansum(x, axis=0))
+
+class Reducer(object):
+    """
+    Reduction over pixels of a region, bands of a pixel or images of a
+    collection. Single input reducers reduce axis 0 of an array with NaN
+    marking masked values; joint reducers reduce the rows of a (samples,
+    inputs) matrix
+
+    Parameters:
+        name (str): name used in profile()
+        outputs (list<str>): output names
+        kernel (callable): x -> list of outputs reduced over axis 0
+        joint (callable): X -> list of outputs, for multi-input reducers
+    """
+
+    def __init__(self, name, outputs, kernel=None, joint=None):
+        self.name = name
+        self.outputs = outputs
+        self._kernel = kernel
+        self._joint = joint
+
+    def combine(self, reducer2, outputPrefix='', sharedInputs=False):
+        """
+        Combine two single input reducers applied to the same inputs
+        """
+        first, second = self._kernel, reducer2._kernel
+        return Reducer(self.name + '+' + reducer2.name,
+                       self.outputs + [outputPrefix + o for o in reducer2.outputs],
+                       lambda x: first(x) + second(x))
+
+    def _apply(self, x):
+        _counts['Reducer.' + self.name] += 1
+        _pixels['Reducer.' + self.name] += int(x.size)
+        return _quiet(self._kernel, x)
+
+    def _apply_joint(self, X):
+        _counts['Reducer.' + self.name] += 1
+        _pixels['Reducer.' + self.name] += int(X.size)
+        return _quiet(self._joint, X)
+
+    @staticmethod
+    def mean():
+        return Reducer('mean', ['mean'], lambda x: [np.nanmean(x, axis=0)])
+
+    @staticmethod
+    def stdDev():
+        return Reducer('stdDev', ['stdDev'], lambda x: [np.nanstd(x, axis=0)])
+
+    @staticmethod
+    def sampleStdDev():
+        return Reducer('sampleStdDev', ['stdDev'], lambda x: [np.nanstd(x, axis=0, ddof=1)])
+
+    @staticmethod
+    def sum():
+        return Reducer('sum', ['sum'], lambda x: [_sum(x)])
+
+    @staticmethod
+    def count():
+        return Reducer('count', ['count'], lambda x: [_count(x)])
+
+    @staticmethod
+    def max(numInputs=1):
+        return Reducer('max', ['max'], lambda x: [np.nanmax(x, axis=0)])
+
+    @staticmethod
+    def min(numInputs=1):
+        return Reducer('min', ['min'], lambda x: [np.nanmin(x, axis=0)])
+
+    @staticmethod
+    def median(maxBuckets=None, minBucketWidth=None, maxRaw=None):
+        return Reducer('median', ['median'], lambda x: [np.nanmedian(x, axis=0)])
+
+    @staticmethod
+    def mode(maxBuckets=None, minBucketWidth=None, maxRaw=None):
+        # the bounded histogram of stats_local, as used by stats.mode_reducer
+        def kernel(x):
+            if x.ndim != 1:
+                raise EEException('Reducer.mode is only supported over regions')
+            return [stats_local.mode(x, maxBuckets, minBucketWidth)]
+        return Reducer('mode', ['mode'], kernel)
+
+    @staticmethod
+    def covariance():
+        def joint(X):
+            return [np.cov(X, rowvar=False, ddof=1)]
+        return Reducer('covariance', ['array'], joint=joint)
+
+    @staticmethod
+    def centeredCovariance():
+        def joint(X):
+            return [X.T @ X / (X.shape[0] - 1)]
+        return Reducer('centeredCovariance', ['array'], joint=joint)
+
+    @staticmethod
+    def pearsonsCorrelation():
+        def joint(X):
+            r = np.corrcoef(X[:, 0], X[:, 1])[0, 1]
+            t = r * np.sqrt((X.shape[0] - 2) / (1 - r * r))
+            return [r, 2 * special.stdtr(X.shape[0] - 2, -abs(t))]
+        return Reducer('pearsonsCorrelation', ['correlation', 'p-value'], joint=joint)
+
+    @staticmethod
+    def linearRegression(numX, numY=1):
+        numX, numY = int(_number(numX)), int(_number(numY))
+
+        def joint(X):
+            # X is (samples, ..., numX + numY) with invalid samples zeroed
+            x, y = X[..., :numX], X[..., numX:]
+            xtx = np.einsum('n...i,n...j->...ij', x, x)
+            xty = np.einsum('n...i,n...j->...ij', x, y)
+            coefficients = np.linalg.pinv(xtx) @ xty
+            fitted = np.einsum('n...i,...ij->n...j', x, coefficients)
+            n = np.sum(np.any(x != 0, axis=-1), axis=0)[..., None]
+            residuals = np.sqrt(np.sum(np.square(y - fitted) * np.any(x != 0, axis=-1)[..., None], axis=0) / n)
+            return [coefficients, residuals]
+        return Reducer('linearRegression', ['coefficients', 'residuals'], joint=joint)
+
+# ----------------------------------------------------------------------
+# images
+
+def _grid_band(arr):
+    """
+    Broadcast a band to the grid, keeping any array dimensions
+    """
+    return np.broadcast_to(arr, grid().shape + arr.shape[2:])
+
+def _pixel_mask(arr):
+    """
+    True where a pixel of a (rows, cols, ...) band is masked
+    """
+    nan = np.isnan(arr)
+    return nan.any(axis=tuple(range(2, arr.ndim))) if arr.ndim > 2 else nan
+
+def _bcast(x, y):
+    while x.ndim < y.ndim:
+        x = x[..., None]
+    while y.ndim < x.ndim:
+        y = y[..., None]
+    return x, y
+
+def _raster(x):
+    """
+    Raster of an image, or a constant raster of a number or list of numbers
+    """
+    value = _val(x)
+    if isinstance(value, Raster):
+        return value
+    if isinstance(value, (list, tuple)):
+        return Raster(('constant_{}'.format(i), np.full((1, 1), v, dtype=float))
+                      for i, v in enumerate(value))
+    if value is None:
+        value = np.nan
+    return Raster({'constant': np.full((1, 1), value, dtype=float)})
+
+def _pairs(a, b):
+    """
+    Matched (name, x, y) bands of two rasters following the EE rules: equal
+    band counts pair up in order, and a single band is used against every
+    band of the other image. Names come from the longer input
+    """
+    an, bn = list(a.bands), list(b.bands)
+    if len(an) == len(bn):
+        return [(n, a.bands[n], b.bands[m]) for n, m in zip(an, bn)]
+    if len(bn) == 1:
+        return [(n, a.bands[n], b.bands[bn[0]]) for n in an]
+    if len(an) == 1:
+        return [(n, a.bands[an[0]], b.bands[n]) for n in bn]
+    raise EEException('Images must contain the same number of bands or only 1 band. '
+                      'Got {} and {}.'.format(len(an), len(bn)))
+
+def _arith(func):
+    def apply(x, y):
+        x, y = _bcast(x, y)
+        return _quiet(func, x, y)
+    return apply
+
+def _logical(func):
+    # comparisons and logical operators keep the masks of their inputs
+    def apply(x, y):
+        x, y = _bcast(x, y)
+        out = _quiet(func, x, y).astype(float)
+        return np.where(np.isnan(x) | np.isnan(y), np.nan, out)
+    return apply
+
+def _divide(x, y):
+    # division by zero is masked
+    return np.where(y == 0, np.nan, x / y)
+
+def _cast(func):
+    def apply(x):
+        return np.where(np.isnan(x), np.nan, func(np.nan_to_num(x)))
+    return apply
+
+def _focal(filter_func, fill, radius, kernelType, units):
+    r = _number(radius)
+    if units == 'meters':
+        r = r / min(grid().cellsize())
+    n = int(np.floor(r))
+    if kernelType == 'square':
+        footprint = np.ones((2 * n + 1, 2 * n + 1), dtype=bool)
+    else:
+        yy, xx = np.mgrid[-n:n + 1, -n:n + 1]
+        footprint = yy ** 2 + xx ** 2 <= r * r
+
+    def apply(x):
+        # masked neighbours are ignored, a pixel stays masked only if its
+        # whole neighbourhood is
+        x = _grid_band(x)
+        out = filter_func(np.where(np.isnan(x), fill, x), footprint=footprint, mode='nearest')
+        return np.where(out == fill, np.nan, out)
+    return apply
+
+def _select(raster, selectors, names=None):
+    bands = list(raster.bands)
+    chosen = []
+    for s in selectors:
+        if isinstance(s, (int, np.integer)):
+            chosen.append(bands[s])
+        elif s in raster.bands:
+            chosen.append(s)
+        else:
+            matches = [b for b in bands if re.fullmatch(s, b)]
+            if not matches:
+                raise EEException('Pattern \'{}\' did not match any bands.'.format(s))
+            chosen.extend(matches)
+    names = names or chosen
+    return Raster(zip(names, [raster.bands[b] for b in chosen]), raster.props)
+
+def _names(args):
+    """
+    Flatten band name arguments given as a list, ee.List or varargs
+    """
+    if len(args) == 1:
+        value = _val(args[0])
+        return list(value) if isinstance(value, (list, tuple)) else [value]
+    return [_val(a) for a in args]
+
+class _Expression(object):
+    """
+    Evaluate the arithmetic expressions of Image.expression on Image objects
+    """
+
+    OPS = {ast.Add: 'add', ast.Sub: 'subtract', ast.Mult: 'multiply',
+           ast.Div: 'divide', ast.Pow: 'pow', ast.Gt: 'gt', ast.GtE: 'gte',
+           ast.Lt: 'lt', ast.LtE: 'lte', ast.Eq: 'eq', ast.NotEq: 'neq'}
+    # functions of the expression language, named as the Image methods
+    CALLS = ('min', 'max', 'abs', 'sqrt')
+
+    def __init__(self, variables):
+        self.variables = variables
+
+    def __call__(self, node):
+        if isinstance(node, ast.Expression):
+            return self(node.body)
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            return self.variables[node.id]
+        if isinstance(node, ast.Attribute):
+            return Image(self(node.value)).select([node.attr])
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return self._image(self(node.operand)).multiply(-1)
+        if isinstance(node, ast.BinOp):
+            return getattr(self._image(self(node.left)), self.OPS[type(node.op)])(self(node.right))
+        if isinstance(node, ast.Compare) and len(node.ops) == 1:
+            return getattr(self._image(self(node.left)), self.OPS[type(node.ops[0])])(self(node.comparators[0]))
+        if isinstance(node, ast.BoolOp):
+            op = 'And' if isinstance(node.op, ast.And) else 'Or'
+            out = self._image(self(node.values[0]))
+            for value in node.values[1:]:
+                out = getattr(out, op)(self(value))
+            return out
+        if isinstance(node, ast.Call) and node.func.id in self.CALLS:
+            args = [self(arg) for arg in node.args]
+            return getattr(self._image(args[0]), node.func.id)(*args[1:])
+        raise EEException('unsupported expression ' + ast.dump(node))
+
+    @staticmethod
+    def _image(x):
+        return x if isinstance(x, Image) else Image.constant(x)
+
+class Image(ComputedObject):
+    """
+    Lazily evaluated image
+    """
+
+    def __init__(self, args=None, version=None):
+        if isinstance(args, ComputedObject):
+            self._share(args)
+        elif isinstance(args, str):
+            self._set('Image.load', lambda: _load(args, Raster))
+        elif isinstance(args, Raster):
+            self._set(None, None, args)
+        elif args is None:
+            self._set(None, None, Raster({}))
+        else:
+            self._set('Image.constant', lambda: _raster(args))
+
+    @staticmethod
+    def constant(value):
+        return _node(Image, 'Image.constant', lambda: _raster(value))
+
+    def _apply(self, op, func):
+        """
+        New image computed by func from the raster of this image
+        """
+        return _node(Image, 'Image.' + op, lambda: func(_val(self)))
+
+    def _bandwise(self, op, func, keep=False):
+        def thunk():
+            r = _val(self)
+            return Raster(((n, func(arr)) for n, arr in r.bands.items()),
+                          r.props if keep else None)
+        return _node(Image, 'Image.' + op, thunk)
+
+    def _binary(self, op, other, func):
+        def thunk():
+            return Raster((n, func(x, y)) for n, x, y in _pairs(_val(self), _raster(other)))
+        return _node(Image, 'Image.' + op, thunk)
+
+    # arithmetic, comparison and logical operators
+    def add(self, other): return self._binary('add', other, _arith(np.add))
+    def subtract(self, other): return self._binary('subtract', other, _arith(np.subtract))
+    def multiply(self, other): return self._binary('multiply', other, _arith(np.multiply))
+    def divide(self, other): return self._binary('divide', other, _arith(_divide))
+    def pow(self, other): return self._binary('pow', other, _arith(np.power))
+    def mod(self, other): return self._binary('mod', other, _arith(np.fmod))
+    def max(self, other): return self._binary('max', other, _arith(np.maximum))
+    def min(self, other): return self._binary('min', other, _arith(np.minimum))
+    def gt(self, other): return self._binary('gt', other, _logical(np.greater))
+    def gte(self, other): return self._binary('gte', other, _logical(np.greater_equal))
+    def lt(self, other): return self._binary('lt', other, _logical(np.less))
+    def lte(self, other): return self._binary('lte', other, _logical(np.less_equal))
+    def eq(self, other): return self._binary('eq', other, _logical(np.equal))
+    def neq(self, other): return self._binary('neq', other, _logical(np.not_equal))
+    def And(self, other): return self._binary('And', other, _logical(lambda a, b: (a != 0) & (b != 0)))
+    def Or(self, other): return self._binary('Or', other, _logical(lambda a, b: (a != 0) | (b != 0)))
+
+    def bitwiseAnd(self, other):
+        def func(x, y):
+            x, y = _bcast(x, y)
+            masked = np.isnan(x) | np.isnan(y)
+            out = np.bitwise_and(np.nan_to_num(x).astype(np.int64), np.nan_to_num(y).astype(np.int64))
+            return np.where(masked, np.nan, out)
+        return self._binary('bitwiseAnd', other, func)
+
+    def gammainc(self, other):
+        # regularized lower incomplete gamma P(a, x) with x from this image
+        return self._binary('gammainc', other, _arith(lambda x, a: special.gammainc(a, x)))
+
+    # per band functions
+    def abs(self): return self._bandwise('abs', np.abs)
+    def sqrt(self): return self._bandwise('sqrt', lambda x: _quiet(np.sqrt, x))
+    def exp(self): return self._bandwise('exp', lambda x: _quiet(np.exp, x))
+    def log(self): return self._bandwise('log', lambda x: _quiet(np.log, x))
+    def cos(self): return self._bandwise('cos', np.cos)
+    def sin(self): return self._bandwise('sin', np.sin)
+    def tan(self): return self._bandwise('tan', np.tan)
+    def atan(self): return self._bandwise('atan', np.arctan)
+    def gamma(self): return self._bandwise('gamma', special.gamma)
+    def Not(self): return self._bandwise('Not', _cast(lambda x: (x == 0).astype(float)))
+    def round(self): return self._bandwise('round', np.round)
+    def floor(self): return self._bandwise('floor', np.floor)
+    def ceil(self): return self._bandwise('ceil', np.ceil)
+    def int(self): return self._bandwise('int', _cast(np.trunc))
+    def int16(self): return self._bandwise('int16', _cast(lambda x: np.clip(np.trunc(x), -2**15, 2**15 - 1)))
+    def int32(self): return self._bandwise('int32', _cast(lambda x: np.clip(np.trunc(x), -2**31, 2**31 - 1)))
+    def byte(self): return self._bandwise('byte', _cast(lambda x: np.clip(np.trunc(x), 0, 255)))
+    def uint8(self): return self._bandwise('uint8', _cast(lambda x: np.clip(np.trunc(x), 0, 255)))
+    def float(self): return self._bandwise('float', lambda x: x)
+    def double(self): return self._bandwise('double', lambda x: x)
+    toInt = int
+    toFloat = float
+    toDouble = double
+
+    def clamp(self, low, high):
+        return self._bandwise('clamp', lambda x: np.clip(x, _number(low), _number(high)))
+
+    def focal_min(self, radius=1.5, kernelType='circle', units='pixels', iterations=1, kernel=None):
+        return self._bandwise('focal_min', _focal(ndimage.minimum_filter, np.inf, radius, kernelType, units))
+
+    def focal_max(self, radius=1.5, kernelType='circle', units='pixels', iterations=1, kernel=None):
+        return self._bandwise('focal_max', _focal(ndimage.maximum_filter, -np.inf, radius, kernelType, units))
+
+    # masks
+    def updateMask(self, mask):
+        def thunk():
+            r = _val(self)
+            bands = collections.OrderedDict()
+            for n, x, m in _pairs(r, _raster(mask)):
+                x, m = _bcast(x, m)
+                bands[n] = np.where((m == 0) | np.isnan(m), np.nan, x)
+            # band names stay those of the image
+            return Raster(zip(r.bands, bands.values()), r.props)
+        return _node(Image, 'Image.updateMask', thunk)
+
+    def mask(self):
+        return self._bandwise('mask', lambda x: (~np.isnan(x)).astype(float))
+
+    def unmask(self, value=0):
+        return self._bandwise('unmask', lambda x: np.where(np.isnan(x), _number(value), x), keep=True)
+
+    def remap(self, from_, to, defaultValue=None, bandName=None):
+        def func(x):
+            out = np.full(x.shape, np.nan if defaultValue is None else _number(defaultValue))
+            for a, b in zip(_val(from_), _val(to)):
+                out[x == a] = np.nan if b is None else b
+            return out
+        def thunk():
+            r = _val(self)
+            name = bandName if bandName is not None else next(iter(r.bands))
+            return Raster({'remapped': func(r.bands[name])})
+        return _node(Image, 'Image.remap', thunk)
+
+    def where(self, test, value):
+        def thunk():
+            r = _val(self)
+            v = _raster(value)
+            bands = collections.OrderedDict()
+            for (n, x, t), (_, _, y) in zip(_pairs(r, _raster(test)), _pairs(r, v)):
+                x, t = _bcast(x, t)
+                x, y = _bcast(x, y)
+                bands[n] = np.where((t != 0) & ~np.isnan(t), y, x)
+            return Raster(zip(r.bands, bands.values()), r.props)
+        return _node(Image, 'Image.where', thunk)
+
+    def clip(self, geometry):
+        def thunk():
+            r = _val(self)
+            outside = ~_shape(geometry).mask()
+            return Raster(((n, np.where(_bcast(outside, _grid_band(arr))[0], np.nan, _grid_band(arr)))
+                           for n, arr in r.bands.items()), r.props)
+        return _node(Image, 'Image.clip', thunk)
+
+    # bands and properties
+    def select(self, *args, **kwargs):
+        if 'opt_selectors' in kwargs or 'selectors' in kwargs:
+            args = (kwargs.get('opt_selectors', kwargs.get('selectors')),) + args
+        names = kwargs.get('opt_names', kwargs.get('names'))
+        if len(args) == 2 and isinstance(_val(args[0]), list) and isinstance(_val(args[1]), list):
+            args, names = args[:1], args[1]
+        return self._apply('select', lambda r: _select(r, _names(args), _val(names)))
+
+    def rename(self, *args):
+        def func(r):
+            names = _names(args)
+            if len(names) != len(r.bands):
+                raise EEException('Can\'t rename {} bands to {} names.'.format(len(r.bands), len(names)))
+            return Raster(zip(names, r.bands.values()), r.props)
+        return self._apply('rename', func)
+
+    def addBands(self, srcImg, names=None, overwrite=False):
+        def func(r):
+            bands = collections.OrderedDict(r.bands)
+            src = _val(srcImg)
+            if names is not None:
+                src = _select(src, _val(names))
+            for n, arr in src.bands.items():
+                if n in bands and not overwrite:
+                    n = n + '_1'
+                bands[n] = arr
+            return Raster(bands, r.props)
+        return self._apply('addBands', func)
+
+    def bandNames(self):
+        return _node(List, 'Image.bandNames', lambda: list(_val(self).bands))
+
+    def set(self, *args):
+        props = args[0] if len(args) == 1 else {args[0]: args[1]}
+
+        def func(r):
+            return Raster(r.bands, dict(r.props, **_val(props)))
+        return self._apply('set', func)
+
+    def get(self, prop):
+        return _node(ComputedObject, 'Image.get', lambda: _val(self).props.get(_val(prop)))
+
+    def date(self):
+        return _node(Date, 'Image.date', lambda: _datetime(_val(self).props['system:time_start']))
+
+    def geometry(self, maxError=None, proj=None, geodesics=None):
+        def thunk():
+            rows, cols = grid().shape
+            ring = [grid().corner(0, 0), grid().corner(0, cols), grid().corner(rows, cols),
+                    grid().corner(rows, 0), grid().corner(0, 0)]
+            return Shape({'type': 'Polygon', 'coordinates': [ring]})
+        return _node(Geometry, 'Image.geometry', thunk)
+
+    def projection(self):
+        return _Projection()
+
+    def reproject(self, crs=None, crsTransform=None, scale=None):
+        return self
+
+    def metadata(self, property, name=None):
+        return _node(Image, 'Image.metadata', lambda: Raster(
+                {name or property: np.full((1, 1), _val(self).props[property], dtype=float)}))
+
+    # composite operations
+    def normalizedDifference(self, bandNames=None):
+        def func(r):
+            names = _val(bandNames) or list(r.bands)[:2]
+            x, y = r.bands[names[0]], r.bands[names[1]]
+            return Raster({'nd': _quiet(_divide, x - y, x + y)})
+        return self._apply('normalizedDifference', func)
+
+    def expression(self, expression, opt_map=None):
+        text = expression.replace('&&', ' and ').replace('||', ' or ')
+        variables = dict(opt_map or {})
+        return Image(_Expression(variables)(ast.parse(text.strip(), mode='eval')))
+
+    def reduce(self, reducer):
+        def func(r):
+            stack = np.stack([_grid_band(arr) for arr in r.bands.values()])
+            return Raster(zip(reducer.outputs, reducer._apply(stack)))
+        return self._apply('reduce', func)
+
+    def reduceRegion(self, reducer, geometry=None, scale=None, crs=None, crsTransform=None,
+                     bestEffort=False, maxPixels=None, tileScale=1, **kwargs):
+        def thunk():
+            r = _val(self)
+            inside = _shape(geometry).mask() if geometry is not None else np.ones(grid().shape, dtype=bool)
+            columns = [(n, _grid_band(arr)[inside]) for n, arr in r.bands.items()]
+            out = {}
+            if reducer._joint is not None:
+                X = np.column_stack([c.reshape(c.shape[0], -1) for _, c in columns])
+                X = X[~np.isnan(X).any(axis=1)]
+                return dict(zip(reducer.outputs, reducer._apply_joint(X)))
+            for n, c in columns:
+                values = reducer._apply(c)
+                if len(reducer.outputs) == 1:
+                    out[n] = values[0]
+                else:
+                    out.update((n + '_' + o, v) for o, v in zip(reducer.outputs, values))
+            return {k: _scalar(v) for k, v in out.items()}
+        return _node(Dictionary, 'Image.reduceRegion', thunk)
+
+    def reduceToVectors(self, reducer=None, geometry=None, scale=None, geometryType='polygon',
+                        eightConnected=True, labelProperty='label', crs=None, crsTransform=None,
+                        bestEffort=False, maxPixels=None, tileScale=1, **kwargs):
+        def thunk():
+            r = _val(self)
+            band = _grid_band(next(iter(r.bands.values())))
+            valid = ~np.isnan(band)
+            if geometry is not None:
+                valid &= _shape(geometry).mask()
+            structure = np.ones((3, 3)) if eightConnected else None
+            features = []
+            for value in np.unique(band[valid]):
+                labels, n = ndimage.label(valid & (band == value), structure=structure)
+                # the bounding box of a component may hold others, e.g. one
+                # enclosed by a ring, so pick its pixels by label
+                for label, index in enumerate(ndimage.find_objects(labels), 1):
+                    rows, cols = np.nonzero(labels[index] == label)
+                    rows, cols = rows + index[0].start, cols + index[1].start
+                    features.append(FeatureValue(_runs(rows, cols), {labelProperty: _scalar(value)}))
+            _pixels['Image.reduceToVectors'] += int(valid.sum())
+            return Collection(features)
+        return _node(FeatureCollection, 'Image.reduceToVectors', thunk)
+
+    # array images
+    def toArray(self, axis=0):
+        def func(r):
+            bands = [_grid_band(arr) for arr in r.bands.values()]
+            arr = np.stack(bands, axis=2 + axis)
+            return Raster({'array': np.where(_bcast(_pixel_mask(arr), arr)[0], np.nan, arr)})
+        return self._apply('toArray', func)
+
+    def arrayProject(self, axes):
+        def func(r):
+            keep = [2 + a for a in _val(axes)]
+            out = collections.OrderedDict()
+            for n, arr in r.bands.items():
+                drop = tuple(i for i in range(2, arr.ndim) if i not in keep)
+                out[n] = arr.squeeze(axis=drop)
+            return Raster(out)
+        return self._apply('arrayProject', func)
+
+    def arraySlice(self, axis=0, start=0, end=None, step=1):
+        def func(r):
+            out = collections.OrderedDict()
+            for n, arr in r.bands.items():
+                index = [slice(None)] * arr.ndim
+                index[2 + _number(axis)] = slice(_number(start), _number(end), _number(step))
+                out[n] = arr[tuple(index)]
+            return Raster(out)
+        return self._apply('arraySlice', func)
+
+    def arrayFlatten(self, coordinateLabels, separator='_'):
+        def func(r):
+            labels = _val(coordinateLabels)
+            arr = next(iter(r.bands.values()))
+            out = collections.OrderedDict()
+            for index in np.ndindex(*arr.shape[2:]):
+                name = separator.join(labels[axis][i] for axis, i in enumerate(index))
+                out[name] = arr[(Ellipsis,) + index]
+            return Raster(out)
+        return self._apply('arrayFlatten', func)
+
+    def matrixMultiply(self, image2):
+        return self._binary('matrixMultiply', image2, lambda x, y: np.matmul(x, y))
+
+    def matrixTranspose(self, axis1=0, axis2=1):
+        return self._bandwise('matrixTranspose', lambda x: np.swapaxes(x, 2 + axis1, 2 + axis2))
+
+class _Projection(object):
+    def nominalScale(self):
+        return _node(Number, 'Projection.nominalScale', lambda: float(np.mean(grid().cellsize())))
+
+def _scalar(value):
+    value = np.asarray(value)
+    return value.item() if value.ndim == 0 else value
+
+def _runs(rows, cols):
+    """
+    Exact MultiPolygon of a set of pixels, one rectangle per run of pixels
+    along a row
+    """
+    order = np.lexsort((cols, rows))
+    rows, cols = rows[order], cols[order]
+    breaks = np.flatnonzero((np.diff(rows) != 0) | (np.diff(cols) != 1)) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [rows.size]]) - 1
+    g = grid()
+    polygons = []
+    for s, e in zip(starts, ends):
+        row, c0, c1 = rows[s], cols[s], cols[e] + 1
+        ring = [g.corner(row, c0), g.corner(row + 1, c0), g.corner(row + 1, c1),
+                g.corner(row, c1), g.corner(row, c0)]
+        polygons.append([ring])
+    return Shape({'type': 'MultiPolygon', 'coordinates': polygons}, (rows, cols))
+
+def _load(asset_id, kind):
+    value = _catalog.get(asset_id)
+    if not isinstance(value, kind):
+        raise EEException('{} asset \'{}\' not found.'.format(kind.__name__, asset_id))
+    return value
+
+# ----------------------------------------------------------------------
+# collections
+
+class Filter(object):
+    """
+    Predicate on element properties
+    """
+
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    @staticmethod
+    def _compare(name, value, func):
+        return Filter(lambda props: name in props and props[name] is not None
+                      and bool(func(props[name], _val(value))))
+
+    @staticmethod
+    def eq(name, value): return Filter._compare(name, value, lambda a, b: a == b)
+    @staticmethod
+    def neq(name, value): return Filter._compare(name, value, lambda a, b: a != b)
+    @staticmethod
+    def gt(name, value): return Filter._compare(name, value, lambda a, b: a > b)
+    @staticmethod
+    def gte(name, value): return Filter._compare(name, value, lambda a, b: a >= b)
+    @staticmethod
+    def lt(name, value): return Filter._compare(name, value, lambda a, b: a < b)
+    @staticmethod
+    def lte(name, value): return Filter._compare(name, value, lambda a, b: a <= b)
+
+    @staticmethod
+    def inList(name, values):
+        return Filter._compare(name, values, lambda a, b: a in b)
+
+    @staticmethod
+    def date(start, end=None):
+        def func(t, bounds):
+            return _millis(_datetime(bounds[0])) <= t and \
+                   (bounds[1] is None or t < _millis(_datetime(bounds[1])))
+        return Filter._compare('system:time_start', [start, end], func)
+
+    @staticmethod
+    def metadata(name, operator, value):
+        ops = {'equals': Filter.eq, 'not_equals': Filter.neq, 'less_than': Filter.lt,
+               'greater_than': Filter.gt, 'not_less_than': Filter.gte,
+               'not_greater_than': Filter.lte}
+        return ops[operator](name, value)
+
+    @staticmethod
+    def And(*filters):
+        return Filter(lambda props: all(f.predicate(props) for f in filters))
+
+    @staticmethod
+    def Or(*filters):
+        return Filter(lambda props: any(f.predicate(props) for f in filters))
+
+def _shape(x):
+    value = _val(x)
+    if isinstance(value, FeatureValue):
+        return value.shape
+    if isinstance(value, dict):
+        return Shape(value)
+    return value
+
+class _Collection(ComputedObject):
+    """
+    Operations shared by image and feature collections
+    """
+
+    _element = None
+    _name = None
+
+    def _derive(self, op, func):
+        def thunk():
+            c = _val(self)
+            return Collection(func(c.elements), c.props)
+        return _node(type(self), self._name + '.' + op, thunk)
+
+    def filter(self, filter):
+        return self._derive('filter', lambda es: [e for e in es if filter.predicate(e.props)])
+
+    def filterMetadata(self, name, operator, value):
+        return self.filter(Filter.metadata(name, operator, value))
+
+    def filterDate(self, start, end=None):
+        return self.filter(Filter.date(start, end))
+
+    def map(self, algorithm, dropNulls=False):
+        def func(elements):
+            out = [_val(algorithm(_wrap(e))) for e in elements]
+            return [e for e in out if e is not None] if dropNulls else out
+        return self._derive('map', func)
+
+    def merge(self, collection2):
+        return self._derive('merge', lambda es: es + _val(collection2).elements)
+
+    def sort(self, prop, ascending=True):
+        return self._derive('sort', lambda es: sorted(es, key=lambda e: e.props.get(prop),
+                                                      reverse=not ascending))
+
+    def limit(self, maximum, prop=None, ascending=True):
+        return self._derive('limit', lambda es: es[:int(_number(maximum))])
+
+    def first(self):
+        return _node(self._element, self._name + '.first',
+                     lambda: _val(self).elements[0] if _val(self).elements else None)
+
+    def size(self):
+        return _node(Number, self._name + '.size', lambda: len(_val(self).elements))
+
+    def toList(self, count, offset=0):
+        return _node(List, self._name + '.toList', lambda: _val(self).elements[
+                int(_number(offset)):int(_number(offset)) + int(_number(count))])
+
+    def aggregate_array(self, prop):
+        return _node(List, self._name + '.aggregate_array',
+                     lambda: [e.props[prop] for e in _val(self).elements if prop in e.props])
+
+    def aggregate_max(self, prop):
+        return _node(Number, self._name + '.aggregate_max',
+                     lambda: max([e.props[prop] for e in _val(self).elements if prop in e.props] or [None]))
+
+    def aggregate_min(self, prop):
+        return _node(Number, self._name + '.aggregate_min',
+                     lambda: min([e.props[prop] for e in _val(self).elements if prop in e.props] or [None]))
+
+    def aggregate_sum(self, prop):
+        return _node(Number, self._name + '.aggregate_sum',
+                     lambda: sum(e.props[prop] for e in _val(self).elements if prop in e.props))
+
+    def set(self, *args):
+        props = args[0] if len(args) == 1 else {args[0]: args[1]}
+
+        def thunk():
+            c = _val(self)
+            return Collection(c.elements, dict(c.props, **_val(props)))
+        return _node(type(self), self._name + '.set', thunk)
+
+    def get(self, prop):
+        return _node(ComputedObject, self._name + '.get', lambda: _val(self).props.get(prop))
+
+class ImageCollection(_Collection):
+    """
+    Lazily evaluated image collection
+    """
+
+    _name = 'ImageCollection'
+
+    def __init__(self, args):
+        if isinstance(args, ComputedObject):
+            self._share(args)
+        elif isinstance(args, str):
+            self._set('ImageCollection.load', lambda: _load(args, Collection))
+        else:
+            self._set(None, lambda: Collection(_val(list(args))))
+
+    @staticmethod
+    def fromImages(images):
+        return ImageCollection(images)
+
+    def filterBounds(self, geometry):
+        def func(elements):
+            inside = _shape(geometry).mask()
+            out = []
+            for e in elements:
+                band = _grid_band(next(iter(e.bands.values())))
+                if np.any(~_pixel_mask(band) & inside):
+                    out.append(e)
+            return out
+        return self._derive('filterBounds', func)
+
+    def select(self, *args, **kwargs):
+        return self.map(lambda img: img.select(*args, **kwargs))
+
+    def _reduce(self, op, reducer, rename):
+        def thunk():
+            elements = _val(self).elements
+            if not elements:
+                return Raster({})
+            names = list(elements[0].bands)
+            if reducer._joint is not None:
+                # pixels of all bands of each image, invalid images zeroed
+                X = np.stack([np.stack([_grid_band(e.bands[n]) for n in names], axis=-1)
+                              for e in elements])
+                X = np.where(np.isnan(X).any(axis=-1, keepdims=True), 0, X)
+                return Raster(zip(reducer.outputs, reducer._apply_joint(X)))
+            bands = collections.OrderedDict()
+            for n in names:
+                stack = np.stack([_grid_band(e.bands[n]) for e in elements])
+                for o, v in zip(reducer.outputs, reducer._apply(stack)):
+                    bands[n + '_' + o if rename else n] = v
+            return Raster(bands)
+        return _node(Image, 'ImageCollection.' + op, thunk)
+
+    def reduce(self, reducer, parallelScale=1):
+        return self._reduce('reduce', reducer, True)
+
+    def median(self): return self._reduce('median', Reducer.median(), False)
+    def mean(self): return self._reduce('mean', Reducer.mean(), False)
+    def sum(self): return self._reduce('sum', Reducer.sum(), False)
+    def max(self): return self._reduce('max', Reducer.max(), False)
+    def min(self): return self._reduce('min', Reducer.min(), False)
+    def count(self): return self._reduce('count', Reducer.count(), False)
+
+ImageCollection._element = Image
+
+# ----------------------------------------------------------------------
+# geometries and features
+
+class Geometry(ComputedObject):
+    """
+    Lazily evaluated lon / lat geometry
+    """
+
+    def __init__(self, geoJson, opt_proj=None, opt_geodesic=None):
+        if isinstance(geoJson, ComputedObject):
+            self._set(None, lambda: _shape(geoJson))
+        elif isinstance(geoJson, Shape):
+            self._set(None, None, geoJson)
+        else:
+            self._set(None, None, Shape(geoJson))
+
+    @staticmethod
+    def Polygon(coords, proj=None, geodesic=None, maxError=None, evenOdd=None):
+        return Geometry({'type': 'Polygon', 'coordinates': coords})
+
+    @staticmethod
+    def MultiPolygon(coords, proj=None, geodesic=None, maxError=None, evenOdd=None):
+        return Geometry({'type': 'MultiPolygon', 'coordinates': coords})
+
+    @staticmethod
+    def Rectangle(coords, proj=None, geodesic=None, evenOdd=None):
+        x0, y0, x1, y1 = coords
+        ring = [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+        return Geometry({'type': 'Polygon', 'coordinates': [ring]})
+
+    def area(self, maxError=None, proj=None):
+        return _node(Number, 'Geometry.area', lambda: _val(self).area())
+
+    def type(self):
+        return _node(String, 'Geometry.type', lambda: _val(self).geojson['type'])
+
+    def coordinates(self):
+        return _node(List, 'Geometry.coordinates', lambda: _val(self).geojson['coordinates'])
+
+    def toGeoJSON(self):
+        return self.getInfo()
+
+class Feature(ComputedObject):
+    """
+    Lazily evaluated feature
+    """
+
+    def __init__(self, geom, opt_properties=None):
+        if isinstance(geom, ComputedObject) and not isinstance(geom, Geometry):
+            self._share(geom)
+        else:
+            self._set(None, lambda: FeatureValue(_shape(geom), _val(opt_properties or {})))
+
+    def get(self, prop):
+        return _node(ComputedObject, 'Feature.get', lambda: _val(self).props.get(_val(prop)))
+
+    def set(self, *args):
+        props = args[0] if len(args) == 1 else {args[0]: args[1]}
+
+        def thunk():
+            f = _val(self)
+            return FeatureValue(f.shape, dict(f.props, **_val(props)))
+        return _node(Feature, 'Feature.set', thunk)
+
+    def geometry(self, maxError=None, proj=None, geodesics=None):
+        return _node(Geometry, 'Feature.geometry', lambda: _val(self).shape)
+
+    def area(self, maxError=None, proj=None):
+        return _node(Number, 'Feature.area', lambda: _val(self).shape.area())
+
+class FeatureCollection(_Collection):
+    """
+    Lazily evaluated feature collection
+    """
+
+    _name = 'FeatureCollection'
+
+    def __init__(self, args, opt_column=None):
+        if isinstance(args, ComputedObject) and not isinstance(args, (Feature, Geometry)):
+            self._share(args)
+        elif isinstance(args, str):
+            self._set('FeatureCollection.load', lambda: _load(args, Collection))
+        else:
+            items = args if isinstance(args, (list, tuple)) else [args]
+            self._set(None, lambda: Collection(
+                    [v if isinstance(v, FeatureValue) else FeatureValue(_shape(v))
+                     for v in _val(list(items))]))
+
+FeatureCollection._element = Feature
+
+# ----------------------------------------------------------------------
+# algorithms and terrain
+
+class Algorithms(object):
+
+    @staticmethod
+    def If(condition=None, trueCase=None, falseCase=None):
+        # only the chosen branch is evaluated
+        return _node(ComputedObject, 'Algorithms.If',
+                     lambda: _val(trueCase) if _truthy(_val(condition)) else _val(falseCase))
+
+class Terrain(object):
+
+    @staticmethod
+    def _slope_aspect(dem):
+        arr = _grid_band(next(iter(_raster(dem).bands.values())))
+        return terrain_local.slope_aspect(arr, grid().cellsize())
+
+    @staticmethod
+    def slope(dem):
+        return _node(Image, 'Terrain.slope',
+                     lambda: Raster({'slope': Terrain._slope_aspect(dem)[0]}))
+
+    @staticmethod
+    def aspect(dem):
+        return _node(Image, 'Terrain.aspect',
+                     lambda: Raster({'aspect': Terrain._slope_aspect(dem)[1]}))
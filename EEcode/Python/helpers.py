@@ -7,7 +7,7 @@ Created on Wed Mar 25 12:41:37 2020
 
 import ee
 from random import randint
-ee.Initialize()
+import instrument
 
 def buffer(ft):
     """
@@ -88,20 +88,21 @@ def sample_output(output, polygons, aoi_id):
         export task sending a csv file to google drive
     """
 
-    data = output.sampleRegions(
-            collection = polygons,
-            properties = [],
-            scale = 10,
-            tileScale = 8)
+    with instrument.stage('export'):
+        data = output.sampleRegions(
+                collection = polygons,
+                properties = [],
+                scale = 10,
+                tileScale = 8)
     
-    task = ee.batch.Export.table.toDrive(
-            collection = data,
-            #folder = {GDrive subdirectory path},
-            description = aoi_id,
-            fileFormat = 'CSV'
-            )
+        task = ee.batch.Export.table.toDrive(
+                collection = data,
+                #folder = {GDrive subdirectory path},
+                description = aoi_id,
+                fileFormat = 'CSV'
+                )
     
-    task.start()
+        task.start()
     
 if __name__ == '__main__':
     print('How many aois should we create?')
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental local change analysis for monitoring an AOI as scenes arrive
+
+A State keeps everything needed to rerun the local IW pipeline over an AOI
+in a directory, so a nightly update only reads the scenes acquired since
+the last run:
+
+    scenes/<id>.npy: each cloud masked RGBN scene, as a (bands, rows, cols)
+    float32 array, read again only when its period is recomposited, or
+    memory mapped to recomposite a few of its pixels
+    periods/<start>.npz: per period of months, the median composite of the
+    terrain corrected scenes and the terrain regression sums of its scenes
+    (terrain_local.Regression)
+    coefficients/<fit>.npy: the C-correction coefficients of each fit that
+    a period composite still uses
+    state.json: bands, period length, tolerance, scene and period index
+
+Medians do not merge, so composites are accumulated per period as in
+analyze.analyze_series: adding scenes only recomposites their periods, and
+the before and after images of a date are medians of the (at most 18)
+period composites in its 12 and 6 month windows.
+
+The regression sums do merge, so once scenes have been added or dropped
+the coefficients are refitted from them without reading any scene, as a
+rebuild from every scene would fit them. When a run uses a period
+composited with earlier coefficients, the correction factors of its scenes
+are compared with those of the fit it was composited with. The period is
+recomposited when they moved by more than tolerance at the
+DRIFT_PERCENTILE percentile of their pixels, and otherwise only the pixels
+where they did are, so every pixel of each composite stays within
+tolerance of a rebuild however many updates it goes through. Periods
+outside the windows of a run are not checked. refit=True recomposites
+every period, for a periodic full refresh.
+
+The statistics calc_zp standardizes with are AOI-wide functions of the
+change image, which moves wherever a period composite does, so IW itself
+is rerun in full on the composites.
+
+    state = incremental_local.State('state/' + aoiId, slope, aspect)
+    for scene_id, date, scene, (azimuth, zenith) in new_scenes:
+        state.add(scene_id, date, scene, azimuth, zenith)
+    zs, iterations = state.run('2020-06-01', tol=0.05)
+"""
+
+import json
+import os
+import warnings
+import numpy as np
+import iw_local
+import terrain_local
+
+# before and after windows around a date of interest, in months, as in
+# analyze.analyze_iw
+BEFORE_MONTHS = 12
+AFTER_MONTHS = 6
+
+REGRESSION_SUMS = ['n', 'sx', 'sxx', 'sy', 'sxy']
+
+# percentile of the pixel changes of a period's correction factors compared
+# with the tolerance, so the few pixels where the regression is ill
+# conditioned are recomposited on their own rather than with every period
+DRIFT_PERCENTILE = 99
+
+def period_index(date, months=1):
+    """
+    Index of the period of months holding a 'YYYY-MM-DD' date, counted from
+    year 0
+    """
+    year, month = int(date[:4]), int(date[5:7])
+    return (year * 12 + month - 1) // months
+
+def period_start(index, months=1):
+    """
+    First day of a period, 'YYYY-MM-DD'
+    """
+    year, month = divmod(index * months, 12)
+    return '{:04d}-{:02d}-01'.format(year, month + 1)
+
+class State(object):
+    """
+    On-disk state of the local pipeline for one AOI
+
+    Opens the state in directory, or creates it when there is none, in
+    which case slope and aspect are required.
+
+    Parameters:
+        directory (str): state directory, created if needed
+        slope (np.ndarray): terrain slope (degrees), see
+        terrain_local.slope_aspect()
+        aspect (np.ndarray): terrain aspect (degrees)
+        bands (list<str>): bands composited and corrected
+        months (int): period length, 1, 2, 3 or 6
+        tolerance (float): largest relative change of the correction
+        factors of a period's scenes left without recompositing a pixel
+
+    Attributes:
+        reads (int): scenes read back from disk since the state was opened
+        composited (int): period composites built since the state was opened
+        patched (int): period composites recomposited at a few pixels since
+        the state was opened
+    """
+
+    def __init__(self, directory, slope=None, aspect=None, bands=iw_local.RGBN, months=1,
+                 tolerance=0.01):
+        self.directory = directory
+        self.reads = 0
+        self.composited = 0
+        self.patched = 0
+        if os.path.exists(self._path('state.json')):
+            with open(self._path('state.json')) as f:
+                self.index = json.load(f)
+            terrain = np.load(self._path('terrain.npz'))
+            self.slope, self.aspect = terrain['slope'], terrain['aspect']
+            return
+        if slope is None or aspect is None:
+            raise ValueError('slope and aspect are required to create a state')
+        if AFTER_MONTHS % months:
+            raise ValueError('months must divide {}, got {}'.format(AFTER_MONTHS, months))
+        for sub in ['scenes', 'periods', 'coefficients']:
+            os.makedirs(os.path.join(directory, sub), exist_ok=True)
+        self.slope, self.aspect = slope, aspect
+        np.savez(self._path('terrain.npz'), slope=slope, aspect=aspect)
+        self.index = {'bands': list(bands), 'months': months, 'tolerance': tolerance,
+                      'fit': 0, 'unfitted': True, 'scenes': {}, 'periods': {}}
+        self.save()
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    @property
+    def bands(self):
+        return self.index['bands']
+
+    @property
+    def months(self):
+        return self.index['months']
+
+    def save(self):
+        """
+        Write the scene and period index
+        """
+        tmp = self._path('state.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self._path('state.json'))
+
+    def _period(self, key):
+        """
+        Composite and regression of a stored period
+        """
+        data = np.load(self._path('periods', key + '.npz'))
+        regression = terrain_local.Regression(self.bands)
+        for name in REGRESSION_SUMS:
+            setattr(regression, name, data[name])
+        return data['composite'], regression
+
+    def _write_period(self, key, composite, regression):
+        sums = {name: getattr(regression, name) for name in REGRESSION_SUMS}
+        np.savez(self._path('periods', key + '.npz'), composite=composite, **sums)
+
+    def _illumination(self, scene_id):
+        entry = self.index['scenes'][scene_id]
+        return terrain_local.illuminate(self.slope, self.aspect,
+                                        entry['azimuth'], entry['zenith'])
+
+    def add(self, scene_id, date, scene, azimuth, zenith):
+        """
+        Ingest a cloud masked scene, updating the regression sums of its
+        period. Its period is recomposited by the next run()
+
+        Parameters:
+            scene_id (str): unique scene id, e.g. system:index
+            date (str): acquisition date, 'YYYY-MM-DD'
+            scene (dict): masked image with the state bands
+            azimuth (float): MEAN_SOLAR_AZIMUTH_ANGLE
+            zenith (float): MEAN_SOLAR_ZENITH_ANGLE
+
+        Returns:
+            bool: False if the scene was already ingested
+        """
+        if scene_id in self.index['scenes']:
+            return False
+        stack = np.stack([scene[band] for band in self.bands]).astype(np.float32)
+        np.save(self._path('scenes', scene_id + '.npy'), stack)
+        key = period_start(period_index(date, self.months), self.months)
+        self.index['scenes'][scene_id] = {'date': date, 'azimuth': azimuth,
+                                          'zenith': zenith, 'period': key}
+        period = self.index['periods'].setdefault(key, {'scenes': [], 'stale': True,
+                                                        'fit': None, 'checked': None})
+        period['scenes'].append(scene_id)
+        period['stale'] = True
+        self.index['unfitted'] = True
+
+        if os.path.exists(self._path('periods', key + '.npz')):
+            composite, regression = self._period(key)
+        else:
+            composite, regression = np.zeros(0), terrain_local.Regression(self.bands)
+        regression.add(scene, self._illumination(scene_id))
+        self._write_period(key, composite, regression)
+        self.save()
+        return True
+
+    def drop(self, date):
+        """
+        Remove the scenes and periods starting before a date, e.g. those
+        no longer within the before window of the next date of interest.
+        The coefficients are refitted without their sums by the next run()
+
+        Parameters:
+            date (str): 'YYYY-MM-DD'
+
+        Returns:
+            int: number of scenes removed
+        """
+        first = period_index(date, self.months)
+        removed = 0
+        for key in [k for k in self.index['periods'] if period_index(k, self.months) < first]:
+            for scene_id in self.index['periods'].pop(key)['scenes']:
+                del self.index['scenes'][scene_id]
+                os.remove(self._path('scenes', scene_id + '.npy'))
+                removed += 1
+            os.remove(self._path('periods', key + '.npz'))
+            self.index['unfitted'] = True
+        self._prune()
+        self.save()
+        return removed
+
+    def _coefficients_path(self, fit):
+        return self._path('coefficients', '{}.npy'.format(fit))
+
+    def coefficients(self, refit=False):
+        """
+        C-correction coefficients of the stored scenes, refitted from the
+        merged regression sums of every period when scenes were added or
+        dropped since the last fit, or with refit, in which case every
+        period is marked for recompositing
+
+        Returns:
+            np.ndarray: (bands, rows, cols) array of c, see
+            terrain_local.Regression.coefficients()
+        """
+        if not refit and not self.index['unfitted']:
+            return np.load(self._coefficients_path(self.index['fit']))
+        regression = terrain_local.Regression(self.bands)
+        for key in self.index['periods']:
+            regression.merge(self._period(key)[1])
+        c = regression.coefficients()
+        self.index['fit'] += 1
+        self.index['unfitted'] = False
+        np.save(self._coefficients_path(self.index['fit']), c)
+        if refit:
+            for period in self.index['periods'].values():
+                period['stale'] = True
+        self._prune()
+        self.save()
+        return c
+
+    def _drift(self, key, old, new):
+        """
+        Relative change of the correction factors of the scenes of a period
+        between two sets of coefficients. A factor that becomes defined or
+        undefined counts as an infinite change
+
+        Returns:
+            tuple: DRIFT_PERCENTILE percentile of the changes over the
+            pixels of each scene, largest over the scenes, and the
+            (rows, cols) mask of pixels where a change exceeds the state
+            tolerance in some band of some scene
+        """
+        drift = 0.0
+        drifted = np.zeros(self.slope.shape, dtype=bool)
+        for scene_id in self.index['periods'][key]['scenes']:
+            illum = self._illumination(scene_id)
+            zenith = self.index['scenes'][scene_id]['zenith']
+            a = terrain_local.factor(illum, zenith, old)
+            b = terrain_local.factor(illum, zenith, new)
+            either = np.isfinite(a) | np.isfinite(b)
+            if not either.any():
+                continue
+            with np.errstate(divide='ignore', invalid='ignore'):
+                change = np.abs(b / a - 1)
+            change[either & ~np.isfinite(change)] = np.inf
+            drift = max(drift, np.percentile(change[either], DRIFT_PERCENTILE))
+            # NaN, where neither factor is defined, compares False
+            drifted |= (change > self.index['tolerance']).any(axis=0)
+        return drift, drifted
+
+    def _refresh(self, key, c):
+        """
+        Bring a period composited with earlier coefficients within the state
+        tolerance of c, recompositing it when its correction factors drifted
+        too far at the DRIFT_PERCENTILE percentile and otherwise only the
+        pixels where they drifted by more than the tolerance
+
+        Drift is measured from the fit the period was composited with, so
+        the pixels recomposited here are checked again after every refit.
+        """
+        period = self.index['periods'][key]
+        old = np.load(self._coefficients_path(period['fit']))
+        drift, drifted = self._drift(key, old, c)
+        if drift > self.index['tolerance']:
+            self._recomposite(key, c)
+            return
+        if drifted.any():
+            self._patch(key, c, drifted)
+        period['checked'] = self.index['fit']
+
+    def _prune(self):
+        """
+        Remove the coefficients of earlier fits no composite uses any more
+        """
+        used = {period['fit'] for period in self.index['periods'].values()}
+        used.add(self.index['fit'])
+        for name in os.listdir(self._path('coefficients')):
+            if int(os.path.splitext(name)[0]) not in used:
+                os.remove(self._path('coefficients', name))
+
+    def _recomposite(self, key, c):
+        """
+        Median composite of the corrected scenes of a period
+        """
+        corrected = []
+        for scene_id in self.index['periods'][key]['scenes']:
+            stack = np.load(self._path('scenes', scene_id + '.npy'))
+            self.reads += 1
+            scene = dict(zip(self.bands, stack.astype(float)))
+            entry = self.index['scenes'][scene_id]
+            out = terrain_local.correct(scene, self._illumination(scene_id),
+                                        entry['zenith'], c, self.bands)
+            corrected.append(np.stack([out[band] for band in self.bands]))
+        with warnings.catch_warnings():
+            # pixels masked in every scene of the period stay NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            composite = np.nanmedian(np.stack(corrected), axis=0)
+        self._write_period(key, composite, self._period(key)[1])
+        self.index['periods'][key]['stale'] = False
+        self.index['periods'][key]['fit'] = self.index['fit']
+        self.index['periods'][key]['checked'] = self.index['fit']
+        self.composited += 1
+
+    def _patch(self, key, c, pixels):
+        """
+        Recomposite a period at a (rows, cols) mask of pixels, reading only
+        those pixels of its memory mapped scenes
+        """
+        composite, regression = self._period(key)
+        corrected = []
+        for scene_id in self.index['periods'][key]['scenes']:
+            stack = np.load(self._path('scenes', scene_id + '.npy'), mmap_mode='r')
+            entry = self.index['scenes'][scene_id]
+            illum = self._illumination(scene_id)[pixels]
+            num = terrain_local.factor(illum, entry['zenith'], c[:, pixels])
+            corrected.append(stack[:, pixels].astype(float) * num)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            composite[:, pixels] = np.nanmedian(np.stack(corrected), axis=0)
+        self._write_period(key, composite, regression)
+        self.patched += 1
+
+    def composites(self, doi, refit=False):
+        """
+        Before and after period composites of a date of interest,
+        recompositing the periods with new scenes first and bringing those
+        composited with earlier coefficients within the state tolerance
+
+        Parameters:
+            doi (str): date of interest, 'YYYY-MM-DD'. Windows are rounded
+            to whole periods, with the period holding doi the first after
+            refit (bool): recomposite every period with refitted coefficients
+
+        Returns:
+            tuple: before and after dicts of 3D (periods, rows, cols) bands,
+            see iw_local.runIW()
+        """
+        c = self.coefficients(refit)
+        first = period_index(doi, self.months)
+        nbefore = BEFORE_MONTHS // self.months
+        nafter = AFTER_MONTHS // self.months
+        windows = []
+        for indexes in [range(first - nbefore, first), range(first, first + nafter)]:
+            stacks = []
+            for index in indexes:
+                key = period_start(index, self.months)
+                period = self.index['periods'].get(key)
+                if period is None:
+                    continue
+                if period['stale']:
+                    self._recomposite(key, c)
+                elif period['checked'] != self.index['fit']:
+                    self._refresh(key, c)
+                stacks.append(self._period(key)[0])
+            if not stacks:
+                raise ValueError('no scenes within the windows of {}'.format(doi))
+            windows.append(dict(zip(self.bands, np.stack(stacks, axis=1))))
+        self._prune()
+        self.save()
+        return windows[0], windows[1]
+
+    def run(self, doi, mask=None, niter=10, tol=None, refit=False):
+        """
+        Run the IW change analysis for a date of interest
+
+        Parameters:
+            doi (str): date of interest, 'YYYY-MM-DD'
+            mask (np.ndarray): optional boolean array of pixels to retain
+            niter (int): number of reweighting iterations
+            tol (float): optional convergence tolerance, see iw_local.iw()
+            refit (bool): recomposite every period, see composites()
+
+        Returns:
+            tuple: z-score image and number of reweighting iterations, see
+            iw_local.runIW()
+        """
+        before, after = self.composites(doi, refit)
+        return iw_local.runIW(before, after, mask, niter, tol)
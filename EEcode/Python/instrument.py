@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage instrumentation of the analysis pipeline
+
+A Recorder wraps the analysis of one AOI. While it is active, pipeline code
+marks its stages with stage(), and each stage records:
+    'calls' (int): times the stage was entered
+    'seconds' (float): wall time spent in the stage
+    'reduceRegion' (int): ee.Image.reduceRegion calls made in the stage
+    'getInfo' (int): blocking getInfo() round trips made in the stage, and
+    other blocking requests made through request()
+    'getInfo_seconds' (float): wall time spent waiting on those round trips
+    'payload_bytes' (int): JSON size of the getInfo() results
+    'graph_bytes' (int): serialized size of the objects passed to graph(),
+    or None if the ee module in use cannot serialize graphs
+
+Earth Engine builds graphs lazily, so 'seconds' of a stage that makes no
+getInfo() call is client side graph construction only, and the server
+time of every stage is paid by the stage that makes the round trip. A
+function mapped over a collection or list is traced once by Earth Engine,
+so its reduceRegion calls count once however many elements it runs on.
+Stages are nested: counts are added to every stage in progress, and nested
+stages are named by joining the enclosing names with '.'.
+
+stage() and graph() do nothing when no Recorder is active, so the pipeline
+modules can be used without instrumentation.
+
+    with instrument.Recorder(aoiId) as recorder:
+        output = analyze.analyze_iw(aoi, doi, dictionary, size, aoiId)
+    recorder.write('reports/' + aoiId + '.json')
+"""
+
+import collections
+import json
+import time
+from contextlib import contextmanager
+import ee
+import session
+
+FIELDS = ['calls', 'seconds', 'reduceRegion', 'getInfo', 'getInfo_seconds',
+          'payload_bytes', 'graph_bytes']
+
+# the Recorder in use, if any
+_active = None
+
+def graph_bytes(obj):
+    """
+    Size of the serialized graph of an Earth Engine object
+
+    Returns:
+        int: bytes of the JSON serialization, or None if the ee module in
+        use has no serializer
+    """
+    serializer = getattr(ee, 'serializer', None)
+    if serializer is None:
+        return None
+    return len(serializer.toJSON(obj))
+
+class Recorder(object):
+    """
+    Record per-stage timings and Earth Engine calls for one AOI
+
+    Entering a Recorder initializes the Earth Engine session, which adds
+    the API methods it counts, such as ee.Image.reduceRegion, to their
+    classes.
+
+    Parameters:
+        aoiId (str): identifier of the AOI, written to the report
+    """
+
+    def __init__(self, aoiId=None):
+        self.aoiId = aoiId
+        self.stages = collections.OrderedDict()
+        self.started = None
+        self.seconds = None
+        self._stack = []
+        self._patched = []
+
+    def __enter__(self):
+        global _active
+        if _active is not None:
+            raise RuntimeError('a Recorder is already active')
+        session.initialize()
+        self._patch(ee.Image, 'reduceRegion', self._count_reduce)
+        self._patch(ee.ComputedObject, 'getInfo', self._count_getinfo)
+        _active = self
+        self.started = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global _active
+        self.seconds = time.perf_counter() - self._start
+        _active = None
+        for cls, name, original in self._patched:
+            setattr(cls, name, original)
+        self._patched = []
+        return False
+
+    def _patch(self, cls, name, wrapper):
+        original = cls.__dict__[name]
+        self._patched.append((cls, name, original))
+        setattr(cls, name, wrapper(original))
+
+    def _count_reduce(self, original):
+        def reduceRegion(*args, **kwargs):
+            self._add('reduceRegion', 1)
+            return original(*args, **kwargs)
+        return reduceRegion
+
+    def _count_getinfo(self, original):
+        def getInfo(*args, **kwargs):
+            start = time.perf_counter()
+            out = original(*args, **kwargs)
+            self._add('getInfo', 1)
+            self._add('getInfo_seconds', time.perf_counter() - start)
+            self._add('payload_bytes', len(json.dumps(out)))
+            return out
+        return getInfo
+
+    def _add(self, field, value):
+        for name in self._stack:
+            self.stages[name][field] += value
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Record a pipeline stage, see stage()
+        """
+        if self._stack:
+            name = self._stack[-1] + '.' + name
+        if name not in self.stages:
+            self.stages[name] = dict.fromkeys(FIELDS, 0)
+        self._stack.append(name)
+        self.stages[name]['calls'] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name]['seconds'] += time.perf_counter() - start
+            self._stack.pop()
+
+    def graph(self, obj):
+        """
+        Add the serialized graph size of obj to the stages in progress
+        """
+        size = graph_bytes(obj)
+        if size is None:
+            for name in self._stack:
+                self.stages[name]['graph_bytes'] = None
+        elif all(self.stages[name]['graph_bytes'] is not None for name in self._stack):
+            self._add('graph_bytes', size)
+
+    def report(self):
+        """
+        Returns:
+            dict: 'id', 'started' (epoch seconds), 'seconds' and 'stages'
+            mapping each stage name to its FIELDS
+        """
+        return {'id': self.aoiId,
+                'started': self.started,
+                'seconds': self.seconds,
+                'stages': {name: dict(row) for name, row in self.stages.items()}}
+
+    def write(self, path):
+        """
+        Write report() to a JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+@contextmanager
+def stage(name):
+    """
+    Mark a pipeline stage of the active Recorder, if any
+
+    Parameters:
+        name (str): stage name, prefixed by the names of enclosing stages
+    """
+    if _active is None:
+        yield
+    else:
+        with _active.stage(name):
+            yield
+
+def request(function, *args):
+    """
+    Make a blocking Earth Engine request other than getInfo(), e.g. an
+    ee.data call, counted with the getInfo round trips of the active
+    Recorder, if any
+
+    Parameters:
+        function (callable): function making the request
+        args: arguments of function
+
+    Returns:
+        the result of function(*args)
+    """
+    if _active is None:
+        return function(*args)
+    return _active._count_getinfo(function)(*args)
+
+def graph(obj):
+    """
+    Record the serialized graph size of obj in the stages in progress of the
+    active Recorder, if any
+
+    Parameters:
+        obj (ee.ComputedObject): output of the stage
+
+    Returns:
+        obj, so calls can wrap stage outputs
+    """
+    if _active is not None:
+        _active.graph(obj)
+    return obj
+
+def aggregate(reports):
+    """
+    Combine the reports of many AOIs, e.g. a nightly batch
+
+    Parameters:
+        reports (list<dict>): outputs of Recorder.report()
+
+    Returns:
+        dict: per stage, 'aois' (number of reports containing the stage),
+        the sum of each of FIELDS over those reports, and 'max_seconds'
+    """
+    out = collections.OrderedDict()
+    for report in reports:
+        for name, row in report['stages'].items():
+            total = out.setdefault(name, dict(dict.fromkeys(FIELDS, 0), aois=0, max_seconds=0))
+            total['aois'] += 1
+            total['max_seconds'] = max(total['max_seconds'], row['seconds'])
+            for field in FIELDS:
+                if row[field] is None or total[field] is None:
+                    total[field] = None
+                else:
+                    total[field] += row[field]
+    return out
@@ -1,14 +1,15 @@
 # Import the Earth Engine Python Package
 import ee
+import instrument
+import session
 import stats
 
-# Initialize Earth Engine
-#ee.Initialize()
+# Earth Engine is initialized by session on first use
 
 # Import the Sentinel-2 image collection
-S2 = ee.ImageCollection("COPERNICUS/S2")
-CDL = ee.ImageCollection("USDA/NASS/CDL/2019")
-DEM = ee.ImageCollection("USGS/SRTMGL1_003")
+S2 = session.asset('ImageCollection', "COPERNICUS/S2")
+CDL = session.asset('ImageCollection', "USDA/NASS/CDL/2019")
+DEM = session.asset('ImageCollection', "USGS/SRTMGL1_003")
 
 def ND(img, NIR, R, G, SWIR1, SWIR2):
     """
@@ -198,7 +199,7 @@ def calc_zp(change, aoi, scl, tScl):
     #     maxPixels=1e13).rename(norm_bands, cat_sd)
     #mystats = mean.combine(sd)
     mystats = change.select(norm_bands).reduceRegion(
-        reducer=ee.Reducer.mode().combine(
+        reducer=stats.mode_reducer().combine(
             reducer2=ee.Reducer.stdDev(),
             sharedInputs=True
             ),
@@ -215,7 +216,22 @@ def calc_zp(change, aoi, scl, tScl):
     cp = stats.chi_p(chi, 6).multiply(-1).add(1).rename(['cv_p'])
     return chi.addBands(img_z).addBands(np).addBands(cp)
 
-def iw(change, aoi, niter, scl, tScl):
+def p_summary(zs, cat_p, aoi, scl, tScl):
+    """
+    Summarize p-values as their AOI-wide means, for convergence checks
+    
+    Returns:
+        ee.Array: 1D array of mean p-value per band in cat_p
+    """
+    return zs.select(cat_p).reduceRegion(
+        reducer=ee.Reducer.mean(),
+        geometry=aoi,
+        scale=scl,
+        maxPixels=1e13,
+        tileScale=tScl
+    ).toArray(cat_p)
+
+def iw(change, aoi, niter, scl, tScl, tol=None):
     """
     Iteratively reweight the pixels of an image 
     
@@ -225,20 +241,56 @@ def iw(change, aoi, niter, scl, tScl):
         niter (int): number of reweighting iterations
         scl (int): scale parameter for z-score calculation
         tScl (int): even integer [2,12]
+        tol (float): optional tolerance. If provided, reweighting stops once
+        the largest change in AOI-wide mean p-values of the normal bands
+        between iterations is below tol, with niter as the upper limit. cv_p
+        is not checked as the reweighted cv alternates between two states
     Returns:
-        ee.Image: z-score image output of calc_zp()
+        ee.Image: z-score image output of calc_zp() with property
+        'iterations', the number of reweighting iterations run
     """
     bands = change.bandNames()
     cat_p = bands.map(rnm_p)
+    sum_p = ee.List(['ndvi', 'ndsi', 'nbr', 'ndwi', 'rcvmax']).map(rnm_p)
     net = 1
     zs = calc_zp(change, aoi, scl, tScl)
-    while net <= niter:
-        dp = zs.select(cat_p).max(0.001).multiply(change).rename(bands)
+    if tol is None:
+        while net <= niter:
+            dp = zs.select(cat_p).max(0.001).multiply(change).rename(bands)
+            zs = calc_zp(dp, aoi, scl, tScl)
+            net += 1
+        return zs.set('iterations', niter)
+
+    def reweight(current, prev):
+        prev = ee.Dictionary(prev)
+        last = ee.Image(prev.get('zs'))
+        dp = last.select(cat_p).max(0.001).multiply(change).rename(bands)
         zs = calc_zp(dp, aoi, scl, tScl)
-        net += 1
-    return zs
-
-def runIW(before, after, aoi, scl, tScl, ag):
+        summary = p_summary(zs, sum_p, aoi, scl, tScl)
+        delta = ee.Number(summary.subtract(ee.Array(prev.get('summary')))\
+        .abs()\
+        .reduce(ee.Reducer.max(), [0])\
+        .get([0]))
+        return ee.Dictionary({
+                'done': delta.lt(tol),
+                'zs': zs,
+                'summary': summary,
+                'iterations': ee.Number(prev.get('iterations')).add(1)})
+
+    # skip the remaining iterations once converged, as in MAD_mc.imad
+    def step(current, prev):
+        done = ee.Number(ee.Dictionary(prev).get('done'))
+        return ee.Algorithms.If(done, prev, reweight(current, prev))
+
+    first = ee.Dictionary({
+            'done': 0,
+            'zs': zs,
+            'summary': p_summary(zs, sum_p, aoi, scl, tScl),
+            'iterations': 0})
+    output = ee.Dictionary(ee.List.sequence(1, niter).iterate(step, first))
+    return ee.Image(output.get('zs')).set('iterations', output.get('iterations'))
+
+def runIW(before, after, aoi, scl, tScl, ag, tol=None):
     """
     Run the complete iteratively weighted change analysis
     
@@ -249,6 +301,7 @@ def runIW(before, after, aoi, scl, tScl, ag):
         scl (int): scale parameter for image statistics calculations
         tileScale (int): even integer [2,12]
         ag ('yes/no'): mask agricultural areas using Cultivated Lands Dataset?
+        tol (float): optional convergence tolerance for iw()
         
     Returns:
         ee.Image: z-score image output of iw()
@@ -263,12 +316,13 @@ def runIW(before, after, aoi, scl, tScl, ag):
 
     time1 = after
     time2 = before
-    recent = time1.median().clip(aoi)
-    past = time2.median().clip(aoi)
-    recent = ee.Image(ee.Algorithms.If(ag == 'yes', recent.updateMask(agMask.And(demMask)), recent.updateMask(demMask)))
-    past = ee.Image(ee.Algorithms.If(ag == 'yes', past.updateMask(agMask.And(demMask)), past.updateMask(demMask)))
-    now = ND(recent, 'B8', 'B4', 'B3', 'B11', 'B12')
-    old = ND(past, 'B8', 'B4', 'B3', 'B11', 'B12')
+    with instrument.stage('composite'):
+        recent = time1.median().clip(aoi)
+        past = time2.median().clip(aoi)
+        recent = ee.Image(ee.Algorithms.If(ag == 'yes', recent.updateMask(agMask.And(demMask)), recent.updateMask(demMask)))
+        past = ee.Image(ee.Algorithms.If(ag == 'yes', past.updateMask(agMask.And(demMask)), past.updateMask(demMask)))
+        now = ND(recent, 'B8', 'B4', 'B3', 'B11', 'B12')
+        old = ND(past, 'B8', 'B4', 'B3', 'B11', 'B12')
 
     # bands = now.bandNames()
     # list = bands.getInfo()
@@ -276,24 +330,25 @@ def runIW(before, after, aoi, scl, tScl, ag):
 
 
     # CREATE IMAGE WITH BANDS FOR CHANGE METRICS CV, RCV, NDVI, NBR, NDSI
-    # Calculate cv from before and after images
-    cv = CV(old, now, rgbn, aoi, scl, tScl)
+    with instrument.stage('change'):
+        # Calculate cv from before and after images
+        cv = CV(old, now, rgbn, aoi, scl, tScl)
 
-    # Calculate rcv from before and after images
-    rcv = rcvmax(old, now, rgbn, aoi, scl, tScl)
-    #bands = rcv.bandNames()
-    #list = bands.getInfo()
-    #print('rcv bands:',  rcv.bandNames().getInfo())
+        # Calculate rcv from before and after images
+        rcv = rcvmax(old, now, rgbn, aoi, scl, tScl)
+        #bands = rcv.bandNames()
+        #list = bands.getInfo()
+        #print('rcv bands:',  rcv.bandNames().getInfo())
 
-    # Calculate combined normalized difference metrics from before and after images
-    diff = d(old, now, ['ndvi', 'ndsi', 'ndwi', 'nbr'])
+        # Calculate combined normalized difference metrics from before and after images
+        diff = d(old, now, ['ndvi', 'ndsi', 'ndwi', 'nbr'])
 
-    #bands = diff.bandNames()
-    #list = bands.getInfo()
-    #print('diff bands:',  bands.getInfo())
+        #bands = diff.bandNames()
+        #list = bands.getInfo()
+        #print('diff bands:',  bands.getInfo())
 
-    # Combine cv, rcv, and normalized difference images into single image
-    change = cv.addBands(diff).addBands(rcv)
+        # Combine cv, rcv, and normalized difference images into single image
+        change = instrument.graph(cv.addBands(diff).addBands(rcv))
 
     #bands = change.bandNames()
     #list = bands.getInfo()
@@ -301,7 +356,8 @@ def runIW(before, after, aoi, scl, tScl, ag):
     # zchange not used, but still need to call zp
     #zchange = calc_zp(change, aoi, 30)
 
-    iwchange = iw(change, aoi, 10, scl, tScl)
+    with instrument.stage('reweight'):
+        iwchange = instrument.graph(iw(change, aoi, 10, scl, tScl, tol))
     #bands = iwchange.bandNames()
     #list = bands.getInfo()
     #print('iwchange bands:',  bands.getInfo())
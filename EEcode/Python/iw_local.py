@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Local NumPy implementation of the iteratively weighted change analysis
+
+Mirrors iw.py for imagery already on disk. Images are dictionaries mapping
+band names to 2D arrays of equal shape, with masked pixels set to NaN.
+AOI-wide reductions are computed over every unmasked pixel in the arrays.
+"""
+
+import numpy as np
+import stats_local
+
+RGBN = ['B2', 'B3', 'B4', 'B8', 'B11', 'B12']
+NORM_BANDS = ['ndvi', 'ndsi', 'nbr', 'ndwi', 'rcvmax']
+
+def normalizedDifference(img, b1, b2):
+    """
+    Compute (b1 - b2) / (b1 + b2) between two bands of an image
+    """
+    x = img[b1]
+    y = img[b2]
+    return (x - y) / (x + y)
+
+def ND(img, NIR, R, G, SWIR1, SWIR2):
+    """
+    Calcuate multiple normalized difference metrics
+
+    Parameters:
+        img (dict): multispectral image
+        NIR (string): name of the near infrared band
+        R (string): name of the red band
+        G (string): ...
+        SWIR1 (string):...
+        SWIR2 (string):...
+
+    Returns:
+        dict: image with added bands ['ndvi', 'ndsi', 'nbr', 'ndwi']
+    """
+    out = dict(img)
+    out['ndvi'] = normalizedDifference(img, NIR, R)
+    out['ndsi'] = normalizedDifference(img, G, SWIR1) / img[NIR]
+    out['nbr'] = normalizedDifference(img, NIR, SWIR2)
+    out['ndwi'] = normalizedDifference(img, G, NIR)
+    return out
+
+def d(b, a, bnds):
+    """
+    Calculate difference between two images
+
+    Parameters:
+        b (dict): 'before' image
+        a (dict): 'after' image
+        bnds (list<str>): band names included in calculation
+
+    Returns:
+        np.ndarray: 3D difference array of shape (len(bnds), rows, cols)
+    """
+    return np.stack([b[band] - a[band] for band in bnds])
+
+def CV(b, a, bnds, stats=None):
+    """
+    Calculate the change vector between two images
+
+    Parameters:
+        b (dict): 'before' image
+        a (dict): 'after' image
+        bnds (list<str>): band names included in calculation
+        stats (tuple): optional precomputed (mean, stdDev) of the band
+        differences. Computed from b and a if not provided
+
+    Returns:
+        np.ndarray: change vector ['cv'] band
+    """
+    diff = d(b, a, bnds)
+    mn, sd = stats if stats is not None else stats_local.band_stats(diff)
+    z = (diff - mn[:, None, None]) / sd[:, None, None]
+    return np.square(z).sum(axis=0)
+
+def rcvmax(b, a, bnds, stats=None):
+    """
+    Calculate the relative change vector max metric between two images
+
+    Parameters:
+        b (dict): 'before' image
+        a (dict): 'after' image
+        bnds (list<str>): band names included in calculation
+        stats (tuple): optional precomputed (mean, stdDev) of the band
+        differences. Computed from b and a if not provided
+
+    Returns:
+        np.ndarray: relative change vector ['rcvmax'] band
+    """
+    diff = d(b, a, bnds)
+    maxab = np.square(np.maximum(
+        np.stack([b[band] for band in bnds]),
+        np.stack([a[band] for band in bnds])))
+    mn, sd = stats if stats is not None else stats_local.band_stats(diff)
+    # (diff / maxab - mn / maxab) / (sd / maxab) as in iw.rcvmax
+    stat = (diff / maxab - mn[:, None, None] / maxab) / (sd[:, None, None] / maxab)
+    return stat.sum(axis=0)
+
+def calc_zp(change, stats=None):
+    """
+    Calculate the z-score and p-values from normal and chi-squared distributions
+
+    Parameters:
+        change (dict): image containing bands ['cv', 'ndvi', 'ndsi', 'nbr',
+        'ndwi', 'rcvmax']
+        stats (tuple): optional precomputed (mode, stdDev) arrays of the
+        NORM_BANDS. Computed from change if not provided
+
+    Returns:
+        dict: image with bands ['cv_z', '<band>_z'..., '<band>_p'..., 'cv_p']
+    """
+    norm = np.stack([change[band] for band in NORM_BANDS])
+    if stats is None:
+        modes = np.array([stats_local.mode(band) for band in norm])
+        _, sds = stats_local.band_stats(norm)
+    else:
+        modes, sds = stats
+    img_z = (norm - modes[:, None, None]) / sds[:, None, None]
+    np_ = stats_local.norm_p(np.abs(img_z)) * 2
+
+    out = {'cv_z': change['cv']}
+    out.update({band + '_z': z for band, z in zip(NORM_BANDS, img_z)})
+    out.update({band + '_p': p for band, p in zip(NORM_BANDS, np_)})
+    out['cv_p'] = 1 - stats_local.chi_p(change['cv'], 6)
+    return out
+
+def p_summary(zs):
+    """
+    Summarize the normal p-values as their mean per band, for convergence
+    checks. cv_p is left out: it is a fixed chi-square transform of the
+    reweighted cv, which alternates between two states instead of settling
+    """
+    return np.array([np.nanmean(zs[band + '_p']) for band in NORM_BANDS])
+
+def iw(change, niter, tol=None):
+    """
+    Iteratively reweight the pixels of an image
+
+    Parameters:
+        change (dict): image of change metrics
+        niter (int): number of reweighting iterations
+        tol (float): optional tolerance. If provided, reweighting stops once
+        the largest change in mean normal p-values between iterations is
+        below tol, with niter as the upper limit
+
+    Returns:
+        tuple: z-score image output of calc_zp() and the number of
+        reweighting iterations run, niter without tol, as iw.iw sets
+        'iterations'
+    """
+    zs = calc_zp(change)
+    summary = p_summary(zs)
+    iterations = 0
+    while iterations < niter:
+        dp = {band: np.maximum(zs[band + '_p'], 0.001) * change[band]
+              for band in change}
+        zs = calc_zp(dp)
+        iterations += 1
+        if tol is not None:
+            last, summary = summary, p_summary(zs)
+            if np.max(np.abs(summary - last)) < tol:
+                break
+    if tol is not None:
+        print('iw iterations:', iterations)
+    return zs, iterations
+
+def composite(img):
+    """
+    Take the per-pixel median of any 3D (scenes, rows, cols) bands
+    """
+    return {band: np.nanmedian(arr, axis=0) if arr.ndim == 3 else arr
+            for band, arr in img.items()}
+
+def runIW(before, after, mask=None, niter=10, tol=None):
+    """
+    Run the complete iteratively weighted change analysis
+
+    Parameters:
+        before (dict): bands representing the reference landscape, either
+        2D composites or 3D (scenes, rows, cols) stacks to be median reduced
+        after (dict): bands representing the after condition
+        mask (np.ndarray): optional boolean array of pixels to retain,
+        e.g. the DEM and cultivated lands masks applied in iw.runIW
+        niter (int): number of reweighting iterations
+        tol (float): optional convergence tolerance for iw()
+
+    Returns:
+        tuple: z-score image and number of reweighting iterations, see iw()
+    """
+    recent = composite(after)
+    past = composite(before)
+    if mask is not None:
+        recent = {band: np.where(mask, arr, np.nan) for band, arr in recent.items()}
+        past = {band: np.where(mask, arr, np.nan) for band, arr in past.items()}
+    now = ND(recent, 'B8', 'B4', 'B3', 'B11', 'B12')
+    old = ND(past, 'B8', 'B4', 'B3', 'B11', 'B12')
+
+    # CREATE IMAGE WITH BANDS FOR CHANGE METRICS CV, RCV, NDVI, NBR, NDSI
+    change = {'cv': CV(old, now, RGBN)}
+    diff = d(old, now, ['ndvi', 'ndsi', 'ndwi', 'nbr'])
+    change.update(zip(['ndvi', 'ndsi', 'ndwi', 'nbr'], diff))
+    change['rcvmax'] = rcvmax(old, now, RGBN)
+
+    return iw(change, niter, tol)
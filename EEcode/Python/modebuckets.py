@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+Bucket limits of the mode estimates shared by stats.mode_reducer and
+stats_local.ModeHistogram, so the Earth Engine and local estimates share a
+resolution. Kept free of dependencies so importing stats loads neither
+numpy nor scipy.
+"""
+
+MODE_MAX_BUCKETS = 1024
+MODE_MIN_BUCKET_WIDTH = 2.0 ** -20
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Local square morphology for change masks, the counterpart of the
+focal_min / focal_max cleaning in analyze.analyze_iw
+
+Square min and max filters are separable, so each is run as a 1D filter
+along rows and then along columns. The 1D filters use the van Herk /
+Gil-Werman algorithm: the line is cut into blocks of the window size, and
+the running min (or max) from the start and from the end of every block
+are combined, so each pixel costs a constant three operations whatever the
+radius.
+
+Masks are boolean or uint8 arrays. As with focal_min and focal_max on a
+masked image, pixels beyond the edges of the image are ignored rather than
+treated as background.
+"""
+
+import numpy as np
+import tiles
+
+# working memory per pixel of a window: the uint8 mask, padded copies and
+# the block running values
+BYTES_PER_PIXEL = 8
+
+def _filter1d(arr, radius, axis, op, fill):
+    """
+    Running op over windows of 2 * radius + 1 pixels along one axis
+
+    Parameters:
+        arr (np.ndarray): 2D uint8 array
+        radius (int): window radius in pixels
+        axis (int): axis to filter along
+        op (np.ufunc): np.minimum or np.maximum
+        fill (int): identity of op, used beyond the edges
+
+    Returns:
+        np.ndarray: filtered array
+    """
+    size = 2 * radius + 1
+    n = arr.shape[axis]
+    blocks = -(-(n + 2 * radius) // size)
+    shape = list(arr.shape)
+    shape[axis] = blocks * size
+    padded = np.full(shape, fill, dtype=arr.dtype)
+    padded[_along(axis, slice(radius, radius + n))] = arr
+    # split the axis into (blocks, size) and run op from the start and from
+    # the end of each block, one whole array operation per block position
+    forward = padded.reshape(shape[:axis] + [blocks, size] + shape[axis + 1:])
+    backward = forward.copy()
+    for k in range(1, size):
+        op(forward[_along(axis + 1, k - 1)], forward[_along(axis + 1, k)],
+           out=forward[_along(axis + 1, k)])
+    for k in range(size - 2, -1, -1):
+        op(backward[_along(axis + 1, k + 1)], backward[_along(axis + 1, k)],
+           out=backward[_along(axis + 1, k)])
+    forward = forward.reshape(shape)
+    backward = backward.reshape(shape)
+    # the window of pixel i is padded[i:i + size]: the end of the block
+    # holding i and the start of the block holding i + size - 1
+    return op(backward[_along(axis, slice(0, n))],
+              forward[_along(axis, slice(size - 1, size - 1 + n))])
+
+def _along(axis, index):
+    """
+    Index of a 2D (or split 3D) array selecting index along axis
+    """
+    return (slice(None),) * axis + (index,)
+
+def _as_uint8(mask):
+    mask = np.asarray(mask)
+    if mask.dtype == bool:
+        return mask.view(np.uint8)
+    return mask.astype(np.uint8)
+
+def erode(mask, radius=1):
+    """
+    Square minimum filter, as focal_min(radius, 'square', 'pixels')
+
+    Parameters:
+        mask (np.ndarray): 2D boolean or uint8 mask
+        radius (int): half width of the square in pixels
+
+    Returns:
+        np.ndarray: uint8 mask
+    """
+    out = _filter1d(_as_uint8(mask), radius, 0, np.minimum, 255)
+    return _filter1d(out, radius, 1, np.minimum, 255)
+
+def dilate(mask, radius=1):
+    """
+    Square maximum filter, as focal_max(radius, 'square', 'pixels')
+
+    Parameters:
+        mask (np.ndarray): 2D boolean or uint8 mask
+        radius (int): half width of the square in pixels
+
+    Returns:
+        np.ndarray: uint8 mask
+    """
+    out = _filter1d(_as_uint8(mask), radius, 0, np.maximum, 0)
+    return _filter1d(out, radius, 1, np.maximum, 0)
+
+def opening(mask, radius=1):
+    """
+    Erode then dilate a mask, removing features narrower than the square
+
+    Returns:
+        np.ndarray: uint8 mask
+    """
+    return dilate(erode(mask, radius), radius)
+
+def opening_tiled(mask, out, radius=1, budget=2**28):
+    """
+    Open a mask in row windows within a memory budget
+
+    Each window is read with a halo of 2 * radius rows on either side, the
+    reach of the erosion plus the dilation, so the rows written are those
+    of opening() on the whole mask.
+
+    Parameters:
+        mask (np.ndarray): 2D boolean or uint8 mask, e.g. np.memmap
+        out (np.ndarray): array of the same shape receiving the result
+        radius (int): half width of the square in pixels
+        budget (int): bytes of working memory available for each window
+
+    Returns:
+        int: number of windows
+    """
+    shape = mask.shape
+    halo = 2 * radius
+    rows = tiles.tile_rows(shape, budget, BYTES_PER_PIXEL)
+    count = 0
+    for window in tiles.windows(shape, rows):
+        start = max(window.start - halo, 0)
+        stop = min(window.stop + halo, shape[0])
+        opened = opening(mask[start:stop], radius)
+        out[window] = opened[window.start - start:window.stop - start]
+        count += 1
+    return count
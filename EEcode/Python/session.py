@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy Earth Engine session and assets
+
+Earth Engine is initialized at most once per process, on the first call to
+initialize() or the first use of an asset, rather than when the pipeline
+modules are imported. Importing analyze, or any module it imports, makes no
+network calls, so worker processes only pay for authentication when they
+start working.
+
+Module level assets are declared with asset() and called to get the object:
+
+    S2 = session.asset('ImageCollection', 'COPERNICUS/S2')
+    ...
+    S2().filterDate(prior, today)
+"""
+
+import ee
+
+_initialized = False
+_credentials = None
+
+def configure(credentials=None):
+    """
+    Set the credentials used when the session is initialized
+
+    Parameters:
+        credentials (tuple): (service account, private key file), or None
+        for the default credentials
+    """
+    global _credentials
+    _credentials = credentials
+
+def initialize(credentials=None):
+    """
+    Initialize Earth Engine, unless already done in this process
+
+    Parameters:
+        credentials (tuple): optional (service account, private key file),
+        defaults to those set by configure()
+    """
+    global _initialized
+    if _initialized:
+        return
+    # a script may have called ee.Initialize itself
+    is_initialized = getattr(ee.data, 'is_initialized', None) if hasattr(ee, 'data') else None
+    if is_initialized is None or not is_initialized():
+        credentials = credentials or _credentials
+        if credentials:
+            ee.Initialize(ee.ServiceAccountCredentials(*credentials))
+        else:
+            ee.Initialize()
+    _initialized = True
+
+def asset(kind, asset_id):
+    """
+    Declare an Earth Engine asset, built on first use
+
+    Parameters:
+        kind (str): ee constructor, e.g. 'Image' or 'ImageCollection'
+        asset_id (str): asset id
+
+    Returns:
+        function: returns the ee object, initializing the session and
+        building the object on its first call only
+    """
+    loaded = []
+
+    def load():
+        if not loaded:
+            initialize()
+            loaded.append(getattr(ee, kind)(asset_id))
+        return loaded[0]
+
+    load.asset_id = asset_id
+    return load
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Local output sinks for change polygons
+
+Features are written as they are produced, e.g. by vectors_local.vectorize,
+and flushed every flush_every features, so the output can be read while a
+run is still going and memory does not grow with the number of polygons.
+
+Formats:
+    GeoJSONSeqSink: newline delimited GeoJSON features (RFC 8142 without
+    the record separator, as GDAL's GeoJSONSeq driver writes by default)
+    IndexedSink: length prefixed GeoJSON features in a binary file, with a
+    sidecar '.idx' file of fixed size (offset, length, bounding box)
+    records, so a reader can fetch the features within a bounding box by
+    seeking rather than parsing the whole file
+
+    with sinks.open_sink('reports/' + aoiId + '.geojsonl') as sink:
+        for feature in vectors_local.vectorize(selected, 40, transform, zs=zs):
+            sink.write(feature)
+"""
+
+import json
+import struct
+import numpy as np
+
+# header of IndexedSink feature files
+MAGIC = b'CHGPOLY1'
+
+# offset, length, minx, miny, maxx, maxy of each feature
+INDEX_RECORD = struct.Struct('<QQdddd')
+
+def _default(obj):
+    # numpy scalars from the local engines
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('{} is not JSON serializable'.format(type(obj).__name__))
+
+def dumps(feature):
+    """
+    Compact JSON text of a feature
+    """
+    return json.dumps(feature, separators=(',', ':'), default=_default)
+
+def bounds(geometry):
+    """
+    Bounding box of a GeoJSON Polygon or MultiPolygon
+
+    Returns:
+        tuple: (minx, miny, maxx, maxy)
+    """
+    coords = geometry['coordinates']
+    if geometry['type'] == 'Polygon':
+        coords = [coords]
+    xy = np.array([point for polygon in coords for point in polygon[0]], dtype=float)
+    return tuple(xy.min(axis=0).tolist() + xy.max(axis=0).tolist())
+
+class GeoJSONSeqSink(object):
+    """
+    Write features as newline delimited GeoJSON
+
+    Parameters:
+        path (str): output file
+        flush_every (int): features buffered between flushes
+    """
+
+    def __init__(self, path, flush_every=100):
+        self.path = path
+        self.flush_every = flush_every
+        self.count = 0
+        self._file = open(path, 'w')
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def write(self, feature):
+        """
+        Add a GeoJSON Feature dictionary
+        """
+        self._file.write(dumps(feature) + '\n')
+        self.count += 1
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Make the features written so far visible to readers
+        """
+        self._file.flush()
+        self._pending = 0
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+class IndexedSink(GeoJSONSeqSink):
+    """
+    Write features to a binary file with a bounding box index
+
+    Every feature is stored as a 4 byte little endian length followed by
+    its JSON text. The index file is only appended when the features file
+    has been flushed, so every index record a reader sees points at
+    complete data. See read_index() and query().
+
+    Parameters:
+        path (str): output file, the index is written to path + '.idx'
+        flush_every (int): features buffered between flushes
+    """
+
+    def __init__(self, path, flush_every=100):
+        self.path = path
+        self.flush_every = flush_every
+        self.count = 0
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._index = open(path + '.idx', 'wb')
+        self._offset = len(MAGIC)
+        self._records = []
+
+    def write(self, feature):
+        """
+        Add a GeoJSON Feature dictionary
+        """
+        data = dumps(feature).encode('utf-8')
+        self._file.write(struct.pack('<I', len(data)))
+        self._file.write(data)
+        self._records.append(INDEX_RECORD.pack(self._offset, len(data) + 4,
+                                               *bounds(feature['geometry'])))
+        self._offset += len(data) + 4
+        self.count += 1
+        if len(self._records) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Make the features written so far visible to readers
+        """
+        self._file.flush()
+        self._index.write(b''.join(self._records))
+        self._index.flush()
+        self._records = []
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._index.close()
+            self._file = self._index = None
+
+def open_sink(path, flush_every=100):
+    """
+    Open the sink for a path by its extension, '.geojsonl' or '.geojsons'
+    for GeoJSONSeqSink, anything else for IndexedSink
+    """
+    if path.endswith('.geojsonl') or path.endswith('.geojsons'):
+        return GeoJSONSeqSink(path, flush_every)
+    return IndexedSink(path, flush_every)
+
+def read_index(path):
+    """
+    Read the index of an IndexedSink file, as far as it has been flushed
+
+    Returns:
+        np.ndarray: (features, 6) array of offset, length, minx, miny,
+        maxx, maxy
+    """
+    with open(path + '.idx', 'rb') as f:
+        data = f.read()
+    data = data[:len(data) - len(data) % INDEX_RECORD.size]
+    return np.array(list(INDEX_RECORD.iter_unpack(data)), dtype=float).reshape(-1, 6)
+
+def query(path, bbox=None):
+    """
+    Read the features of an IndexedSink file, optionally only those whose
+    bounding box intersects bbox
+
+    Parameters:
+        path (str): file written by IndexedSink
+        bbox (tuple): (minx, miny, maxx, maxy)
+
+    Returns:
+        generator: GeoJSON Feature dictionaries
+    """
+    index = read_index(path)
+    if bbox is not None:
+        keep = ((index[:, 2] <= bbox[2]) & (index[:, 4] >= bbox[0]) &
+                (index[:, 3] <= bbox[3]) & (index[:, 5] >= bbox[1]))
+        index = index[keep]
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not an IndexedSink file'.format(path))
+        for offset, length in index[:, :2].astype(np.int64).tolist():
+            f.seek(offset + 4)
+            yield json.loads(f.read(length - 4).decode('utf-8'))
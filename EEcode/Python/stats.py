@@ -1,8 +1,24 @@
 import ee
+from modebuckets import MODE_MAX_BUCKETS, MODE_MIN_BUCKET_WIDTH
 
 # Initialize Earth Engine
 #ee.Initialize()
 
+def mode_reducer():
+    """
+    Histogram based mode reducer with bounded bucket count and width
+
+    Uses the same bucket limits as stats_local.ModeHistogram, so the EE and
+    local estimates share a resolution and are within half a bucket width
+    of the modal bucket.
+
+    Returns:
+        ee.Reducer: mode reducer
+    """
+    return ee.Reducer.mode(
+            maxBuckets = MODE_MAX_BUCKETS,
+            minBucketWidth = MODE_MIN_BUCKET_WIDTH)
+
 def norm_p(z):
     """ 
     Caclulate (approx) the p-value for a standard normal distribution
@@ -91,3 +107,23 @@ def ldaScore(img, bands, dictionary):
     intercept = dictionary.toImage(['int'])
     score = img.multiply(coeffs).addBands(intercept).reduce(ee.Reducer.sum())
     return score
+
+def ldaMargin(img, bands, coefficients):
+    """
+    LDA score less the 'lda' threshold, with per pixel coefficients
+
+    The threshold is folded into the intercept so scoring is a single
+    multiply-sum, and change pixels are those where the margin is >= 0.
+
+    Parameters:
+        img (ee.Image): multiband image
+        bands (list<str>): band names to be scored
+        coefficients (ee.Image): coefficient image with bands, 'int' and
+        'lda', see dictionaries.coefficient_image
+    Returns:
+        ee.Image: image with one band of score - lda
+    """
+    offset = coefficients.select(['int']).subtract(coefficients.select(['lda'])).rename(['offset'])
+    coeffs = coefficients.select(bands).addBands(offset)
+    return img.select(bands).addBands(ee.Image.constant(1).rename(['offset']))\
+    .multiply(coeffs).reduce(ee.Reducer.sum())
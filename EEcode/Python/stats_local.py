@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+NumPy equivalents of the statistical helpers in stats.py
+
+Images are dictionaries mapping band names to 2D arrays of equal shape.
+Masked pixels are represented by NaN.
+"""
+
+import numpy as np
+from scipy.special import expit, gammainc
+# bucket limits for mode estimates, shared with stats.mode_reducer
+from modebuckets import MODE_MAX_BUCKETS, MODE_MIN_BUCKET_WIDTH
+
+def norm_p(z):
+    """
+    Caclulate (approx) the p-value for a standard normal distribution
+
+    Parameters:
+        z (np.ndarray): array containing z-scores
+
+    Returns:
+        np.ndarray: array containing p-values
+    """
+    # 1 - 1 / (1 + exp(-1.65451 * z)) as in stats.norm_p
+    return 1 - expit(z * 1.65451)
+
+def chi_p(chi, df):
+    """
+    Caclulate the CDF probability of a chi-square statistic
+
+    Parameters:
+        chi (np.ndarray): observations from a chi-squared dist
+        df (int): degrees of freedom
+
+    Returns:
+        np.ndarray: array of probabilities
+    """
+    return gammainc(df / 2, chi / 2)
+
+def mode(values, maxBuckets=None, minBucketWidth=None):
+    """
+    Histogram estimate of the mode of an array, ignoring masked values
+
+    Uses the same mergeable ModeHistogram as the tiled engine, so in-memory
+    and tiled runs agree. See ModeHistogram for the error bound.
+
+    Parameters:
+        values (np.ndarray): array of observations
+        maxBuckets (int): maximum number of occupied buckets
+        minBucketWidth (float): smallest bucket width allowed
+
+    Returns:
+        float: center of the most populated bucket
+    """
+    hist = ModeHistogram(maxBuckets, minBucketWidth)
+    hist.update(values)
+    return hist.mode()
+
+def band_stats(stack):
+    """
+    Calculate the mean and (population) standard deviation of each band
+
+    Parameters:
+        stack (np.ndarray): 3D array of shape (bands, rows, cols)
+
+    Returns:
+        tuple: 1D arrays (mean, stdDev) of length bands
+    """
+    flat = stack.reshape(stack.shape[0], -1)
+    return np.nanmean(flat, axis=1), np.nanstd(flat, axis=1)
+
+def ldaScore(img, bands, dictionary):
+    """
+    Function converting multiband image into single band image of LDA scores
+
+    Parameters:
+        img (dict): image with at least the bands in bands
+        bands (list<str>): band names to be scored
+        dictionary (dict): lda coefficients keyed by band name, plus 'int'
+
+    Returns:
+        np.ndarray: LDA scores based on provided coefficients
+    """
+    score = np.full_like(img[bands[0]], dictionary['int'], dtype=float)
+    for band in bands:
+        score += img[band] * dictionary[band]
+    return score
+
+def coefficient_image(landcover, habitats, bands):
+    """
+    Per pixel LDA coefficients from a land cover array, as
+    dictionaries.coefficient_image
+
+    Parameters:
+        landcover (np.ndarray): land cover classes
+        habitats (dict): lda coefficient dictionary keyed by class
+        bands (list<str>): band names to be scored
+
+    Returns:
+        dict: arrays of the coefficients of bands, 'int' and 'lda', NaN
+        where the class has no habitat
+    """
+    keys = list(bands) + ['int', 'lda']
+    classes = np.array(sorted(habitats))
+    table = np.array([[habitats[cls][key] for key in keys] for cls in classes] +
+                     [[np.nan] * len(keys)], dtype=float)
+    index = np.searchsorted(classes, landcover)
+    index = np.where(classes[np.minimum(index, classes.size - 1)] == landcover, index, classes.size)
+    return {key: table[index, i] for i, key in enumerate(keys)}
+
+def ldaMargin(img, bands, coefficients):
+    """
+    LDA score less the 'lda' threshold, with per pixel coefficients, as
+    stats.ldaMargin
+
+    Parameters:
+        img (dict): image with at least the bands in bands
+        bands (list<str>): band names to be scored
+        coefficients (dict): output of coefficient_image()
+
+    Returns:
+        np.ndarray: score - lda, change where >= 0
+    """
+    score = coefficients['int'] - coefficients['lda']
+    for band in bands:
+        score = score + img[band] * coefficients[band]
+    return score
+
+class Moments(object):
+    """
+    Mergeable per band count, mean and sum of squared deviations
+
+    Accumulates over successive windows of an image so that AOI-wide means
+    and standard deviations can be computed without holding the whole image
+    in memory. Partial results from different windows combine with merge().
+    """
+
+    def __init__(self, nbands):
+        self.count = np.zeros(nbands)
+        self.mean = np.zeros(nbands)
+        self.m2 = np.zeros(nbands)
+
+    def update(self, stack):
+        """
+        Add the unmasked pixels of a (bands, ...) array
+        """
+        flat = stack.reshape(stack.shape[0], -1)
+        other = Moments(flat.shape[0])
+        other.count = np.isfinite(flat).sum(axis=1).astype(float)
+        seen = other.count > 0
+        other.mean[seen] = np.nanmean(flat[seen], axis=1)
+        other.m2[seen] = np.nansum(np.square(flat[seen] - other.mean[seen, None]), axis=1)
+        self.merge(other)
+
+    def merge(self, other):
+        """
+        Combine the moments of another accumulator into this one
+        """
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(count > 0, other.count / count, 0)
+        self.mean = self.mean + delta * share
+        self.m2 = self.m2 + other.m2 + np.square(delta) * self.count * share
+        self.count = count
+
+    def stdDev(self):
+        """
+        Population standard deviation, matching ee.Reducer.stdDev
+        """
+        return np.sqrt(self.m2 / self.count)
+
+class ModeHistogram(object):
+    """
+    Mergeable sparse histogram for estimating the mode of a single band
+
+    Bucket widths are powers of two so histograms built from different
+    windows can always be brought to a common width and added. When the
+    number of occupied buckets exceeds maxBuckets the width is doubled.
+
+    The width is always the smallest power of two (not below
+    minBucketWidth) at which the data seen so far occupy at most maxBuckets
+    buckets. This does not depend on how the data are split into windows,
+    so a histogram merged from tiles is identical to one built in memory.
+    The estimate is the center of the modal bucket, so it is within
+    error() = width / 2 of the mode at that resolution, and the width stays
+    below 2 * range of the data / (maxBuckets - 2).
+    Memory is O(maxBuckets) regardless of the number of pixels.
+
+    Parameters:
+        maxBuckets (int): maximum number of occupied buckets retained
+        minBucketWidth (float): smallest bucket width allowed
+    """
+
+    def __init__(self, maxBuckets=None, minBucketWidth=None):
+        self.maxBuckets = maxBuckets or MODE_MAX_BUCKETS
+        self.minBucketWidth = minBucketWidth or MODE_MIN_BUCKET_WIDTH
+        self.width = None
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0)
+
+    def _histogram(self, values, width):
+        keys = np.floor(values / width).astype(np.int64)
+        lo = keys.min()
+        if keys.max() - lo < 4 * keys.size:
+            counts = np.bincount(keys - lo)
+            occupied = np.nonzero(counts)[0]
+            return occupied + lo, counts[occupied]
+        # sparse outliers, avoid allocating the full key range
+        return np.unique(keys, return_counts=True)
+
+    def _batch_width(self, values):
+        # smallest power of two width at which values alone fit in
+        # maxBuckets buckets, never finer than the current width
+        floor = max(self.width or 0, self.minBucketWidth)
+        span = values.max() - values.min()
+        if span == 0:
+            return floor
+        # at most span / width + 2 buckets are occupied at this width
+        width = max(2.0 ** np.ceil(np.log2(span / (self.maxBuckets - 2))), floor)
+        while width / 2 >= floor and \
+              self._histogram(values, width / 2)[0].size <= self.maxBuckets:
+            width /= 2
+        return width
+
+    def _coarsen(self, keys, counts, factor):
+        keys = np.floor_divide(keys, factor)
+        keys, index = np.unique(keys, return_inverse=True)
+        return keys, np.bincount(index, weights=counts)
+
+    def _combine(self, keys, counts):
+        keys, index = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        self.counts = np.bincount(index, weights=np.concatenate([self.counts, counts]))
+        self.keys = keys
+        while self.keys.size > self.maxBuckets:
+            self.width *= 2
+            self.keys, self.counts = self._coarsen(self.keys, self.counts, 2)
+
+    def update(self, values):
+        """
+        Add the unmasked values of an array
+        """
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+        width = self._batch_width(values)
+        if self.width is not None and width > self.width:
+            self.keys, self.counts = self._coarsen(
+                self.keys, self.counts, int(width / self.width))
+        self.width = width
+        keys, counts = self._histogram(values, width)
+        self._combine(keys, counts.astype(float))
+
+    def merge(self, other):
+        """
+        Combine the histogram of another accumulator into this one
+        """
+        if other.width is None:
+            return
+        if self.width is None:
+            self.width = other.width
+        keys, counts = other.keys, other.counts
+        if other.width < self.width:
+            keys, counts = self._coarsen(keys, counts, int(self.width / other.width))
+        elif other.width > self.width:
+            self.keys, self.counts = self._coarsen(
+                self.keys, self.counts, int(other.width / self.width))
+            self.width = other.width
+        self._combine(keys, counts)
+
+    def mode(self):
+        """
+        Center of the most populated bucket
+        """
+        if self.width is None:
+            return np.nan
+        return (self.keys[np.argmax(self.counts)] + 0.5) * self.width
+
+    def error(self):
+        """
+        Maximum distance between the estimate and the modal bucket edges
+        """
+        if self.width is None:
+            return np.nan
+        return self.width / 2
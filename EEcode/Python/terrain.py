@@ -1,4 +1,5 @@
 import ee
+import instrument
 
 # Initialize Earth Engine
 #ee.Initialize()
@@ -25,23 +26,15 @@ def illuminate(img, elev):
 #     return image.addBands(ee.Image(1)).addBands(illuminate(image, elev.clip(aoi)))
 
 
-def c_correct(imgCol, bands, aoi, elev):
+def coefficients(illumCol, bands):
     """
-    Calculate and correct hillshade for each image in a collection.
+    Regress each band on illumination across a collection at every pixel
     Parameters:
-        imgCol (ee.ImageCollection): images to be corrected
+        illumCol (ee.ImageCollection): images with 'constant' and 'illumination' bands
         bands (list): bands to correct
-        aoi (ee.Geometry): area of interest
-        elev (ee.Image): digital elevation model
     Returns:
-        ee.ImageCollection
+        ee.Image: c = intercept / slope for each band
     """
-    print('Running c_correct algorithm')
-    otherbands = ee.Image(imgCol.first()).bandNames().removeAll(bands)
-    #print('otherbands:', otherbands)
-    illumCol = imgCol.map(lambda image: image.addBands(ee.Image(1)).addBands(illuminate(image, elev.clip(aoi))))
-    #illumCol.map(illumImg)
-
     regbands = ee.List(['constant', 'illumination']).cat(bands)
     coeffs = illumCol.select(regbands).reduce(ee.Reducer.linearRegression(
         numX = 2,
@@ -54,7 +47,85 @@ def c_correct(imgCol, bands, aoi, elev):
 
     intercept = coeffs.arraySlice(0, 0, 1).arrayProject([1]).arrayFlatten([bands])
 
-    c = intercept.divide(betas)
+    return intercept.divide(betas)
+
+def add_illumination(imgCol, aoi, elev):
+    """
+    Add the 'constant' and 'illumination' regression bands to each image
+    """
+    return imgCol.map(lambda image: image.addBands(ee.Image(1)).addBands(illuminate(image, elev.clip(aoi))))
+
+def asset_exists(asset_id):
+    """
+    Check whether an Earth Engine asset exists. Makes one blocking request
+    """
+    try:
+        return ee.data.getInfo(asset_id) is not None
+    except ee.EEException:
+        return False
+
+def export_description(asset_id):
+    """
+    Description of the export of coefficients to an asset, one per asset so
+    concurrent runs over the same AOI and window find each other's export
+    """
+    return 'c_correct_' + asset_id.split('/')[-1]
+
+def export_running(asset_id):
+    """
+    Check whether an export of coefficients to an asset is waiting to run or
+    running. Makes one blocking request
+    """
+    description = export_description(asset_id)
+    return any(task.get('description') == description and
+               task.get('state') in ('READY', 'RUNNING')
+               for task in ee.data.getTaskList())
+
+def export_coefficients(c, asset_id, aoi, proj):
+    """
+    Export c_correct coefficients to an image asset
+    Parameters:
+        c (ee.Image): coefficients from coefficients()
+        asset_id (str): asset to export to
+        aoi (ee.Geometry): area of interest, the region exported
+        proj (dict): client side projection of the corrected bands, with
+        keys 'crs' and 'transform'. c is a reduction of a collection, whose
+        default projection is 1 degree WGS84
+    Returns:
+        ee.batch.Task: the export, not yet started
+    """
+    return ee.batch.Export.image.toAsset(image = c.toFloat(),
+                                         description = export_description(asset_id),
+                                         assetId = asset_id,
+                                         region = aoi,
+                                         crs = proj['crs'],
+                                         crsTransform = proj['transform'],
+                                         maxPixels = 1e13)
+
+def c_correct(imgCol, bands, aoi, elev, c=None):
+    """
+    Calculate and correct hillshade for each image in a collection.
+    Parameters:
+        imgCol (ee.ImageCollection): images to be corrected
+        bands (list): bands to correct
+        aoi (ee.Geometry): area of interest
+        elev (ee.Image): digital elevation model
+        c (ee.Image): optional precomputed coefficients from coefficients(),
+        e.g. from a previous run over the same AOI and window, in which
+        case the regression is skipped
+    Returns:
+        ee.ImageCollection
+    """
+    print('Running c_correct algorithm')
+    otherbands = ee.Image(imgCol.first()).bandNames().removeAll(bands)
+    #print('otherbands:', otherbands)
+    with instrument.stage('illumination'):
+        illumCol = add_illumination(imgCol, aoi, elev)
+    #illumCol.map(illumImg)
+
+    if c is None:
+        with instrument.stage('coefficients'):
+            c = instrument.graph(coefficients(illumCol, bands))
 
     # not used
     #mnshade = illumCol.select('illumination').reduce(ee.Reducer.mean())
@@ -65,6 +136,7 @@ def c_correct(imgCol, bands, aoi, elev):
         correction = image.select(bands).multiply(num)
         return image.select(otherbands.cat(['illumination'])).addBands(correction)
 
-    corrected = illumCol.map(correct)
+    with instrument.stage('correct'):
+        corrected = illumCol.map(correct)
 
     return corrected
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Local NumPy implementation of the C-correction in terrain.py
+
+Scenes are dictionaries mapping band names to 2D arrays, with masked pixels
+set to NaN. Solar angles are passed alongside as (azimuth, zenith) pairs,
+the MEAN_SOLAR_AZIMUTH_ANGLE and MEAN_SOLAR_ZENITH_ANGLE scene properties.
+"""
+
+import numpy as np
+
+def slope_aspect(dem, cellsize):
+    """
+    Calculate terrain slope and aspect in degrees, as ee.Terrain does
+
+    Parameters:
+        dem (np.ndarray): 2D elevation array, first row northernmost
+        cellsize (float): pixel size in the units of the elevation, or a
+        (row, col) pair for non-square pixels
+
+    Returns:
+        tuple: (slope, aspect) arrays in degrees, aspect clockwise from north
+    """
+    dzdrow, dzdx = np.gradient(dem.astype(float), *np.broadcast_to(cellsize, 2))
+    slope = np.degrees(np.arctan(np.hypot(dzdx, dzdrow)))
+    aspect = np.degrees(np.arctan2(-dzdx, dzdrow)) % 360
+    return slope, aspect
+
+def illuminate(slope, aspect, azimuth, zenith):
+    """
+    Calculate the illumination of each pixel for a given sun position
+
+    Angles are handed to the trigonometric functions in degrees, exactly as
+    terrain.illuminate does, so the two implementations agree.
+
+    Parameters:
+        slope (np.ndarray): terrain slope (degrees)
+        aspect (np.ndarray): terrain aspect (degrees)
+        azimuth (float): solar azimuth angle
+        zenith (float): solar zenith angle
+
+    Returns:
+        np.ndarray: illumination
+    """
+    return (np.cos(slope) * np.cos(zenith) +
+            np.sin(slope) * np.sin(zenith) * np.cos(azimuth - aspect))
+
+class Regression(object):
+    """
+    Per pixel regression of bands on illumination, accumulated scene by scene
+
+    Only the sums n, sum(x), sum(x^2), sum(y) and sum(xy) are kept, so memory
+    is proportional to pixels x bands however many scenes are added. As with
+    ee.Reducer.linearRegression, a scene contributes to a pixel only where
+    its illumination and every band are unmasked.
+
+    Parameters:
+        bands (list<str>): bands to regress
+    """
+
+    def __init__(self, bands):
+        self.bands = list(bands)
+        self.n = None
+
+    def add(self, scene, illum):
+        """
+        Add the pixels of one scene to the sums
+
+        Parameters:
+            scene (dict): image with the regressed bands
+            illum (np.ndarray): illumination of the scene
+        """
+        y = np.stack([scene[band] for band in self.bands]).astype(float)
+        valid = np.isfinite(y).all(axis=0) & np.isfinite(illum)
+        x = np.where(valid, illum, 0.0)
+        y[:, ~valid] = 0
+        if self.n is None:
+            self.n = np.zeros(x.shape)
+            self.sx = np.zeros(x.shape)
+            self.sxx = np.zeros(x.shape)
+            self.sy = np.zeros(y.shape)
+            self.sxy = np.zeros(y.shape)
+        self.n += valid
+        self.sx += x
+        self.sxx += x * x
+        self.sy += y
+        y *= x
+        self.sxy += y
+
+    def merge(self, other):
+        """
+        Add the sums of another regression over the same bands and pixels
+        """
+        if other.n is None:
+            return
+        if self.n is None:
+            self.n, self.sx, self.sxx = other.n.copy(), other.sx.copy(), other.sxx.copy()
+            self.sy, self.sxy = other.sy.copy(), other.sxy.copy()
+            return
+        self.n += other.n
+        self.sx += other.sx
+        self.sxx += other.sxx
+        self.sy += other.sy
+        self.sxy += other.sxy
+
+    def coefficients(self):
+        """
+        Solve the regressions in closed form
+
+        Returns:
+            np.ndarray: (bands, rows, cols) array of c = intercept / slope,
+            NaN where fewer than two scenes contribute to a pixel
+        """
+        # with slope = (n sxy - sx sy) / (n sxx - sx^2) and
+        # intercept = (sy - slope sx) / n, intercept / slope reduces to
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c = ((self.sy * self.sxx - self.sx * self.sxy) /
+                 (self.n * self.sxy - self.sx * self.sy))
+        # a single scene fits exactly, but rounding can leave the terms
+        # above slightly off zero
+        c[:, self.n < 2] = np.nan
+        return c
+
+def coefficients(illums, scenes, bands):
+    """
+    Regress each band on illumination across scenes at every pixel
+
+    Parameters:
+        illums (iterable<np.ndarray>): illumination of each scene
+        scenes (iterable<dict>): images to be corrected
+        bands (list<str>): bands to correct
+
+    Returns:
+        np.ndarray: (bands, rows, cols) array of c = intercept / slope
+    """
+    regression = Regression(bands)
+    for illum, scene in zip(illums, scenes):
+        regression.add(scene, illum)
+    return regression.coefficients()
+
+def factor(illum, zenith, c):
+    """
+    C-correction factor (cos(zenith) + c) / (illum + c) of each band
+
+    The correction is undefined where illum + c is zero or NaN, e.g. where
+    too few scenes cover a pixel to fit c. Those pixels are masked (NaN),
+    as Earth Engine masks the result of a division by zero.
+
+    Returns:
+        np.ndarray: (bands, rows, cols) array of factors
+    """
+    den = illum + c
+    defined = np.isfinite(den) & (den != 0)
+    num = np.full(den.shape, np.nan)
+    np.divide(np.cos(zenith) + c, den, out=num, where=defined)
+    return num
+
+def correct(scene, illum, zenith, c, bands):
+    """
+    Apply the C-correction to a single scene, see factor()
+
+    Returns:
+        dict: scene with an 'illumination' band and corrected bands
+    """
+    out = {band: arr for band, arr in scene.items() if band not in bands}
+    out['illumination'] = illum
+    num = factor(illum, zenith, c)
+    for i, band in enumerate(bands):
+        out[band] = scene[band] * num[i]
+    return out
+
+def c_correct(scenes, angles, bands, slope, aspect, cache=None, key=None):
+    """
+    Calculate and correct hillshade for each scene in a collection
+
+    Scenes are read twice, once to accumulate the regression and once to
+    correct them, and illumination is recomputed on the second pass rather
+    than held for every scene. Corrected scenes are yielded one at a time,
+    so memory is proportional to pixels x bands however many scenes there
+    are, provided scenes reads them lazily.
+
+    Parameters:
+        scenes (iterable<dict>): images to be corrected, any iterable that
+        can be iterated again, e.g. a list or an object whose __iter__
+        reads the scenes from disk, but not a generator
+        angles (iterable<tuple>): (azimuth, zenith) solar angles of each
+        scene, re-iterable as scenes
+        bands (list<str>): bands to correct
+        slope (np.ndarray): terrain slope (degrees), see slope_aspect()
+        aspect (np.ndarray): terrain aspect (degrees)
+        cache (coeffcache.CoefficientCache): optional coefficient cache
+        key (str): cache key from coeffcache.cache_key(), required with cache
+
+    Returns:
+        generator<dict>: corrected scenes, in the order of scenes
+    """
+    if cache is not None and key is None:
+        raise ValueError('a cache key is required with cache')
+    for name, source in [('scenes', scenes), ('angles', angles)]:
+        # an iterator would be exhausted by the regression pass
+        if iter(source) is source:
+            raise TypeError('{} must be re-iterable, not an iterator'.format(name))
+
+    def illums():
+        for az, zen in angles:
+            yield illuminate(slope, aspect, az, zen)
+
+    hit = cache.get(key) if cache is not None else None
+    if hit is not None and list(hit[1]) == list(bands):
+        c = hit[0]
+    else:
+        c = coefficients(illums(), scenes, bands)
+        if cache is not None:
+            cache.put(key, c, bands)
+    return (correct(scene, illum, zen, c, bands)
+            for scene, illum, (az, zen) in zip(scenes, illums(), angles))
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Out-of-core tiled execution of the local IW engine
+
+iw_local needs AOI-wide statistics (mean, stdDev, mode) before it can
+transform any pixel. Here the scene is processed in row windows sized to a
+memory budget: one pass streams the windows to accumulate mergeable
+statistics, the next streams them again to apply the transform. Inputs may
+be np.memmap arrays, and intermediate images are kept in memory-mapped
+.npy files so only one window is ever resident.
+"""
+
+import os
+import shutil
+import tempfile
+import tracemalloc
+import numpy as np
+import iw_local
+import stats_local
+
+# approximate working memory per pixel of a window: the 12 input bands,
+# the derived indices, change bands and float64 temporaries
+BYTES_PER_PIXEL = 600
+
+CHANGE_BANDS = ['cv', 'ndvi', 'ndsi', 'ndwi', 'nbr', 'rcvmax']
+ND_BANDS = ['ndvi', 'ndsi', 'ndwi', 'nbr']
+
+def tile_rows(shape, budget, bytes_per_pixel=BYTES_PER_PIXEL):
+    """
+    Number of image rows per window that fit within a memory budget
+
+    Parameters:
+        shape (tuple): (rows, cols) of the image
+        budget (int): bytes of working memory available
+        bytes_per_pixel (int): working memory per pixel of a window,
+        defaults to that of the IW engine
+
+    Returns:
+        int: rows per window
+    """
+    if shape[0] < 1 or shape[1] < 1:
+        raise ValueError('cannot tile an empty image of shape {}'.format(tuple(shape)))
+    rows = int(budget // (shape[1] * bytes_per_pixel))
+    if rows < 1:
+        raise ValueError('memory budget of {} bytes cannot hold one row of {} pixels'.format(budget, shape[1]))
+    return min(rows, shape[0])
+
+def windows(shape, rows):
+    """
+    Generate row slices covering an image
+    """
+    for start in range(0, shape[0], rows):
+        yield slice(start, min(start + rows, shape[0]))
+
+def read(img, window, mask=None):
+    """
+    Read a window of every band as float64, applying an optional mask
+    """
+    out = {band: np.asarray(arr[window], dtype=float) for band, arr in img.items()}
+    if mask is not None:
+        keep = np.asarray(mask[window], dtype=bool)
+        out = {band: np.where(keep, arr, np.nan) for band, arr in out.items()}
+    return out
+
+def open_store(directory, bands, shape, dtype):
+    """
+    Create memory-mapped .npy files, one per band, in a directory
+    """
+    return {band: np.lib.format.open_memmap(
+                os.path.join(directory, band + '.npy'),
+                mode='w+', dtype=dtype, shape=shape)
+            for band in bands}
+
+class ZPStats(object):
+    """
+    Mergeable accumulator for the statistics used by iw_local.calc_zp
+    """
+
+    def __init__(self):
+        self.moments = stats_local.Moments(len(iw_local.NORM_BANDS))
+        self.modes = [stats_local.ModeHistogram() for band in iw_local.NORM_BANDS]
+
+    def update(self, img):
+        norm = np.stack([img[band] for band in iw_local.NORM_BANDS])
+        self.moments.update(norm)
+        for hist, band in zip(self.modes, norm):
+            hist.update(band)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        for hist, hist2 in zip(self.modes, other.modes):
+            hist.merge(hist2)
+
+    def result(self):
+        """
+        Returns:
+            tuple: (mode, stdDev) arrays in the order of iw_local.NORM_BANDS
+        """
+        return np.array([hist.mode() for hist in self.modes]), self.moments.stdDev()
+
+def runIW(before, after, outdir, mask=None, niter=10, tol=None, budget=2**30,
+          workdir=None, dtype=np.float32):
+    """
+    Run the iteratively weighted change analysis in windows within a memory
+    budget
+
+    Parameters:
+        before (dict): 2D 'before' composite bands, e.g. np.memmap arrays
+        after (dict): 2D 'after' composite bands
+        outdir (str): directory in which output bands are written as .npy
+        mask (np.ndarray): optional boolean array of pixels to retain
+        niter (int): number of reweighting iterations
+        tol (float): optional convergence tolerance, as in iw_local.iw()
+        budget (int): bytes of working memory available for each window
+        workdir (str): directory for intermediate images, defaults to the
+        system temporary directory
+        dtype (np.dtype): storage type of intermediate and output images
+
+    Returns:
+        tuple: dict of memory-mapped z-score bands as in iw_local.iw(), and
+        a report dictionary with 'peak_bytes', 'tiles', 'rows', 'passes' and
+        'iterations'
+    """
+    # peak_bytes is the peak traced allocation since tracing started
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+
+    shape = next(iter(before.values())).shape
+    rows = tile_rows(shape, budget)
+    tiles = list(windows(shape, rows))
+    tmp = tempfile.mkdtemp(dir=workdir)
+
+    def pair(window):
+        old = iw_local.ND(read(before, window, mask), 'B8', 'B4', 'B3', 'B11', 'B12')
+        now = iw_local.ND(read(after, window, mask), 'B8', 'B4', 'B3', 'B11', 'B12')
+        return old, now
+
+    try:
+        # pass 1: moments of the band differences used by CV and rcvmax
+        moments = stats_local.Moments(len(iw_local.RGBN))
+        for window in tiles:
+            old, now = pair(window)
+            moments.update(iw_local.d(old, now, iw_local.RGBN))
+        diff_stats = (moments.mean, moments.stdDev())
+
+        # pass 2: write the change image and accumulate its statistics
+        change = open_store(tmp, CHANGE_BANDS, shape, dtype)
+        zp = ZPStats()
+        for window in tiles:
+            old, now = pair(window)
+            img = {'cv': iw_local.CV(old, now, iw_local.RGBN, diff_stats)}
+            img.update(zip(ND_BANDS, iw_local.d(old, now, ND_BANDS)))
+            img['rcvmax'] = iw_local.rcvmax(old, now, iw_local.RGBN, diff_stats)
+            for band in CHANGE_BANDS:
+                change[band][window] = img[band]
+            zp.update(img)
+
+        # reweighting passes: apply calc_zp to the source image with its
+        # statistics, write the reweighted image to the other buffer and
+        # accumulate its statistics. Alternating buffers keep the source
+        # intact when the convergence check stops the loop
+        buffers = []
+        for name in ['dp0', 'dp1'][:min(niter, 2)]:
+            os.mkdir(os.path.join(tmp, name))
+            buffers.append(open_store(os.path.join(tmp, name), CHANGE_BANDS, shape, dtype))
+        source = change
+        stats = zp.result()
+        summary = None
+        iterations = 0
+        passes = 2
+        while iterations < niter:
+            target = buffers[iterations % 2]
+            zp = ZPStats()
+            # mean normal p-values of the source image, for the convergence
+            # check as in iw_local.p_summary
+            p_moments = stats_local.Moments(len(iw_local.NORM_BANDS))
+            for window in tiles:
+                zs = iw_local.calc_zp(read(source, window), stats)
+                p_moments.update(np.stack([zs[band + '_p'] for band in iw_local.NORM_BANDS]))
+                base = read(change, window)
+                dp = {band: np.maximum(zs[band + '_p'], 0.001) * base[band]
+                      for band in CHANGE_BANDS}
+                for band in CHANGE_BANDS:
+                    target[band][window] = dp[band]
+                zp.update(dp)
+            passes += 1
+            last, summary = summary, p_moments.mean
+            if tol is not None and last is not None and np.max(np.abs(summary - last)) < tol:
+                break
+            source = target
+            stats = zp.result()
+            iterations += 1
+        if tol is not None:
+            print('iw iterations:', iterations)
+
+        # final pass: write the z-scores and p-values
+        out = None
+        for window in tiles:
+            zs = iw_local.calc_zp(read(source, window), stats)
+            if out is None:
+                out = open_store(outdir, list(zs), shape, dtype)
+            for band in zs:
+                out[band][window] = zs[band]
+        for arr in out.values():
+            arr.flush()
+
+        report = {'peak_bytes': tracemalloc.get_traced_memory()[1],
+                  'tiles': len(tiles),
+                  'rows': rows,
+                  'passes': passes + 1,
+                  'iterations': iterations}
+    finally:
+        change = source = target = buffers = None
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not tracing:
+            tracemalloc.stop()
+    return out, report
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Local tiled vectorization of change masks, the counterpart of the
+reduceToVectors call in analyze.analyze_iw
+
+The mask is labeled in row windows sized to a memory budget. Each window
+is labeled 8-connected on its own, the labels are written to a
+memory-mapped file, and components that meet across a window seam are
+joined with a union-find over the label ids. Pixel counts are summed per
+component before any tracing, so components below the minimum size are
+never traced. The remaining components are traced to polygons along pixel
+edges, at the full resolution of the mask, and yielded one at a time.
+
+    for feature in vectors_local.vectorize(selected, min_pixels=40,
+                                           transform=(x0, 10, y0, -10)):
+        sink.write(feature)
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from scipy import ndimage
+import tiles
+
+# working memory per pixel of a window: the mask, labels and temporaries
+BYTES_PER_PIXEL = 24
+
+EIGHT = np.ones((3, 3), dtype=bool)
+
+def foreground(arr):
+    """
+    Pixels to vectorize: nonzero and not masked (NaN)
+    """
+    arr = np.asarray(arr)
+    if arr.dtype == bool:
+        return arr
+    return np.nan_to_num(arr, nan=0) != 0
+
+def _find(parent, x):
+    """
+    Root of x, compressing the path to it
+    """
+    root = x
+    while parent[root] != root:
+        root = parent[root]
+    while parent[x] != root:
+        parent[x], x = root, parent[x]
+    return root
+
+def _union(parent, a, b):
+    a, b = _find(parent, a), _find(parent, b)
+    if a != b:
+        parent[max(a, b)] = min(a, b)
+
+class Labels(object):
+    """
+    Connected components of a mask, labeled in row windows
+
+    Attributes:
+        labels (np.memmap): window label of every pixel, 0 for background
+        roots (np.ndarray): component of each window label, roots[0] = 0
+        counts (np.ndarray): pixel count of each component, by root
+        boxes (np.ndarray): (rmin, rmax, cmin, cmax) of each component, by
+        root, with rmax and cmax exclusive
+        tiles (int): number of windows
+    """
+
+    def __init__(self, mask, budget=2**28, workdir=None):
+        shape = mask.shape
+        rows = tiles.tile_rows(shape, budget, BYTES_PER_PIXEL)
+        self.tmp = tempfile.mkdtemp(dir=workdir)
+        dtype = np.int32 if shape[0] * shape[1] < 2**31 else np.int64
+        self.labels = np.lib.format.open_memmap(
+                os.path.join(self.tmp, 'labels.npy'), mode='w+', dtype=dtype, shape=shape)
+        counts = [np.zeros(1, dtype=np.int64)]
+        boxes = [np.zeros((1, 4), dtype=np.int64)]
+        seams = []
+        offset = 0
+        previous = None
+        self.tiles = 0
+        for window in tiles.windows(shape, rows):
+            fg = foreground(mask[window])
+            local, n = ndimage.label(fg, structure=EIGHT)
+            lab = np.where(fg, local.astype(dtype) + offset, 0).astype(dtype)
+            self.labels[window] = lab
+            counts.append(np.bincount(local.ravel(), minlength=n + 1)[1:])
+            box = np.zeros((n, 4), dtype=np.int64)
+            for i, index in enumerate(ndimage.find_objects(local)):
+                box[i] = (index[0].start + window.start, index[0].stop + window.start,
+                          index[1].start, index[1].stop)
+            boxes.append(box)
+            # 8-connected neighbours across the seam with the previous window
+            if previous is not None:
+                for a, b in [(previous, lab[0]), (previous[1:], lab[0][:-1]),
+                             (previous[:-1], lab[0][1:])]:
+                    touch = (a > 0) & (b > 0)
+                    if touch.any():
+                        seams.append(np.stack([a[touch], b[touch]], axis=1))
+            previous = lab[-1].copy()
+            offset += n
+            self.tiles += 1
+        self.labels.flush()
+
+        parent = list(range(offset + 1))
+        if seams:
+            for a, b in np.unique(np.concatenate(seams), axis=0):
+                _union(parent, int(a), int(b))
+        roots = np.array(parent, dtype=np.int64)
+        # point every label straight at its root
+        while True:
+            jumped = roots[roots]
+            if np.array_equal(jumped, roots):
+                break
+            roots = jumped
+        self.roots = roots
+
+        counts = np.concatenate(counts)
+        boxes = np.concatenate(boxes)
+        self.counts = np.bincount(roots, weights=counts, minlength=offset + 1).astype(np.int64)
+        self.boxes = np.zeros((offset + 1, 4), dtype=np.int64)
+        self.boxes[:, [0, 2]] = np.iinfo(np.int64).max
+        np.minimum.at(self.boxes[:, 0], roots, boxes[:, 0])
+        np.maximum.at(self.boxes[:, 1], roots, boxes[:, 1])
+        np.minimum.at(self.boxes[:, 2], roots, boxes[:, 2])
+        np.maximum.at(self.boxes[:, 3], roots, boxes[:, 3])
+
+    def components(self, min_pixels=1):
+        """
+        Components of at least min_pixels pixels, in order of first row
+
+        Returns:
+            np.ndarray: root label of each component
+        """
+        ids = np.flatnonzero((self.roots == np.arange(self.roots.size)) &
+                             (self.counts >= min_pixels))
+        ids = ids[ids > 0]
+        return ids[np.argsort(self.boxes[ids, 0], kind='stable')]
+
+    def mask(self, root):
+        """
+        Boolean mask of one component within its bounding box
+
+        Returns:
+            tuple: (mask, (row, col) of the upper left corner of the box)
+        """
+        rmin, rmax, cmin, cmax = self.boxes[root].tolist()
+        return self.roots[self.labels[rmin:rmax, cmin:cmax]] == root, (rmin, cmin)
+
+    def close(self):
+        """
+        Remove the memory-mapped labels
+        """
+        self.labels = None
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+def trace(mask):
+    """
+    Trace the outline of an 8-connected set of pixels along pixel edges
+
+    Boundary edges are directed so the pixels lie on one side. Where two
+    pixels touch only at a corner the outline passes from one to the other,
+    so 8-connected pixels give a single outer ring, and holes are the
+    4-connected background enclosed by it.
+
+    Parameters:
+        mask (np.ndarray): 2D boolean array holding one component
+
+    Returns:
+        list: rings of (col, row) pixel corner coordinates, each closed,
+        with collinear vertices removed. The outer ring comes first
+    """
+    m = np.pad(mask, 1)
+    inner = m[1:-1, 1:-1]
+    starts = []
+    ends = []
+    # top, left, bottom and right pixel sides facing the background
+    for outside, start, end in [(m[:-2, 1:-1], (1, 0), (0, 0)),
+                                (m[1:-1, :-2], (0, 0), (0, 1)),
+                                (m[2:, 1:-1], (0, 1), (1, 1)),
+                                (m[1:-1, 2:], (1, 1), (1, 0))]:
+        r, c = np.nonzero(inner & ~outside)
+        starts.append(np.stack([c + start[0], r + start[1]], axis=1))
+        ends.append(np.stack([c + end[0], r + end[1]], axis=1))
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    directions = ends - starts
+
+    outgoing = {}
+    for i, (x, y) in enumerate(starts.tolist()):
+        outgoing.setdefault((x, y), []).append(i)
+
+    # successor of each edge; at a corner shared by two diagonal pixels,
+    # take the turn that crosses to the other pixel
+    successor = np.empty(len(starts), dtype=np.int64)
+    for i, (x, y) in enumerate(ends.tolist()):
+        options = outgoing[(x, y)]
+        if len(options) == 1:
+            successor[i] = options[0]
+        else:
+            dx, dy = directions[i]
+            successor[i] = next(o for o in options
+                                if dx * directions[o][1] - dy * directions[o][0] > 0)
+
+    rings = []
+    used = np.zeros(len(starts), dtype=bool)
+    for first in range(len(starts)):
+        if used[first]:
+            continue
+        ring = []
+        edge = first
+        while not used[edge]:
+            used[edge] = True
+            following = successor[edge]
+            # keep only the vertices where the outline turns
+            if (directions[edge] != directions[following]).any():
+                ring.append(tuple(ends[edge].tolist()))
+            edge = following
+        ring.append(ring[0])
+        rings.append(ring)
+    rings.sort(key=lambda ring: -abs(signed_area(ring)))
+    return rings
+
+def signed_area(ring):
+    """
+    Shoelace area of a closed ring, positive when counterclockwise in a y-up
+    frame
+    """
+    xy = np.asarray(ring, dtype=float)
+    return 0.5 * float(np.sum(xy[:-1, 0] * xy[1:, 1] - xy[1:, 0] * xy[:-1, 1]))
+
+def polygon(rings, corner, transform=None):
+    """
+    GeoJSON polygon coordinates of traced rings
+
+    Parameters:
+        rings (list): output of trace()
+        corner (tuple): (row, col) of the traced mask within the image
+        transform (tuple): (x0, dx, y0, dy) mapping pixel corner (row, col)
+        to (x0 + col * dx, y0 + row * dy), default pixel coordinates
+
+    Returns:
+        list: rings with the outer ring counterclockwise and holes
+        clockwise, as RFC 7946 requires
+    """
+    x0, dx, y0, dy = transform if transform is not None else (0, 1, 0, 1)
+    out = []
+    for i, ring in enumerate(rings):
+        coords = [[x0 + (corner[1] + x) * dx, y0 + (corner[0] + y) * dy] for x, y in ring]
+        if (signed_area(coords) > 0) != (i == 0):
+            coords.reverse()
+        out.append(coords)
+    return out
+
+def vectorize(mask, min_pixels=1, transform=None, pixel_area=None,
+              budget=2**28, workdir=None, zs=None, properties=None, id_prefix=None):
+    """
+    Vectorize the 8-connected components of a mask, streaming the polygons
+
+    Parameters:
+        mask (np.ndarray): 2D array, e.g. np.memmap, of pixels to vectorize,
+        see foreground()
+        min_pixels (int): smallest component kept, checked before tracing
+        transform (tuple): (x0, dx, y0, dy) pixel to map coordinates, see
+        polygon()
+        pixel_area (float): area of a pixel, e.g. in square meters. If given
+        each feature has an 'area' property
+        budget (int): bytes of working memory available for each window
+        workdir (str): directory for the memory-mapped labels, defaults to
+        the system temporary directory
+        zs (dict): optional bands, e.g. the IW z-scores, whose mean within
+        each polygon is added as a property of the band name
+        properties (dict): optional properties added to every feature, e.g.
+        'landcover'
+        id_prefix (str): if given, features get an 'id' property of the
+        prefix, '_' and their number, counting from 1
+
+    Returns:
+        generator: GeoJSON Feature dictionaries with properties 'label'
+        and 'count' (pixels), in order of the first row of each polygon
+    """
+    labels = Labels(mask, budget, workdir)
+    try:
+        for number, root in enumerate(labels.components(min_pixels), 1):
+            component, corner = labels.mask(root)
+            props = dict(properties or {})
+            if id_prefix is not None:
+                props['id'] = '{}_{}'.format(id_prefix, number)
+            props.update(label=int(root), count=int(labels.counts[root]))
+            if pixel_area is not None:
+                props['area'] = props['count'] * pixel_area
+            box = (slice(corner[0], corner[0] + component.shape[0]),
+                   slice(corner[1], corner[1] + component.shape[1]))
+            for band, arr in (zs or {}).items():
+                values = np.asarray(arr[box], dtype=float)[component]
+                values = values[np.isfinite(values)]
+                props[band] = float(values.mean()) if values.size else None
+            yield {'type': 'Feature',
+                   'geometry': {'type': 'Polygon',
+                                'coordinates': polygon(trace(component), corner, transform)},
+                   'properties': props}
+    finally:
+        labels.close()
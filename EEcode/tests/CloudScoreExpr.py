@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the compiled cloud and water score expressions in clouds.py with
+the step by step sentinelCloudScore and waterScore on a year of Sentinel-2
+TOA imagery.
+
+For every image of a 12 month collection the number of pixels where the
+scores differ is counted, and the serialized graph size of the collection
+mapped with each version is printed.
+"""
+
+import ee
+import clouds
+
+ee.Initialize()
+
+aoi = ee.Geometry.Rectangle([-83.20, 37.38, -83.17, 37.40])
+S2 = ee.ImageCollection("COPERNICUS/S2")\
+.filterBounds(aoi)\
+.filterDate('2018-01-01', '2019-01-01')
+
+def cloud_old(img):
+    return clouds.sentinelCloudScore(img).select(['cloudScore'])
+
+def cloud_new(img):
+    return clouds.sentinelCloudScoreExpr(img).select(['cloudScore'])
+
+def water_old(img):
+    return clouds.waterScore(img)
+
+def water_new(img):
+    return clouds.waterScoreExpr(img)
+
+def mismatches(old, new, band):
+    """
+    Count the pixels of each image where old and new scores differ
+
+    Parameters:
+        old (function): step by step score of an image
+        new (function): compiled score of an image
+        band (str): name of the score band
+
+    Returns:
+        ee.List: per image pixel counts, including pixels masked in only one
+    """
+    def count(img):
+        a = old(img)
+        b = new(img)
+        differ = a.neq(b).unmask(1).Or(a.mask().neq(b.mask()))
+        return ee.Feature(None, differ.reduceRegion(
+                reducer = ee.Reducer.sum(),
+                geometry = aoi,
+                scale = 10,
+                maxPixels = 1e13))
+    return S2.map(count).aggregate_array(band)
+
+print('images:', S2.size().getInfo())
+print('cloudScore mismatches:', mismatches(cloud_old, cloud_new, 'cloudScore').getInfo())
+print('waterScore mismatches:', mismatches(water_old, water_new, 'waterScore').getInfo())
+
+for name, old, new in [('cloudScore', cloud_old, cloud_new),
+                       ('waterScore', water_old, water_new)]:
+    before = len(ee.serializer.toJSON(S2.map(old)))
+    after = len(ee.serializer.toJSON(S2.map(new)))
+    print('{} graph bytes: {} -> {}'.format(name, before, after))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Check that overlapping AOIs and repeat runs read tile composites from a
+compositecache.CompositeCache instead of recomputing them.
+
+A stack of synthetic Sentinel-2 SR scenes with random cloud classes is
+composited over three overlapping AOI windows, twice. For each run the
+script prints the seconds, tiles loaded and cache hits / misses, checks
+that every mosaic equals the median of the masked stack computed in
+memory, shrinks the quota to show LRU eviction, and checks that an entry
+larger than the quota is refused. A stack of raw uint16 TOA digital
+numbers is also composited twice through a cache and compared with the
+median of the reference maskTOA of each scene, on the miss and the hit.
+
+Run from EEcode/Python, or with it on PYTHONPATH.
+"""
+
+import tempfile
+import time
+import warnings
+import numpy as np
+import clouds_local
+import compositecache
+
+SIZE = 1200
+SCENES = 8
+BANDS = ['B2', 'B3', 'B4', 'B8', 'B11', 'B12']
+
+rng = np.random.default_rng(3)
+stack = {band: rng.uniform(500, 3000, (SCENES, SIZE, SIZE)).astype(np.float32)
+         for band in BANDS}
+stack['QA60'] = np.zeros((SCENES, SIZE, SIZE), dtype=np.float32)
+# vegetation everywhere, with cloud (9) and shadow (3) blobs
+stack['SCL'] = np.full((SCENES, SIZE, SIZE), 4, dtype=np.float32)
+for scene in range(SCENES):
+    for value in [3, 9]:
+        r, c = rng.integers(0, SIZE - 200, 2)
+        stack['SCL'][scene, r:r + 200, c:c + 200] = value
+
+loads = []
+
+def load(rows, cols):
+    loads.append((rows, cols))
+    return {band: arr[:, rows, cols] for band, arr in stack.items()}
+
+# reference: the masked median of the whole stack in memory
+keep = clouds_local.mask_stack(stack, 'SR')
+reference = compositecache.masked_median(stack, keep, BANDS)
+
+# raw uint16 digital numbers of a TOA stack, with every band pair in both
+# orders, composited through the cache and against the reference maskTOA
+# of each scene, so a wrapped mask cannot be cached unnoticed
+TOA_SIZE = 300
+dn = {band: rng.integers(0, 6000, (SCENES, TOA_SIZE, TOA_SIZE)).astype(np.uint16)
+      for band in clouds_local.TOA_BANDS}
+dn['QA60'][:] = 0
+masked = [clouds_local.maskTOA({band: arr[i] for band, arr in dn.items()}) for i in range(SCENES)]
+expected = np.stack([np.stack([scene[band] for scene in masked]) for band in BANDS])
+with warnings.catch_warnings():
+    # pixels masked in every scene stay NaN
+    warnings.simplefilter('ignore', RuntimeWarning)
+    expected = np.nanmedian(expected, axis=1).astype(np.float32)
+toa_cache = compositecache.CompositeCache(tempfile.mkdtemp())
+window = (slice(0, TOA_SIZE), slice(0, TOA_SIZE))
+for run in range(2):
+    median, count = compositecache.mosaic(
+            toa_cache, window, '2019-06-01', '2020-06-01', 'TOA', BANDS,
+            lambda rows, cols: {band: arr[:, rows, cols] for band, arr in dn.items()})
+    assert np.array_equal(median, expected, equal_nan=True)
+print('uint16 TOA mosaic equals the uncached masked median, {} hits {} misses'.format(
+        toa_cache.hits, toa_cache.misses))
+assert toa_cache.hits == 1
+
+aois = [(slice(100, 700), slice(100, 700)),
+        (slice(400, 1000), slice(300, 900)),
+        (slice(600, 1200), slice(0, 1200))]
+
+cache = compositecache.CompositeCache(tempfile.mkdtemp())
+for run in range(2):
+    for i, window in enumerate(aois):
+        del loads[:]
+        hits, misses = cache.hits, cache.misses
+        start = time.perf_counter()
+        median, count = compositecache.mosaic(cache, window, '2019-06-01', '2020-06-01',
+                                              'SR', BANDS, load)
+        seconds = time.perf_counter() - start
+        expected = reference[(slice(None),) + window]
+        assert np.array_equal(median, expected[:-1], equal_nan=True)
+        assert np.array_equal(count, expected[-1])
+        print('run {} aoi {}: {:.3f} s, {} tiles loaded, {} hits, {} misses'.format(
+                run, i, seconds, len(loads), cache.hits - hits, cache.misses - misses))
+
+total = sum(entry['bytes'] for entry in cache.index.values())
+print('cached tiles:', len(cache.index), 'bytes:', total)
+cache.max_bytes = total // 2
+cache.evict()
+print('after halving the quota:', len(cache.index), 'tiles')
+
+# an entry larger than the whole quota is refused rather than stored and
+# evicted at once
+small = compositecache.CompositeCache(tempfile.mkdtemp(), max_bytes=reference[:, :10, :10].nbytes)
+try:
+    small.put('tile', reference, BANDS + ['count'])
+except ValueError as error:
+    print('oversized entry:', error)
+else:
+    raise AssertionError('an entry over the quota was accepted')
@@ -22,7 +22,7 @@ aoi = ee.Geometry.Polygon(
 
 projdate = ee.Date('2017-08-20')
 
-dictionary = dictionaries.scrub
+dictionary = ee.Dictionary(dictionaries.scrub)
 cvz = ee.Number(dictionary.get('cvz'))
 rcvz = ee.Number(dictionary.get('rcvz'))
 ndviz = ee.Number(dictionary.get('ndviz'))
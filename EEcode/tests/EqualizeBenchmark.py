@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the random forest and lookup table histogram matching in
+calibration.equalize on two adjacent Sentinel-2 orbits.
+
+For each method the wall time of evaluating the equalized image over the
+overlap is printed, along with the matching error: the mean absolute
+difference between the 5th..95th percentiles of each equalized band and
+of the reference band, relative to the reference interquartile range.
+"""
+
+import time
+import ee
+import calibration
+
+ee.Initialize()
+
+aoi = ee.Geometry.Rectangle([-84.0, 37.0, -83.0, 37.6])
+bands = ['B2', 'B3', 'B4', 'B8', 'B11', 'B12']
+PERCENTILES = list(range(5, 100, 5))
+
+S2 = ee.ImageCollection("COPERNICUS/S2_SR")\
+.filterBounds(aoi)\
+.filterDate('2019-06-01', '2019-09-01')
+orbits = S2.aggregate_array('SENSING_ORBIT_NUMBER').distinct().sort().getInfo()[:2]
+col1 = S2.filter(ee.Filter.eq('SENSING_ORBIT_NUMBER', orbits[0]))
+col2 = S2.filter(ee.Filter.eq('SENSING_ORBIT_NUMBER', orbits[1]))
+overlap = calibration.get_overlap(col1, col2).intersection(aoi, 5)
+image1 = col1.median().select(bands)
+image2 = col2.median().select(bands)
+
+def percentiles(img):
+    return img.reduceRegion(
+        reducer = ee.Reducer.percentile(PERCENTILES),
+        geometry = overlap,
+        scale = 100,
+        maxPixels = 1e13,
+        tileScale = 12)
+
+reference = percentiles(image1).getInfo()
+
+def error(values):
+    out = {}
+    for band in bands:
+        iqr = reference['{}_p75'.format(band)] - reference['{}_p25'.format(band)]
+        diffs = [abs(values['{}_p{}'.format(band, p)] - reference['{}_p{}'.format(band, p)])
+                 for p in PERCENTILES]
+        out[band] = sum(diffs) / len(diffs) / iqr
+    return out
+
+print('orbits:', orbits)
+print('unmatched error:', error(percentiles(image2).getInfo()))
+for method in ['forest', 'lut']:
+    start = time.time()
+    values = percentiles(calibration.equalize(image1, image2, overlap, method)).getInfo()
+    seconds = time.time() - start
+    print('{}: {:.1f} s, error {}'.format(method, seconds, error(values)))
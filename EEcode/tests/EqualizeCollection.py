@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Time calibration.equalize_collection on mosaics of increasing numbers of
+Sentinel-2 orbits.
+
+Scene records and pairwise overlaps are computed once, so the time per
+orbit printed for each mosaic should stay roughly constant.
+"""
+
+import time
+import ee
+import calibration
+
+ee.Initialize()
+
+aoi = ee.Geometry.Rectangle([-90.0, 36.5, -80.0, 37.0])
+bands = ['B2', 'B3', 'B4', 'B8', 'B11', 'B12']
+
+S2 = ee.ImageCollection("COPERNICUS/S2_SR")\
+.filterBounds(aoi)\
+.filterDate('2019-07-01', '2019-08-01')
+orbits = S2.aggregate_array('SENSING_ORBIT_NUMBER').distinct().sort().getInfo()
+print('orbits:', orbits)
+
+for n in range(2, min(len(orbits), 10) + 1, 2):
+    col = S2.filter(ee.Filter.inList('SENSING_ORBIT_NUMBER', orbits[:n]))
+    equalized = calibration.equalize_collection(col, bands, 'SENSING_ORBIT_NUMBER', 'lut')
+    start = time.time()
+    means = equalized.map(lambda img: ee.Feature(None, img.reduceRegion(
+        reducer = ee.Reducer.mean(),
+        geometry = aoi,
+        scale = 1000,
+        maxPixels = 1e13,
+        tileScale = 12))).getInfo()
+    seconds = time.time() - start
+    print('{} orbits: {:.1f} s, {:.1f} s per orbit'.format(n, seconds, seconds / n))
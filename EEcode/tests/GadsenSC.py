@@ -27,7 +27,7 @@ aoi = ee.FeatureCollection(
             })])
 
 projdate = ee.Date('2017-08-20')
-dictionary = dictionaries.wetland
+dictionary = ee.Dictionary(dictionaries.wetland)
 cvz = ee.Number(dictionary.get('cvz'))
 rcvz = ee.Number(dictionary.get('rcvz'))
 ndviz = ee.Number(dictionary.get('ndviz'))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the local NumPy IW engine (iw_local) against the Earth Engine
+formulas in iw.py on a small window of real imagery.
+
+Both engines are fed the same change image, sampled at 10m with
+sampleRectangle, and the maximum absolute difference per output band is
+printed. Differences in the '_z' bands reflect the histogram mode estimate.
+"""
+
+import numpy as np
+import ee
+import iw
+import iw_local
+
+ee.Initialize()
+
+# small window so sampleRectangle stays under the 262144 pixel limit
+aoi = ee.Geometry.Rectangle([-83.20, 37.38, -83.17, 37.40])
+
+S2 = ee.ImageCollection("COPERNICUS/S2_SR").filterBounds(aoi)
+rgbn = iw_local.RGBN
+past = S2.filterDate('2018-06-01', '2018-09-01').median().select(rgbn)
+recent = S2.filterDate('2019-06-01', '2019-09-01').median().select(rgbn)
+
+def sample(img):
+    props = img.sampleRectangle(region = aoi, defaultValue = 0).getInfo()['properties']
+    return {band: np.array(props[band], dtype=float) for band in props}
+
+old = iw.ND(past, 'B8', 'B4', 'B3', 'B11', 'B12')
+now = iw.ND(recent, 'B8', 'B4', 'B3', 'B11', 'B12')
+change = iw.CV(old, now, rgbn, aoi, 10, 2)\
+.addBands(iw.d(old, now, ['ndvi', 'ndsi', 'ndwi', 'nbr']))\
+.addBands(iw.rcvmax(old, now, rgbn, aoi, 10, 2))
+
+ee_zp = sample(iw.calc_zp(change, aoi, 10, 2))
+local_zp = iw_local.calc_zp(sample(change))
+
+for band in local_zp:
+    print(band, np.nanmax(np.abs(local_zp[band] - ee_zp[band])))
+
+# the change metrics themselves should agree to floating point precision
+ee_old = sample(past)
+ee_now = sample(recent)
+local_cv = iw_local.CV(iw_local.ND(ee_old, 'B8', 'B4', 'B3', 'B11', 'B12'),
+                       iw_local.ND(ee_now, 'B8', 'B4', 'B3', 'B11', 'B12'),
+                       rgbn)
+print('cv', np.nanmax(np.abs(local_cv - sample(change.select(['cv']))['cv'])))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Check that importing the pipeline modules makes no network calls and does
+not initialize Earth Engine, and print how long the imports take.
+
+Socket connections and ee.Initialize are intercepted while the modules are
+imported; any call fails the check. Runs against the installed ee package,
+or against the eelocal stand-in when ee is not installed. With the ee package
+the modules must not load numpy or scipy either.
+
+Run from EEcode/Python, or with it on PYTHONPATH.
+"""
+
+import socket
+import sys
+import time
+
+MODULES = ['analyze', 'batch', 'calibration', 'clouds', 'dictionaries',
+           'helpers', 'iw', 'MAD_mc', 'stats', 'terrain']
+
+connections = []
+initializations = []
+
+def connect(self, address):
+    connections.append(address)
+    raise OSError('network access during import')
+
+socket.socket.connect = connect
+
+try:
+    import ee
+except ImportError:
+    import eelocal
+    ee = eelocal.install()
+
+def Initialize(*args, **kwargs):
+    initializations.append(args)
+
+ee.Initialize = Initialize
+
+for name in MODULES:
+    start = time.perf_counter()
+    __import__(name)
+    print('{:<16}{:>10.3f} s'.format(name, time.perf_counter() - start))
+
+# the Earth Engine modules need neither; eelocal itself loads both
+heavy = [name for name in ['numpy', 'scipy'] if name in sys.modules]
+print('numerical modules loaded:', heavy)
+assert 'eelocal' in sys.modules or not heavy, heavy
+
+print('connections:', len(connections))
+print('ee.Initialize calls:', len(initializations))
+assert not connections, connections
+assert not initializations, initializations
+
+import session
+session.initialize()
+session.initialize()
+print('ee.Initialize calls after two session.initialize():', len(initializations))
+assert len(initializations) <= 1
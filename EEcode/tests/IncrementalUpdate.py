@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Compare a nightly incremental_local.State update with rebuilding the state
+from every scene.
+
+Synthetic RGBN scenes over a hillside are ingested for the 18 months
+around DOI and the state is run once. Each scene is shaded by its
+illumination as the C-correction model assumes, with a known c, under sun
+angles spread widely enough that the per pixel regressions are well
+conditioned. Two new scenes are then added and the state is run again, and
+the same scenes are run through a new state, with and without recompositing
+every period. The script prints the seconds, scenes read back from disk,
+periods composited or patched and reweighting iterations of each run, and
+how far the composites and z-scores are from the rebuild. It checks that
+the update only recomposites the period of the new scenes, that every pixel
+of the other composites is within the state tolerance of the rebuild, that
+every z-score outside the planted clearings and 99% of them overall are
+within Z_TOLERANCE, that the coefficients recover C, and that recompositing
+every period reproduces the rebuild exactly.
+
+Run from EEcode/Python, or with it on PYTHONPATH.
+"""
+
+import tempfile
+import time
+import numpy as np
+import benchmark
+import incremental_local
+import terrain_local
+
+SIZE = 300
+DOI = '2020-06-01'
+CHANGE = '2020-06-15'
+# C-correction coefficient the scenes are shaded with
+C = 2.0
+# solar zenith angle of every scene
+ZENITH = 35.0
+# largest difference between the z-scores of the update and the rebuild
+# outside the planted clearings, and at their 99th percentile
+Z_TOLERANCE = 1.0
+
+before, after, planted = benchmark.synthetic_scene(SIZE, tempfile.mkdtemp())
+rng = np.random.default_rng(2)
+rows, cols = np.mgrid[0:SIZE, 0:SIZE]
+# the flank of a conical hill peaking beyond the corner of the AOI: every
+# pixel has the same slope, so the illumination of each varies with the sun
+# azimuth (terrain_local.illuminate takes degrees as radians, and a slope
+# near a multiple of 180 would barely vary), and the aspect turns across it
+dem = 300 - 0.21 * np.hypot(rows + SIZE / 2.0, cols + SIZE / 2.0)
+slope, aspect = terrain_local.slope_aspect(dem, 10)
+# the landscape only changes inside the planted clearings; elsewhere the
+# independent sensor noise of the after scene would be a change too
+cleared = np.zeros((SIZE, SIZE), dtype=bool)
+for row, col, side in planted:
+    cleared[row:row + side, col:col + side] = True
+after = {band: np.where(cleared, after[band], before[band]) for band in before}
+
+def scenes(months, per_month):
+    for m in months:
+        year, month = 2019 + (m - 1) // 12, (m - 1) % 12 + 1
+        for k in range(per_month):
+            date = '{}-{:02d}-{:02d}'.format(year, month, 5 + 10 * k)
+            scene = after if date > CHANGE else before
+            # the sun azimuth varies widely and the zenith is held fixed, so
+            # the shading is linear in illumination with intercept / slope C
+            angles = (rng.uniform(100, 200), ZENITH)
+            # the shading the C-correction with coefficient C removes
+            shade = ((terrain_local.illuminate(slope, aspect, *angles) + C) /
+                     (np.cos(ZENITH) + C))
+            bands = {band: 10000 * (np.asarray(arr) * shade + rng.normal(0, 0.001, arr.shape))
+                     for band, arr in scene.items()}
+            # a cloud over a random corner
+            r, c = rng.integers(0, SIZE - 60, 2)
+            for arr in bands.values():
+                arr[r:r + 60, c:c + 60] = np.nan
+            yield 'S2_{}_{}'.format(date, k), date, bands, angles
+
+# 2019-06 to 2020-11, two scenes a month, then two new scenes in 2020-11
+history = list(scenes(range(6, 24), 2))
+new = list(scenes([23], 2))
+new = [('NEW' + scene_id, date.replace('-05', '-25').replace('-15', '-28'), bands, angles)
+       for scene_id, date, bands, angles in new]
+
+def ingest(state, batch):
+    for scene_id, date, bands, (azimuth, zenith) in batch:
+        state.add(scene_id, date, bands, azimuth, zenith)
+
+def timed(name, state, **kwargs):
+    state.reads = state.composited = state.patched = 0
+    start = time.perf_counter()
+    zs, iterations = state.run(DOI, tol=0.05, **kwargs)
+    print('{:<28}{:>8.2f} s{:>6} reads{:>4} periods{:>4} patched{:>4} iterations'.format(
+            name, time.perf_counter() - start, state.reads, state.composited,
+            state.patched, iterations))
+    return zs
+
+def difference(a, b):
+    """
+    Largest z-score difference outside the planted clearings, and the 99th
+    percentile and largest difference over every pixel
+    """
+    diff = np.stack([np.abs(a[band] - b[band]) for band in a if band.endswith('_z')])
+    outside = np.nanmax(diff[:, ~cleared])
+    print('largest {:.3g} outside the clearings, {:.3g} overall, 99th percentile {:.3g}'.format(
+            outside, np.nanmax(diff), np.nanpercentile(diff, 99)))
+    return outside, np.nanpercentile(diff, 99), np.nanmax(diff)
+
+def composite_difference(a, b):
+    """
+    Largest relative difference of a state's composites from another's
+    """
+    diff = []
+    for x, y in zip(a.composites(DOI), b.composites(DOI)):
+        diff.extend(np.abs(y[band] / x[band] - 1).ravel() for band in x)
+    diff = np.concatenate(diff)
+    print('composite difference: largest {:.3g}, 99th percentile {:.3g}'.format(
+            np.nanmax(diff), np.nanpercentile(diff, 99)))
+    return np.nanmax(diff)
+
+state = incremental_local.State(tempfile.mkdtemp(), slope, aspect)
+ingest(state, history)
+timed('initial run', state)
+ingest(state, new)
+incremental = timed('incremental update', state)
+
+fresh = incremental_local.State(tempfile.mkdtemp(), slope, aspect)
+ingest(fresh, history + new)
+rebuilt = timed('rebuild', fresh)
+
+# every pixel of the periods left as they were is within the state
+# tolerance of the rebuild. The z-scores are differences of the composites
+# standardized by AOI-wide deviations, so inside the clearings, where the
+# composites change most, the same relative error is many deviations
+assert state.composited < fresh.composited
+assert composite_difference(state, fresh) <= state.index['tolerance'] + 1e-12
+print('z difference, incremental vs rebuild:', end=' ')
+outside, percentile, _ = difference(incremental, rebuilt)
+assert outside < Z_TOLERANCE
+assert percentile < Z_TOLERANCE
+
+c = state.coefficients()
+print('coefficients: median {:.3f}, C = {}'.format(np.nanmedian(c), C))
+assert abs(np.nanmedian(c) - C) < 0.01 * C
+
+refitted = timed('incremental with refit', state, refit=True)
+print('z difference, refit vs rebuild:', end=' ')
+assert max(difference(refitted, rebuilt)) == 0
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Check that clouds_local.mask_stack agrees with the reference maskTOA and
+maskSR on raw uint16 digital numbers.
+
+The bands of every scene are random uint16 DNs, so each pair of bands the
+fused kernels subtract or add appears in both orders and with sums past
+the uint16 range; an integer loop would wrap around where the reference
+does not. The same stack is also masked as float to show the two agree.
+
+Run from EEcode/Python, or with it on PYTHONPATH.
+"""
+
+import numpy as np
+import clouds_local
+
+SIZE = 300
+SCENES = 3
+
+rng = np.random.default_rng(4)
+stack = {band: rng.integers(0, 40000, (SCENES, SIZE, SIZE)).astype(np.uint16)
+         for band in clouds_local.TOA_BANDS}
+# a quarter of the pixels with each QA60 flag, and every SCL class
+stack['QA60'] = rng.choice(np.array([0, 0, 1024, 2048], dtype=np.uint16), (SCENES, SIZE, SIZE))
+stack['SCL'] = rng.integers(0, 12, (SCENES, SIZE, SIZE)).astype(np.uint16)
+# half of the scene with B8 < B11 and B3 < B11, half the other way round
+half = slice(0, SIZE // 2)
+stack['B11'][:, half] = np.maximum(stack['B8'][:, half], stack['B3'][:, half]) + 100
+stack['B11'][:, SIZE // 2:] = np.minimum(stack['B8'][:, SIZE // 2:], stack['B3'][:, SIZE // 2:]) // 2
+
+for kind, reference in [('TOA', clouds_local.maskTOA), ('SR', clouds_local.maskSR)]:
+    keep = clouds_local.mask_stack(stack, kind)
+    floats = clouds_local.mask_stack({band: arr.astype(float) for band, arr in stack.items()}, kind)
+    expected = np.stack([~np.isnan(reference({band: arr[i] for band, arr in stack.items()})['QA60'])
+                         for i in range(SCENES)])
+    mismatches = int(np.sum(keep != expected))
+    print('{}: {:.1%} kept, {} mismatches with the reference, {} with float input'.format(
+            kind, keep.mean(), mismatches, int(np.sum(keep != floats))))
+    assert mismatches == 0
+    assert np.array_equal(keep, floats)
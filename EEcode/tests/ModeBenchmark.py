@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the bounded histogram mode estimate (stats.mode_reducer and
+stats_local.mode) against the default ee.Reducer.mode on the test sites.
+
+For each site the IW change image is built as in iw.runIW. The script
+reports the runtime of each reduction and the deviation of the mode in
+z-score units, |reference - bounded| / stdDev, for the five normal bands
+centered by iw.calc_zp. Locally the reference is the mode of the sampled
+values quantized to the bucket width of the bounded estimate, which it is
+checked to be within error() of, and the deviation from a fixed width
+histogram of FINE_WIDTH standard deviations is printed alongside.
+"""
+
+import time
+import numpy as np
+import ee
+import iw
+import stats
+import stats_local
+
+ee.Initialize()
+
+SR = ee.ImageCollection("COPERNICUS/S2_SR")
+S2 = ee.ImageCollection("COPERNICUS/S2")
+
+sites = {
+    'HazardKY': ([[[-83.37017153264765, 37.48081395204879],
+                   [-83.37486536622822, 37.31933288374584],
+                   [-83.05319468739128, 37.30974497135589],
+                   [-83.05556035288436, 37.47934591201635]]], '2018-08-01'),
+    'EnterpriseNV': ([[[-115.31969349704991, 35.98044115914671],
+                       [-115.2175549777628, 35.977662882104646],
+                       [-115.2175549777628, 36.044453329376914],
+                       [-115.31677525364171, 36.04473092617846]]], '2019-06-01'),
+    'GadsenSC': ([[[-80.81991758407679, 33.88836406786576],
+                   [-80.82417447706393, 33.81222611807673],
+                   [-80.71508881286002, 33.80919082945717],
+                   [-80.72153527034902, 33.881822895147785]]], '2019-03-01'),
+    'LocoHillsNM': ([[[-104.084129, 32.786986],
+                      [-104.085503, 32.740938],
+                      [-104.011688, 32.741515],
+                      [-104.012718, 32.789728],
+                      [-104.084129, 32.786986]]], '2020-01-01')
+    }
+
+norm_bands = ['ndvi', 'ndsi', 'nbr', 'ndwi', 'rcvmax']
+# bucket width of the fixed width reference histogram, in standard
+# deviations of the band
+FINE_WIDTH = 0.01
+rgbn = ['B2', 'B3', 'B4', 'B8', 'B11', 'B12']
+
+def change_image(aoi, doi):
+    projdate = ee.Date(doi)
+    col = S2.filterBounds(aoi).select(rgbn)
+    past = col.filterDate(projdate.advance(-1, 'year'), projdate).median().clip(aoi)
+    recent = col.filterDate(projdate, projdate.advance(6, 'month')).median().clip(aoi)
+    old = iw.ND(past, 'B8', 'B4', 'B3', 'B11', 'B12')
+    now = iw.ND(recent, 'B8', 'B4', 'B3', 'B11', 'B12')
+    return iw.d(old, now, ['ndvi', 'ndsi', 'ndwi', 'nbr'])\
+    .addBands(iw.rcvmax(old, now, rgbn, aoi, 30, 6))
+
+def timed_reduce(img, reducer, aoi):
+    start = time.time()
+    out = img.reduceRegion(
+            reducer = reducer.combine(
+                    reducer2 = ee.Reducer.stdDev(),
+                    sharedInputs = True),
+            geometry = aoi,
+            scale = 30,
+            maxPixels = 1e13,
+            tileScale = 6).getInfo()
+    return out, time.time() - start
+
+def reference_mode(values, width):
+    """
+    Center of the most populated bucket of a fixed width histogram, with
+    buckets aligned on multiples of width as ee.Reducer.mode and
+    stats_local.ModeHistogram bin them. The raw values of a continuous band
+    hardly repeat, so their most frequent value says nothing of the mode
+    """
+    values = values[np.isfinite(values)]
+    keys, counts = np.unique(np.floor(values / width), return_counts=True)
+    return (keys[np.argmax(counts)] + 0.5) * width
+
+for name, (coords, doi) in sites.items():
+    aoi = ee.Geometry.Polygon(coords)
+    change = change_image(aoi, doi).select(norm_bands)
+
+    exact, t_exact = timed_reduce(change, ee.Reducer.mode(), aoi)
+    approx, t_approx = timed_reduce(change, stats.mode_reducer(), aoi)
+    print(name, 'EE runtime (s): exact {:.1f}, bounded {:.1f}'.format(t_exact, t_approx))
+    for band in norm_bands:
+        dev = abs(exact[band + '_mode'] - approx[band + '_mode']) / exact[band + '_stdDev']
+        print('   ', band, 'EE z deviation: {:.4f}'.format(dev))
+
+    # local estimate on the same change image sampled at 30m
+    props = change.reproject(ee.Projection('EPSG:3857').atScale(30))\
+    .sampleRectangle(region = aoi, defaultValue = -9999).getInfo()['properties']
+    for band in norm_bands:
+        values = np.array(props[band], dtype=float)
+        values[values == -9999] = np.nan
+        sd = np.nanstd(values)
+        start = time.time()
+        hist = stats_local.ModeHistogram()
+        hist.update(values)
+        m_approx = hist.mode()
+        t_approx = time.time() - start
+        start = time.time()
+        m_fine = reference_mode(values, FINE_WIDTH * sd)
+        t_fine = time.time() - start
+        # the same values binned at the resolution the bounded estimate
+        # ended at, whose modal bucket it must find however it coarsened
+        m_ref = reference_mode(values, hist.width)
+        print('   ', band, 'local runtime (ms): fixed width {:.1f}, bounded {:.1f}, '
+              'z deviation {:.4f} (bound {:.4f}), from the fixed width histogram {:.4f}'.format(
+                t_fine * 1e3, t_approx * 1e3, abs(m_ref - m_approx) / sd,
+                hist.error() / sd, abs(m_fine - m_approx) / sd))
+        assert abs(m_ref - m_approx) <= hist.error()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Run analyze.analyze_iw end to end without Earth Engine, on the NumPy
+stand-in in eelocal.
+
+Sentinel-2 SR scenes are synthesized from the benchmark landscape with
+planted clearings after the date of interest, alongside flat CDL, JRC and
+a hilly DEM. The script prints the per-stage instrument report, the change
+polygons found, the IW z-score statistics, the largest difference from
+iw_local run on the same composites, and the operation profile of the
+evaluated graph.
+
+Run from EEcode/Python, or with it on PYTHONPATH.
+"""
+
+import json
+import tempfile
+import numpy as np
+import eelocal
+import benchmark
+import iw_local
+
+SIZE = 200
+DOI = '2020-06-01'
+# (date, solar azimuth, solar zenith) of each synthetic scene
+SCENES = [('2019-07-01', 140.0, 25.0), ('2019-09-10', 155.0, 38.0),
+          ('2020-04-20', 150.0, 33.0), ('2020-07-05', 142.0, 24.0),
+          ('2020-08-20', 150.0, 31.0), ('2020-10-01', 160.0, 45.0)]
+
+pixel = 10 / eelocal.METERS_PER_DEGREE
+eelocal.set_grid((SIZE, SIZE), origin=(-83.2, 37.4),
+                 pixel=(pixel / np.cos(np.radians(37.4)), pixel))
+
+before, after, planted = benchmark.synthetic_scene(SIZE, tempfile.mkdtemp())
+rng = np.random.default_rng(1)
+rows, cols = np.mgrid[0:SIZE, 0:SIZE]
+shape = (SIZE, SIZE)
+
+images = []
+for date, azimuth, zenith in SCENES:
+    scene = after if date > DOI else before
+    bands = {band: 10000 * (np.asarray(arr) + rng.normal(0, 0.005, shape))
+             for band, arr in scene.items()}
+    for band in ['B1', 'B5', 'B6', 'B7', 'B8A', 'B9', 'B10']:
+        bands[band] = np.full(shape, 500.0)
+    bands['QA60'] = np.zeros(shape)
+    bands['SCL'] = np.full(shape, 4.0)
+    props = {'system:time_start': eelocal._millis(eelocal._datetime(date)),
+             'MEAN_SOLAR_AZIMUTH_ANGLE': azimuth,
+             'MEAN_SOLAR_ZENITH_ANGLE': zenith}
+    images.append((bands, props))
+
+eelocal.add_collection('COPERNICUS/S2_SR', images)
+eelocal.add_collection('COPERNICUS/S2', [])
+eelocal.add_image('USDA/NASS/CDL/2019', {'cultivated': np.ones(shape)})
+eelocal.add_image('USGS/SRTMGL1_003', {
+        'elevation': 300 + 40 * np.sin(rows / 30.0) * np.cos(cols / 45.0)})
+eelocal.add_image('JRC/GSW1_1/YearlyHistory/2018', {'waterClass': np.ones(shape)})
+eelocal.add_collection('JRC/GSW1_1/YearlyHistory', [])
+ee = eelocal.install()
+
+import analyze
+import clouds
+import dictionaries
+import instrument
+import iw
+import terrain
+
+g = eelocal.grid()
+ring = [g.corner(5, 5), g.corner(5, SIZE - 5), g.corner(SIZE - 5, SIZE - 5),
+        g.corner(SIZE - 5, 5), g.corner(5, 5)]
+aoi = ee.Feature(ee.Geometry.Polygon([ring]), {'mode': 'forest'})
+
+
+with instrument.Recorder('offline') as recorder:
+    output = analyze.analyze_iw(aoi, DOI, dictionaries.forest, 0.1, 'offline', tol=0.05)
+print(json.dumps(recorder.report(), indent=2))
+status, past_date, recent_date, polys, iwout = output
+print(status, past_date, recent_date)
+print('planted (row, col, side):', planted)
+
+for feature in polys.getInfo()['features']:
+    props = feature['properties']
+    print('polygon area {:.0f} m2, iterations {}'.format(props['area'], props['iterations']))
+
+zstats = iwout.reduceRegion(
+        reducer=ee.Reducer.mean().combine(reducer2=ee.Reducer.stdDev(), sharedInputs=True),
+        geometry=aoi.geometry()).getInfo()
+for key in sorted(zstats):
+    print(key, zstats[key])
+
+eelocal.print_profile()
+
+# the same composites through iw_local should give the same z-scores
+geometry = aoi.geometry()
+corrected = terrain.c_correct(ee.ImageCollection('COPERNICUS/S2_SR').map(clouds.maskSR),
+                              iw_local.RGBN, geometry, ee.Image('USGS/SRTMGL1_003'))
+past = corrected.filterDate('2019-06-01', DOI)
+recent = corrected.filterDate(DOI, '2020-12-01')
+ee_zs = iw.runIW(past, recent, geometry, 30, 6, 'yes', 0.05)
+
+def composite(collection):
+    bands = collection.median().clip(geometry)._eval().bands
+    return {band: bands[band] for band in iw_local.RGBN}
+
+local_zs, iterations = iw_local.runIW(composite(past), composite(recent), tol=0.05)
+print('iterations', ee_zs.get('iterations').getInfo(), iterations)
+for band, arr in ee_zs._eval().bands.items():
+    print(band, np.nanmax(np.abs(arr - local_zs[band])))
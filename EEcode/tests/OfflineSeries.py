@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Compare analyze.analyze_series with one analyze.analyze_iw call per date
+of interest, without Earth Engine, on the NumPy stand-in in eelocal.
+
+Monthly Sentinel-2 SR scenes are synthesized from the benchmark landscape,
+with planted clearings from CHANGE on. The script prints, for both ways of
+running the series, the seconds taken, the pixel values reduced by median
+composites and by terrain correction regressions, and the change polygons
+found on each date.
+
+Run from EEcode/Python, or with it on PYTHONPATH.
+"""
+
+import tempfile
+import time
+import numpy as np
+import eelocal
+import benchmark
+
+SIZE = 120
+START = '2020-04-01'
+STEPS = 4
+CHANGE = '2020-06-15'
+
+pixel = 10 / eelocal.METERS_PER_DEGREE
+eelocal.set_grid((SIZE, SIZE), origin=(-83.2, 37.4),
+                 pixel=(pixel / np.cos(np.radians(37.4)), pixel))
+
+before, after, planted = benchmark.synthetic_scene(SIZE, tempfile.mkdtemp())
+rng = np.random.default_rng(1)
+rows, cols = np.mgrid[0:SIZE, 0:SIZE]
+shape = (SIZE, SIZE)
+
+images = []
+for year, month in [(2019 + (m - 1) // 12, (m - 1) % 12 + 1) for m in range(4, 28)]:
+    date = '{}-{:02d}-10'.format(year, month)
+    scene = after if date > CHANGE else before
+    bands = {band: 10000 * (np.asarray(arr) + rng.normal(0, 0.005, shape))
+             for band, arr in scene.items()}
+    for band in ['B1', 'B5', 'B6', 'B7', 'B8A', 'B9', 'B10']:
+        bands[band] = np.full(shape, 500.0)
+    bands['QA60'] = np.zeros(shape)
+    bands['SCL'] = np.full(shape, 4.0)
+    props = {'system:time_start': eelocal._millis(eelocal._datetime(date)),
+             'MEAN_SOLAR_AZIMUTH_ANGLE': 150.0 + 10 * np.cos(np.pi * month / 6),
+             'MEAN_SOLAR_ZENITH_ANGLE': 35.0 + 12 * np.cos(np.pi * month / 6)}
+    images.append((bands, props))
+
+eelocal.add_collection('COPERNICUS/S2_SR', images)
+eelocal.add_collection('COPERNICUS/S2', [])
+eelocal.add_image('USDA/NASS/CDL/2019', {'cultivated': np.ones(shape)})
+eelocal.add_image('USGS/SRTMGL1_003', {
+        'elevation': 300 + 40 * np.sin(rows / 30.0) * np.cos(cols / 45.0)})
+eelocal.add_image('JRC/GSW1_1/YearlyHistory/2018', {'waterClass': np.ones(shape)})
+eelocal.add_collection('JRC/GSW1_1/YearlyHistory', [])
+ee = eelocal.install()
+
+import analyze
+import dictionaries
+
+g = eelocal.grid()
+ring = [g.corner(5, 5), g.corner(5, SIZE - 5), g.corner(SIZE - 5, SIZE - 5),
+        g.corner(SIZE - 5, 5), g.corner(5, 5)]
+aoi = ee.Feature(ee.Geometry.Polygon([ring]), {'mode': 'forest'})
+print('planted (row, col, side):', planted)
+
+def report(name, seconds, outputs):
+    pixels = eelocal.profile()['pixels']
+    print('{}: {:.1f} s, {} values composited, {} regressed'.format(
+            name, seconds, pixels.get('Reducer.median', 0),
+            pixels.get('Reducer.linearRegression', 0)))
+    for doi, status, past_date, recent_date, polys, iwout in outputs:
+        areas = [ft['properties']['area'] for ft in polys.getInfo()['features']] if polys else []
+        print('  {} {} {} {} polygons {}'.format(doi, status, past_date, recent_date,
+                                                 ' '.join('{:.0f}'.format(a) for a in areas)))
+
+eelocal.reset_profile()
+start = time.perf_counter()
+outputs = []
+for k in range(STEPS):
+    doi = ee.Date(START).advance(k, 'month')
+    output = analyze.analyze_iw(aoi, doi, dictionaries.forest, 0.1, 'offline', tol=0.05)
+    outputs.append((str(doi.format('YYYY-MM-dd').getInfo())[:10],) + tuple(output))
+    output[3].getInfo()
+report('analyze_iw per date', time.perf_counter() - start, outputs)
+
+eelocal.reset_profile()
+start = time.perf_counter()
+outputs = analyze.analyze_series(aoi, START, STEPS, dictionaries.forest, 0.1, 'offline', tol=0.05)
+for output in outputs:
+    if output[4] is not None:
+        output[4].getInfo()
+report('analyze_series', time.perf_counter() - start, outputs)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Check eelocal's Image.reduceToVectors on nested components.
+
+A 24 pixel ring encloses a single pixel of the same value, so the bounding
+box of the ring also holds the inner component. Each must come back as
+its own feature, with its own pixels, and getInfo() must return plain
+Python floats for the coordinates.
+
+Run from EEcode/Python, or with it on PYTHONPATH.
+"""
+
+import numpy as np
+import eelocal
+
+eelocal.set_grid((11, 11))
+band = np.full((11, 11), np.nan)
+band[2:9, 2:9] = 1
+band[3:8, 3:8] = np.nan
+band[5, 5] = 1
+eelocal.add_image('nested', {'label': band})
+ee = eelocal.install()
+
+info = ee.Image('nested').reduceToVectors().getInfo()
+# pixels of each feature, summed over its rectangles, one per run of pixels
+pixels = []
+for feature in info['features']:
+    widths = [(polygon[0][2][0] - polygon[0][0][0]) / eelocal.grid().pixel[0]
+              for polygon in feature['geometry']['coordinates']]
+    pixels.append(int(round(sum(widths))))
+print('features:', len(info['features']), 'pixels:', sorted(pixels))
+assert sorted(pixels) == [1, 24], pixels
+
+coordinate = info['features'][0]['geometry']['coordinates'][0][0][0][0]
+print('coordinate type:', type(coordinate).__name__)
+assert type(coordinate) is float